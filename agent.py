@@ -1,18 +1,20 @@
 from time import sleep
 from typing import Any
-import torch
 from loguru import logger
 from langgraph.graph import StateGraph, START, END
 from langgraph.prebuilt import ToolNode
-from langchain_core.messages import RemoveMessage
+from langchain_core.messages import RemoveMessage, ToolMessage
 from langgraph.errors import GraphRecursionError
-from pyautogui import screenshot, hotkey
+from pyautogui import hotkey
 
 from nodes.graph_state import CombatState, AgentConfig
 from nodes.vlm_node import VLMNode
 from nodes.llm_node import LLMNode
 from nodes.get_player_strengths import GetPlayerStrengthsNode
 from tools.controller import Controller
+from tools.capture import CaptureBackend, make_capture
+from tools.waiter import ChangeWaiter
+from vision.screen_state import ScreenState, get_screen_state
 
 
 # AGENT
@@ -20,11 +22,20 @@ class Kuro2CombatAgent:
     """Kuro 2 turn-based combat agent."""
     reasoner_system_prompt: str = ""
 
-    def __init__(self):
-        self.controller = Controller()
-        self.stat_updater = VLMNode(self.controller)
+    def __init__(self, capture: CaptureBackend | None = None, vlm_server: str | None = None, vlm_worker: bool = False):
+        """
+        Args:
+            capture (CaptureBackend | None, optional): screen capture backend. Defaults to None - pyautogui.
+            vlm_server (str | None, optional): address of shared VLM server, see `nodes.vlm_server`.
+                Defaults to None - load VLM in-process.
+            vlm_worker (bool, optional): load VLM in a dedicated worker process, see `nodes.vlm_worker`.
+                Inference doesn't block the controller, and a crash of the model doesn't take the agent down. Defaults to False.
+        """
+        self.controller = Controller(capture)
+        self.stat_updater = VLMNode(self.controller, vlm_server, vlm_worker)
         self.reasoner = LLMNode(self.controller)
-        self.get_player_strengths = GetPlayerStrengthsNode(self.stat_updater.vlm, self.controller)
+        self.get_player_strengths = GetPlayerStrengthsNode(self.stat_updater.vlm, self.controller, self.stat_updater.digits)
+        self.turn_waiter: ChangeWaiter | None = None
 
         logger.warning("Building graph")
         self.graph = StateGraph(state_schema=CombatState, config_schema=AgentConfig)
@@ -36,7 +47,13 @@ class Kuro2CombatAgent:
         self.graph.add_sequence(
             [
                 ("get_player_strengths", self.get_player_strengths),
-                ("wait_for_agent_turn", self._wait_for_agent_turn),
+                ("wait_for_agent_turn", self._wait_for_agent_turn)
+            ]
+        )
+        # Timeout - check the screen again instead of acting on it
+        self.graph.add_conditional_edges("wait_for_agent_turn", self._is_agent_turn, ["stat_updater", "forget_turn_reasoning"])
+        self.graph.add_sequence(
+            [
                 ("stat_updater", self.stat_updater),
                 ("reasoner", self.reasoner),
                 ("reasoner_command", ToolNode(tools=self.controller.get_tools())), # TODO: Uncomment
@@ -44,11 +61,23 @@ class Kuro2CombatAgent:
                 ("forget_turn_reasoning", self._forget_turn_reasoning)
             ]
         )
-        self.graph.add_conditional_edges("forget_turn_reasoning", self._is_combat_over, [END, "wait_for_agent_turn"])
+        self.graph.add_conditional_edges("forget_turn_reasoning", self._is_combat_over, [END, "wait_for_agent_turn", "get_player_strengths"])
         self.graph = self.graph.compile()
         self.graph.get_graph().draw_png("agent_graph.png")
         logger.warning("Graph has been built")
 
+    def _screen_state(self, config: AgentConfig) -> ScreenState:
+        """Classify the latest frame by pixel signatures, or with a single VLM query if none matched."""
+        state, confidence = get_screen_state(
+            self.controller.frames.get(), self.stat_updater.vlm,
+            turn_order_origin=config["configurable"]["game_turn_order_region_origin"],
+            turn_order_size=config["configurable"]["game_turn_order_region_crop_size"],
+            enemy_color=config["configurable"]["game_turn_order_enemy_shade_rgb"],
+            enemy_max_distance=config["configurable"]["game_turn_order_enemy_max_distance"]
+        )
+        logger.debug(f"Screen state: {state.value} ({confidence:.3f})")
+        return state
+
     def _is_combat_over(self, state: CombatState, config: Any) -> str:
         """Checks if combat is over. Does not modify agent's state.
 
@@ -57,68 +86,70 @@ class Kuro2CombatAgent:
             END if combat is over.
         """
         logger.debug("---CHECK IF COMBAT IS OVER---")
-        # Seed = 1643; temperature = 0.7; max_tokens = 512
-        seed = config["configurable"]["seed_vlm"]
-        torch.manual_seed(seed)
-        path_to_screenshot = config["configurable"]["path_to_screenshot"]
-
-        # 1. If word "RESULTS" on screen, then it's a win - combat over
-        prompt_test_win = """Is there word "RESULTS" on screen? Give only binary answer - yes or no."""
-        test_win = self.stat_updater.vlm(text=prompt_test_win, image=path_to_screenshot)[0].replace(".", "").lower()
-        if test_win == "yes":
-            return END
-        
-        # 2. If menu with word "Retry" is on screen, then it's a loss - combat over
-        prompt_test_loss = """Is there menu with item "Retry" on screen? Give only binary answer - yes or no."""
-        test_loss = self.stat_updater.vlm(text=prompt_test_loss, image=path_to_screenshot)[0].replace(".", "").lower()
-        if test_loss == "yes":
+        self.controller.screenshot(self.controller.debug_frame_path(config))
+        screen_state = self._screen_state(config)
+
+        # 1. RESULTS panel is a win, GAME OVER menu with "Retry" is a loss - combat over
+        if screen_state in (ScreenState.VICTORY, ScreenState.DEFEAT):
             return END
 
-        # 3. Check if ATB-scale is on top of the screen
-        prompt_test_atb = """Is character's turn order at the top of the screen is present? Ignore character portraits on the left. Give only binary answer - yes or no."""
-        test_atb_result = self.stat_updater.vlm(text=prompt_test_atb, image=path_to_screenshot)[0].replace(".", "").lower()
-        test_atb_result = test_atb_result == "yes"
-        # 4. Check if HP, EP, CP of characters are on screen
-        # More reliable method
-        prompt_test_hpepcp = """Are character's HP,EP,CP values on screen? Ignore character portraits on top. Give only binary answer - yes or no."""
-        test_hpepcp = self.stat_updater.vlm(text=prompt_test_hpepcp, image=path_to_screenshot)[0].replace(".", "").lower()
-        test_hpepcp = test_hpepcp == "yes"
-        # 5. If at least one of these criteria isn't met, then it's out of combat situation
-        if (test_atb_result or test_hpepcp):
+        # 2. Turn order, command menu, or combat sub-menu are on screen - combat is going on
+        if screen_state in (ScreenState.PLAYER_TURN, ScreenState.ENEMY_TURN, ScreenState.MENU):
             return "wait_for_agent_turn"
 
-        # Default route
+        # Default route - out of combat
         return "get_player_strengths"
     
     def _wait_for_agent_turn(self, state: CombatState, config: AgentConfig) -> CombatState:
         """Wait until it is agent's (player) turn. Does not modify agent's state.
 
+        Only command-menu region is sampled while waiting. Screen is classified when the region settles after a change.
+
         Returns:
-            "stat_updater"
+            "stat_updater", or "forget_turn_reasoning" on timeout. See `_is_agent_turn`
         """
         logger.debug("---WAIT FOR AGENT TURN---")
-        seed = config["configurable"]["seed_vlm"]
-        path_to_screenshot = config["configurable"]["path_to_screenshot"]
-        timeout_sec = config["configurable"]["timeout_screenshot_sec"]
-
-        while True: # TODO: Uncomment when it's ready for game
-        # for i in range(5): # TODO: DEBUG: Imitate actual work
-            # 1. Check if UI controls are on screen
-            screenshot(path_to_screenshot) # TODO: Uncomment when it's ready for game
-            torch.manual_seed(seed)
-            prompt_test_ui_enabled = """Are there menu items "Attack" and "Defend" on screen? Give only binary answer - yes or no."""
-            test_ui_enabled = self.stat_updater.vlm(text=prompt_test_ui_enabled, image=path_to_screenshot)[0].replace(".", "").lower()
-            # 2. If UI controls are present, then it's agent's turn
-            if test_ui_enabled == "yes":
-                return state
-            
-            # 3. Otherwise, wait
-            sleep(timeout_sec)
-        
+        debug_frame_path = self.controller.debug_frame_path(config)
+
+        if self.turn_waiter is None:
+            region = config["configurable"]["wait_region_origin"] + config["configurable"]["wait_region_size"]
+            self.turn_waiter = ChangeWaiter(
+                grab=lambda: self.controller.capture.grab(region),
+                min_interval=config["configurable"]["wait_poll_min_sec"],
+                max_interval=config["configurable"]["timeout_screenshot_sec"],
+                backoff=config["configurable"]["wait_poll_backoff"],
+                change_threshold=config["configurable"]["wait_change_threshold"],
+                settle_threshold=config["configurable"]["wait_settle_threshold"],
+                settle_samples=config["configurable"]["wait_settle_samples"],
+                timeout=config["configurable"]["wait_timeout_sec"]
+            )
+
+        def is_agent_turn() -> bool:
+            # Command menu with "Attack" and "Defend" is on screen. The frame is reused by stat updater
+            self.controller.screenshot(debug_frame_path)
+            return self._screen_state(config) == ScreenState.PLAYER_TURN
+
+        if not self.turn_waiter.wait(is_agent_turn):
+            logger.error(f"Agent's turn hasn't come in {self.turn_waiter.timeout}s")
+        logger.debug(f"Turn waiter: {self.turn_waiter.stats()}")
         return state
+
+    def _is_agent_turn(self, state: CombatState) -> str:
+        """Checks if the last wait for agent's turn has succeeded. Does not modify agent's state.
+
+        Returns:
+            "stat_updater" if it is agent's turn.
+            "forget_turn_reasoning" on timeout - the screen is classified again, see `_is_combat_over`.
+        """
+        if self.turn_waiter is not None and self.turn_waiter.last.get("ready"):
+            return "stat_updater"
+        return "forget_turn_reasoning"
     
     def _forget_turn_reasoning(self, state: CombatState) -> CombatState:
         logger.debug("---FORGET TURN REASONING---")
+        # Decision that has failed isn't replayed
+        if any(isinstance(x, ToolMessage) and x.status == "error" for x in state["messages"]):
+            self.reasoner.forget_decision()
         return CombatState(
             messages = [RemoveMessage(x.id) for x in state["messages"]],
             turn_state=state["turn_state"]
@@ -132,7 +163,11 @@ if __name__ == '__main__':
     
     logger.add("logs//ttd2_combat_agent_{time}.log")
 
-    agent = Kuro2CombatAgent()
+    # Linux: make_capture("x11") grabs straight from X server, incl. headless Xvfb.
+    # make_capture("replay", replay="imgs/debug/combat-*.png") replays debug screenshots
+    # Several agents share a single copy of VLM with vlm_server="127.0.0.1:8091", see `python -m nodes.vlm_server`.
+    # vlm_worker=True runs VLM in a worker process of this agent
+    agent = Kuro2CombatAgent(make_capture("pyautogui"))
     
     try:
         # TODO: Timeout before game has started
@@ -173,15 +208,38 @@ if __name__ == '__main__':
                                     # "path_to_screenshot": "imgs\\combat-pc-turn1-3-enemy_stats.png",
                                     # "path_to_screenshot": "imgs\\combat-pc-turn1-2.png",
                                     "path_to_screenshot": r"imgs/screenshot.png",
-                                    "timeout_screenshot_sec": 2.5,
+                                    "timeout_screenshot_sec": 0.5,
+                                    "wait_region_origin": (0, 640),
+                                    "wait_region_size": (720, 400),
+                                    "wait_poll_min_sec": 0.05,
+                                    "wait_poll_backoff": 1.5,
+                                    "wait_change_threshold": 8.0,
+                                    "wait_settle_threshold": 2.0,
+                                    "wait_settle_samples": 3,
+                                    "wait_timeout_sec": 300.0,
+                                    "vlm_batch_profiling": True,
+                                    "pipelined_profiling": True,
+                                    "profiling_queue_size": 2,
+                                    "target_settle_sec": 0.2,
+                                    "digit_reader": True,
+                                    "digit_reader_min_confidence": 0.3,
+                                    "ailment_classifier": True,
+                                    "ailment_classifier_min_confidence": 0.5,
+                                    "reach_detector": False,
+                                    "reach_detector_min_confidence": 0.6,
+                                    "incremental_profiling": True,
+                                    "enemy_panel_min_changed_pixels": 24,
+                                    "bestiary": True,
+                                    "bestiary_path": "data/bestiary.sqlite",
+                                    "bestiary_tolerance": 32,
                                     "game_turn_order_region_origin": (660, 45),
                                     "game_turn_order_region_crop_size": (900, 140),
                                     "game_turn_order_enemy_shade_rgb": (219, 0, 72),
                                     "game_turn_order_enemy_max_distance": 10,
-                                    "enemy_stat_hp_origin": (1566,284),
-                                    "enemy_stat_hp_size": (200,28),
-                                    "enemy_stat_stun_origin": (1566, 320),
-                                    "enemy_stat_stun_size": (60,30),
+                                    "enemy_stat_hp_origin": (1552,284),
+                                    "enemy_stat_hp_size": (214,28),
+                                    "enemy_stat_stun_origin": (1553, 320),
+                                    "enemy_stat_stun_size": (73,30),
                                     "enemy_stat_atk_ats_speed_origin": (1566,382),
                                     "enemy_stat_atk_ats_speed_size": (50,102),
                                     "enemy_stat_def_adf_origin": (1704,382),
@@ -194,6 +252,10 @@ if __name__ == '__main__':
                                     "enemy_stat_ailments_left_size": (40, 174),
                                     "enemy_stat_ailments_right_origin": (1750, 700),
                                     "enemy_stat_ailments_right_size": (40, 174),
+                                    "enemy_reach_region_origin": (760, 230),
+                                    "enemy_reach_region_size": (400, 420),
+                                    "enemy_name_plate_origin": (1455, 242),
+                                    "enemy_name_plate_size": (300, 36),
                                     "enemy_target_detect_origin_delta": (20, 0),
                                     "enemy_target_detect_size": 10,
                                     "character_strength_origin": [(90, 108), (90, 208), (90, 308), (90, 408)], # 1st, 2nd, 3rd, 4th
@@ -214,7 +276,20 @@ Arts consume EP but have delayed execution before yielding high damage, buff all
 Units with high physical strength usually excel at using crafts, while units with high maximum EP and arts damage are better suited for using arts. 
 Basic attacks are available to everyone. You must give the order to active character based of the current turn context.""",
                                     "reasoner_nothink_prompt": True,#False, # TODO: Set to True to speed up the process of decision making. May end up in an endless loop
+                                    "reasoner_cache_prompt": True,
+                                    "reasoner_slot": 0,
+                                    "reasoner_context_format": "table",
+                                    "reasoner_dynamic_tools": True,
+                                    "reasoner_fast_path": True,
+                                    "reasoner_fast_path_min_confidence": 0.8,
+                                    "reasoner_fast_path_finish_hp_ratio": 0.1,
+                                    "reasoner_decision_cache": True,
+                                    "reasoner_decision_cache_path": "data/decisions.sqlite",
+                                    "reasoner_decision_cache_size": 4096,
+                                    "reasoner_decision_cache_explore_rate": 0.1,
+                                    "reasoner_decision_cache_hp_buckets": 4,
                                     "debug_reasoner_off" : False, # TODO: Set to False when ready to deploy
+                                    "debug_save_frames": False, # True - write every captured frame to `path_to_screenshot`
                                     "tool_controller" : agent.controller,
                                     "tool_vlm": agent.stat_updater
                                }
@@ -0,0 +1,60 @@
+"""Screen capture backends: full-frame vs region-of-interest grabs per second.
+
+Regions are the ones the agent grabs: whole 1920x1080 screen, 900x140 turn-order strip, 720x400 command-menu region
+sampled while waiting for agent's turn, and 10x10 selection square.
+Backends that can't start here (no X display, no pyautogui) are skipped. To try X11 backend headless:
+    Xvfb :99 -screen 0 1920x1080x24 & DISPLAY=:99 python -m benchmarks.bench_capture
+
+Run from repository root: python -m benchmarks.bench_capture [seconds per measurement]
+"""
+import sys
+from time import perf_counter
+
+from tools.capture import CaptureBackend, PyAutoGUICapture, ReplayCapture, X11ShmCapture
+
+
+REGIONS: dict[str, tuple[int, int, int, int] | None] = {
+    "full frame 1920x1080": None,
+    "turn order 900x140": (660, 45, 900, 140),
+    "command menu 720x400": (0, 640, 720, 400),
+    "selection square 10x10": (1100, 100, 10, 10),
+}
+
+
+def grabs_per_second(backend: CaptureBackend, region: tuple[int, int, int, int] | None, duration: float) -> float:
+    backend.grab(region)
+    n, t_start = 0, perf_counter()
+    while (elapsed := perf_counter() - t_start) < duration:
+        backend.grab(region)
+        n += 1
+    return n / elapsed
+
+
+def main() -> None:
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 1.0
+    backends = {
+        "replay": lambda: ReplayCapture("imgs/debug/combat-*.png"),
+        "x11": X11ShmCapture,
+        "pyautogui": PyAutoGUICapture,
+    }
+    for name, make in backends.items():
+        try:
+            backend = make()
+        except Exception as e:
+            print(f"{name}: skipped ({type(e).__name__}: {e})")
+            continue
+        try:
+            # Screen of X server may be smaller than 1920x1080
+            width, height = getattr(backend, "width", 1920), getattr(backend, "height", 1080)
+            for region_name, region in REGIONS.items():
+                if region is not None and (region[0] + region[2] > width or region[1] + region[3] > height):
+                    print(f"{name:>9} | {region_name:<24} | out of {width}x{height} screen")
+                    continue
+                rate = grabs_per_second(backend, region, duration)
+                print(f"{name:>9} | {region_name:<24} | {rate:9.1f} grabs/s | {1e3 / rate:8.3f} ms/grab")
+        finally:
+            backend.close()
+
+
+if __name__ == "__main__":
+    main()
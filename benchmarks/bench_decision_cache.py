@@ -0,0 +1,88 @@
+"""Decision cache: hit rate, exploration, and turn latency over repeated synthetic encounters, and after restart.
+
+The same few enemy formations are met again and again, like grinding in the game. Combat is played out on `TurnState`
+alone, see `bench_fast_path`. The reasoner isn't called: it attacks the weakest enemy, or uses a craft when no enemy is
+within reach, and picks another target 10% of the time. Its turn latency is drawn around `REASONER_MEDIAN` seconds.
+Lookups in the cache - fingerprint, and SQLite bookkeeping - are timed for real.
+
+Run from repository root: python -m benchmarks.bench_decision_cache [n_combats]
+"""
+import os
+import sys
+import tempfile
+from time import perf_counter
+import numpy as np
+
+from nodes.decision_cache import DecisionCache, fingerprint
+from state.enemy_stat import EnemyStat
+from state.player_stat import PlayerCharacterStat
+
+
+REASONER_MEDIAN = 2.5
+REASONER_SIGMA = 0.35
+# Enemy formations: (number of enemies, weak element, enemies within reach)
+FORMATIONS = [(1, "fire", 1), (2, "wind", 2), (3, "earth", 1), (3, "water", 3), (4, "time", 2)]
+
+
+def reasoner(turn_state: dict, rng: np.random.Generator) -> tuple[str, dict]:
+    enemies = turn_state["enemies"]
+    if rng.random() < 0.1:
+        return "action_use_craft", {"enemy_id": enemies[int(rng.integers(len(enemies)))].enemy_id}
+    in_reach = [enemy for enemy in enemies if enemy.basic_attack_enabled]
+    if not in_reach:
+        return "action_use_craft", {"enemy_id": min(enemies, key=lambda enemy: enemy.hp).enemy_id}
+    return "action_attack", {"enemy_id": min(in_reach, key=lambda enemy: enemy.hp).enemy_id}
+
+
+def combat(cache: DecisionCache | None, rng: np.random.Generator, latencies: list[float], hp_buckets: int) -> None:
+    n_enemies, element, n_in_reach = FORMATIONS[int(rng.integers(len(FORMATIONS)))]
+    characters = [PlayerCharacterStat(character_id=i, hp=3000, hp_max=3000, ep=300, ep_max=300, cp=40) for i in range(4)]
+    enemies = [EnemyStat(enemy_id=i, hp=9000, hp_max=9000, attack=1, defense=1, arts_attack=1, arts_defense=1, speed=1,
+                         basic_attack_enabled=i < n_in_reach, **{f"weakness_{element}": 150}) for i in range(n_enemies)]
+    turn = 0
+    while enemies:
+        for character in characters:
+            character.is_active = character.character_id == turn % 4
+            character.hp = max(1, character.hp - int(rng.integers(0, 300)))
+        turn_state = {"player_characters": characters, "enemies": enemies}
+
+        t0 = perf_counter()
+        key = fingerprint(turn_state, hp_buckets=hp_buckets) if cache is not None else None
+        decision = cache.get(key) if cache is not None else None
+        if decision is None:
+            decision = reasoner(turn_state, rng)
+            if cache is not None:
+                cache.put(key, *decision)
+            latencies.append(perf_counter() - t0 + rng.lognormal(np.log(REASONER_MEDIAN), REASONER_SIGMA))
+        else:
+            latencies.append(perf_counter() - t0)
+
+        enemy = next(enemy for enemy in enemies if enemy.enemy_id == decision[1]["enemy_id"])
+        enemy.hp = max(0, enemy.hp - int(rng.integers(1500, 3500)))
+        if rng.random() < 0.15:
+            characters[int(rng.integers(4))].hp = 3000
+        enemies = [enemy for enemy in enemies if enemy.hp > 0]
+        turn += 1
+
+
+def main(n_combats: int = 300) -> None:
+    print(f"{'setup':<28} | {'turns':>5} | {'hit rate':>8} | {'explored':>8} | {'agree':>5} | {'size':>5} | {'p50':>6} | {'p90':>6} | {'mean':>6}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, hp_buckets, max_size, explore_rate in (("no cache", 4, 0, 0.0), ("4 HP buckets", 4, 4096, 0.1),
+                                                         ("4 HP buckets, no explore", 4, 4096, 0.0), ("8 HP buckets", 8, 4096, 0.1),
+                                                         ("4 HP buckets, 256 entries", 4, 256, 0.1), ("restart", 4, 4096, 0.1)):
+            path = os.path.join(tmp, "restart.sqlite" if name in ("4 HP buckets", "restart") else f"{name}.sqlite")
+            cache = DecisionCache(path, max_size, explore_rate, seed=1741) if max_size else None
+            rng = np.random.default_rng(1643)
+            latencies = []
+            for _ in range(n_combats if name != "restart" else n_combats // 10):
+                combat(cache, rng, latencies, hp_buckets)
+            stats = cache.stats() if cache is not None else {"hit_rate": 0.0, "explored": 0, "agreement": 0.0, "size": 0}
+            print(f"{name:<28} | {len(latencies):>5} | {stats['hit_rate']:>8.1%} | {stats['explored']:>8} | {stats['agreement']:>5.0%} | "
+                  f"{stats['size']:>5} | {np.percentile(latencies, 50):>5.2f}s | {np.percentile(latencies, 90):>5.2f}s | {np.mean(latencies):>5.2f}s")
+            if cache is not None:
+                cache.db.close()
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:2]])
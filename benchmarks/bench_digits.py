@@ -0,0 +1,71 @@
+"""Glyph-template digit reader: accuracy and latency on labelled crops of debug screenshots.
+
+Accuracy is measured twice:
+- with shipped templates, calibrated on all labelled crops;
+- leave-one-screenshot-out: templates are calibrated without the screenshot under test.
+
+Run from repository root: python -m benchmarks.bench_digits
+"""
+import re
+from collections import defaultdict
+from timeit import repeat
+
+from vision.digits import DigitReader, load_frame, load_samples
+from vision.turn_order import crop
+
+
+ROOT = "imgs/debug"
+
+
+def expected_numbers(text: str) -> list[int]:
+    return [int(number) for number in re.findall(r"\d+", text)]
+
+
+def evaluate(reader: DigitReader, samples: list[dict], min_confidence: float) -> dict[str, list[tuple[bool, float]]]:
+    """Read every sample. Returns panel -> [(correct, confidence)]"""
+    results = defaultdict(list)
+    for sample in samples:
+        region = crop(load_frame(f"{ROOT}/{sample['screenshot']}"), sample["origin"], sample["size"])
+        numbers, confidence = reader(region, sample["panel"])
+        results[sample["panel"]].append((numbers == expected_numbers(sample["text"]), confidence))
+    return results
+
+
+def report(title: str, results: dict[str, list[tuple[bool, float]]], min_confidence: float) -> None:
+    print(title)
+    print(f"{'panel':<18} {'crops':>6} {'accuracy':>9} {'accepted':>9} {'accepted accuracy':>18}")
+    for panel, rows in results.items():
+        accepted = [correct for correct, confidence in rows if confidence >= min_confidence]
+        accuracy = sum(correct for correct, _ in rows) / len(rows)
+        accepted_accuracy = sum(accepted) / len(accepted) if accepted else float("nan")
+        print(f"{panel:<18} {len(rows):>6} {accuracy:>9.1%} {len(accepted) / len(rows):>9.1%} {accepted_accuracy:>18.1%}")
+    print()
+
+
+def main(min_confidence: float = 0.3) -> None:
+    samples = load_samples(f"{ROOT}/digits.json")
+    reader = DigitReader()
+
+    report("Shipped templates", evaluate(reader, samples, min_confidence), min_confidence)
+
+    held_out = defaultdict(list)
+    for screenshot in sorted({sample["screenshot"] for sample in samples}):
+        train = [sample for sample in samples if sample["screenshot"] != screenshot]
+        test = [sample for sample in samples if sample["screenshot"] == screenshot]
+        for panel, rows in evaluate(DigitReader.calibrate(train, ROOT), test, min_confidence).items():
+            held_out[panel] += rows
+    report("Leave-one-screenshot-out", held_out, min_confidence)
+
+    print(f"{'panel':<18} {'crop':>10} {'us/read':>8}")
+    seen = set()
+    for sample in samples:
+        if sample["panel"] in seen:
+            continue
+        seen.add(sample["panel"])
+        region = crop(load_frame(f"{ROOT}/{sample['screenshot']}"), sample["origin"], sample["size"])
+        t = min(repeat(lambda: reader(region, sample["panel"]), number=200, repeat=5)) / 200
+        print(f"{sample['panel']:<18} {region.shape[1]:>4}x{region.shape[0]:<5} {t * 1e6:>8.0f}")
+
+
+if __name__ == "__main__":
+    main()
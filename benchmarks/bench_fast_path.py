@@ -0,0 +1,75 @@
+"""Fast-path policy: how often rules bypass the reasoner, and turn latency distribution over synthetic combats.
+
+Combats are played out on `TurnState` alone: every turn the active character hits an enemy for 5-30% of its max HP,
+spends EP or CP, enemies move in and out of reach, and dead enemies leave. Rules are timed for real.
+The reasoner isn't called - its turn latency is drawn from a log-normal distribution around `REASONER_MEDIAN` seconds,
+put the p50 of your llama-server from `bench_reasoner_prefix` there.
+
+Requires langchain. Run from repository root: python -m benchmarks.bench_fast_path [n_combats]
+"""
+import sys
+from time import perf_counter
+import numpy as np
+
+from nodes.fast_path import FastPathPolicy
+from state.enemy_stat import EnemyStat
+from state.player_stat import PlayerCharacterStat
+from tools.controller import Controller
+
+
+REASONER_MEDIAN = 2.5
+REASONER_SIGMA = 0.35
+
+
+def combat(policy: FastPathPolicy, controller: Controller, rng: np.random.Generator) -> None:
+    characters = [PlayerCharacterStat(character_id=i, hp=3000, hp_max=3000, ep=300, ep_max=300, cp=int(rng.integers(0, 120)))
+                  for i in range(4)]
+    enemies = [EnemyStat(enemy_id=i, hp=12000, hp_max=12000, attack=1, defense=1, arts_attack=1, arts_defense=1, speed=1,
+                         basic_attack_enabled=bool(rng.random() < 0.6)) for i in range(int(rng.integers(1, 6)))]
+    turn = 0
+    while enemies:
+        for character in characters:
+            character.is_active = character.character_id == turn % 4
+            character.hp = max(1, character.hp - int(rng.integers(0, 500)))
+        for enemy in enemies:
+            if rng.random() < 0.2:
+                enemy.basic_attack_enabled = not enemy.basic_attack_enabled
+        turn_state = {"player_characters": characters, "enemies": enemies}
+        active = characters[turn % 4]
+
+        t0 = perf_counter()
+        decision = policy.decide(turn_state, {t.name for t in controller.get_legal_tools(turn_state)})
+        if decision is not None:
+            policy.record("rule", perf_counter() - t0)
+            target = decision[1][1].get("enemy_id", enemies[0].enemy_id)
+        else:
+            policy.record("reasoner", perf_counter() - t0 + rng.lognormal(np.log(REASONER_MEDIAN), REASONER_SIGMA))
+            target = enemies[int(rng.integers(len(enemies)))].enemy_id
+
+        # Play the turn out
+        enemy = next(enemy for enemy in enemies if enemy.enemy_id == target)
+        enemy.hp = max(0, enemy.hp - int(enemy.hp_max * rng.uniform(0.05, 0.3)))
+        active.ep = max(0, active.ep - int(rng.integers(0, 60)))
+        active.cp = min(200, max(0, active.cp + int(rng.integers(-30, 25))))
+        if rng.random() < 0.1:
+            characters[int(rng.integers(4))].hp = 3000
+        enemies = [enemy for enemy in enemies if enemy.hp > 0]
+        turn += 1
+
+
+def main(n_combats: int = 500) -> None:
+    controller = Controller.__new__(Controller)  # no screen capture needed
+    print(f"{'min_confidence':>14} | {'turns':>5} | {'bypass':>6} | {'rule p50':>9} | {'turn p50':>8} | {'turn p90':>8} | {'turn p99':>8} | {'mean':>6}")
+    for min_confidence in (1.01, 0.9, 0.8, 0.6):
+        policy = FastPathPolicy(min_confidence=min_confidence)
+        rng = np.random.default_rng(1741)
+        for _ in range(n_combats):
+            combat(policy, controller, rng)
+        stats = policy.stats()
+        mean = np.mean(policy.latencies["rule"] + policy.latencies["reasoner"])
+        print(f"{min_confidence:>14} | {stats['turns']:>5} | {stats['bypass_rate']:>6.1%} | {1e6 * stats['rule_p50']:>7.1f}us | "
+              f"{stats['turn_p50']:>7.2f}s | {stats['turn_p90']:>7.2f}s | {stats['turn_p99']:>7.2f}s | {mean:>5.2f}s")
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:2]])
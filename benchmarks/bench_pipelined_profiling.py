@@ -0,0 +1,79 @@
+"""Enemy profiling: wall-clock time of sequential vs pipelined target cycling, see `VLMNode._get_enemy_strength`.
+
+Runs the real cycling loop against a simulated controller - no game, and no GPU needed: every capture
+takes `CAPTURE` seconds in total (screenshot, target change, and the wait for the panel to settle),
+and profiling of a captured enemy takes `INFERENCE` seconds. Sequential run takes about
+n_enemies * (CAPTURE + INFERENCE), pipelined - about n_enemies * max(CAPTURE, INFERENCE).
+
+Requires torch (imported by nodes.vlm_node). Run from repository root: python -m benchmarks.bench_pipelined_profiling [n_enemies]
+"""
+import sys
+from time import perf_counter, sleep
+import numpy as np
+
+from nodes.vlm_node import VLMNode
+from state.enemy_stat import EnemyStat
+from vision.frames import Frame
+
+
+CAPTURE = 0.3
+INFERENCE = 0.4
+
+
+class SimulatedController:
+    """Targets enemies 0..n_enemies-1 in a ring. F selects the next one, R - the previous one."""
+    specifics_region = None
+    target_direction_f = True
+
+    def __init__(self, n_enemies: int):
+        self.n_enemies = n_enemies
+        self.selected = 0
+
+    def toggle_display_enemy_specifics(self) -> None:
+        pass
+
+    def screenshot(self, img_path: str | None = None) -> Frame:
+        sleep(CAPTURE / 2)
+        return Frame(np.full((4, 4, 3), self.selected, np.uint8))
+
+    def change_target(self) -> None:
+        self.selected = (self.selected + (1 if self.target_direction_f else -1)) % self.n_enemies
+
+    def wait_until_settled(self, region: tuple[int, int, int, int] | None = None, max_wait: float | None = None) -> float:
+        sleep(CAPTURE / 2)
+        return CAPTURE / 2
+
+
+def simulated_node(n_enemies: int, pipelined: bool) -> VLMNode:
+    node = VLMNode.__new__(VLMNode)
+    node.controller = SimulatedController(n_enemies)
+    node.debug_frame_path = None
+    node.target_settle_sec = CAPTURE / 2
+    node.incremental_profiling = False
+    node.pipelined_profiling = pipelined
+    node.profiling_queue_size = 2
+    # Selected enemy is encoded in the frame
+    node.find_selected_target = lambda frame, enemy_coords: (int(np.asarray(frame)[0, 0, 0]), 1.0)
+
+    def profile(frame: Frame, seed: int, enemy_id: int, target_direction_f: bool = True, previous: list | None = None) -> tuple[EnemyStat, dict]:
+        sleep(INFERENCE)
+        return EnemyStat(enemy_id=enemy_id, hp=1, hp_max=1, attack=1, defense=1, arts_attack=1, arts_defense=1, speed=1), {}
+    node._VLMNode__profile_selected_enemy = profile
+    return node
+
+
+def main(n_enemies: int = 4) -> None:
+    print(f"{n_enemies} enemies, capture {CAPTURE}s, inference {INFERENCE}s per enemy")
+    print(f"{'mode':<10} | {'total':>6} | {'capture':>7} | {'inference':>9} | profiled")
+    for pipelined in (False, True):
+        node = simulated_node(n_enemies, pipelined)
+        t0 = perf_counter()
+        enemies, _ = node._get_enemy_strength(None, n_enemies, [(0, 0)] * n_enemies)
+        total = perf_counter() - t0
+        stats = node.profiling_stats
+        print(f"{'pipelined' if pipelined else 'sequential':<10} | {total:>5.2f}s | {stats['capture']:>6.2f}s | {stats['inference']:>8.2f}s | "
+              f"{[enemy.enemy_id for enemy in enemies]}")
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:2]])
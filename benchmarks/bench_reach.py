@@ -0,0 +1,89 @@
+"""Red X (enemy out of reach) detector: accuracy and latency on debug screenshots.
+
+Labelled set `imgs/debug/reach.json` is built from `combat-select-target-*` screenshots: every screenshot as is
+(no X), and with red X of various sizes drawn over the targeting reticle. All other full-frame debug screenshots
+are used as hard negatives - red gauges, art circles, and enemy glow.
+Drawn X is a guess of the real marker, so the positives only show the detector finds an X of that color. No X is left to
+the VLM - the share of such samples is reported as deferred.
+
+Run from repository root: python -m benchmarks.bench_reach
+"""
+import glob
+import json
+import os
+from timeit import repeat
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from vision.digits import load_frame
+from vision.reach import find_red_cross
+
+
+ROOT = "imgs/debug"
+ORIGIN, SIZE = (760, 230), (400, 420)
+MIN_CONFIDENCE = 0.6            # Same as reach_detector_min_confidence
+CROSS_COLOR = (194, 34, 34)     # Same as immunity cross on enemy specifics panel
+
+
+def draw_cross(frame: np.ndarray, center: tuple[int, int], size: int, width: int) -> np.ndarray:
+    image = Image.fromarray(frame)
+    draw = ImageDraw.Draw(image)
+    x, y, r = center[0], center[1], size // 2
+    draw.line((x - r, y - r, x + r, y + r), fill=CROSS_COLOR, width=width)
+    draw.line((x - r, y + r, x + r, y - r), fill=CROSS_COLOR, width=width)
+    return np.asarray(image)
+
+
+def load_set() -> list[tuple[str, np.ndarray, bool]]:
+    """Get (name, frame, has red X) of every sample."""
+    with open(f"{ROOT}/reach.json", encoding="utf-8") as f:
+        labels = json.load(f)
+
+    samples = []
+    for label in labels:
+        frame = load_frame(f"{ROOT}/{label['screenshot']}")
+        cross = label["cross"]
+        if cross is None:
+            samples.append((label["screenshot"], frame, False))
+        else:
+            name = f"{label['screenshot']} X{cross['size']}/{cross['width']} at {tuple(cross['center'])}"
+            samples.append((name, draw_cross(frame, cross["center"], cross["size"], cross["width"]), True))
+
+    # Hard negatives
+    labelled = {label["screenshot"] for label in labels}
+    for path in sorted(glob.glob(f"{ROOT}/*.png")):
+        frame = load_frame(path)
+        if os.path.basename(path) not in labelled and frame.shape[:2] == (1080, 1920):
+            samples.append((os.path.basename(path), frame[..., :3], False))
+    return samples
+
+
+def main() -> None:
+    samples = load_set()
+    errors = 0
+    deferred = {True: 0, False: 0}
+    confidences = {True: [], False: []}
+    for name, frame, expected in samples:
+        found, confidence = find_red_cross(frame, ORIGIN, SIZE)
+        confidences[expected].append(confidence)
+        if confidence < MIN_CONFIDENCE:
+            deferred[expected] += 1
+        elif found != expected:
+            errors += 1
+            print(f"MISS {name}: expected {expected}, found {found} ({confidence:.2f})")
+
+    decided = len(samples) - sum(deferred.values())
+    print(f"samples: {len(samples)} ({len(confidences[True])} with red X), decided: {decided}, "
+          f"errors among decided: {errors}, deferred to VLM: {deferred[True]} with red X, {deferred[False]} without")
+    for expected, values in confidences.items():
+        print(f"{'red X' if expected else 'no red X':>9}: confidence min {min(values):.2f}, mean {np.mean(values):.2f}")
+
+    times = []
+    for _, frame, _ in samples:
+        times.append(min(repeat(lambda: find_red_cross(frame, ORIGIN, SIZE), number=50, repeat=3)) / 50)
+    print(f"latency: median {np.median(times) * 1e6:.0f} us, max {max(times) * 1e6:.0f} us per frame")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""Reasoner time to first token with and without llama-server prompt cache over a few synthetic turns.
+
+Requires llama-server with the reasoner model at http://127.0.0.1:8080, see agent.py.
+Every turn the party strengths stay the same, and HP of characters, and enemies change - like in combat.
+
+Run from repository root: python -m benchmarks.bench_reasoner_prefix [n_turns]
+"""
+import sys
+from langchain_core.messages import SystemMessage, HumanMessage
+
+from nodes.graph_state import TurnState
+from nodes.llm_wrapper import LLMWrapper
+from state.enemy_stat import EnemyStat
+from state.player_stat import PlayerCharacterStat
+from tools.controller import Controller
+
+
+SYSTEM_PROMPT = "You are playing a turn-based tactics game. You must give the order to active character based of the current turn context./no_think"
+
+
+def turn_state(turn: int) -> TurnState:
+    characters = [PlayerCharacterStat(character_id=i, is_active=i == turn % 4, hp=900 - 37 * turn - i, hp_max=900,
+                                      attack=320 + 15 * i, defense=280 + 9 * i, arts_attack=250 + 21 * i, arts_defense=240 + 7 * i,
+                                      speed=60 + i) for i in range(4)]
+    enemies = [EnemyStat(enemy_id=i, hp=5000 - 211 * turn - 13 * i, hp_max=5000, attack=400, defense=350, arts_attack=300,
+                         arts_defense=310, speed=55) for i in range(3)]
+    return TurnState(enemies=enemies, player_characters=characters)
+
+
+def main(n_turns: int = 5) -> None:
+    print(f"{'cache_prompt':<12} | {'turn':>4} | {'TTFT':>6} | {'prompt':>6} | {'cached':>6}")
+    for cache_prompt in (False, True):
+        llm = LLMWrapper(system_prompt=SystemMessage(content=SYSTEM_PROMPT), max_tokens=64, cache_prompt=cache_prompt)
+        llm.bind_tools(Controller().get_tools())
+        for turn in range(n_turns):
+            state = turn_state(turn)
+            llm([llm.system_prompt, HumanMessage(content=TurnState.party_prompt(state)),
+                 HumanMessage(content=f"{TurnState.turn_prompt(state)}\n\nIt is your turn now. Give order to the active character.")])
+            stats = llm.last_stats
+            print(f"{str(cache_prompt):<12} | {turn:>4} | {stats['ttft']:>5.2f}s | {stats['prompt_tokens']!s:>6} | {stats['cached_tokens']!s:>6}")
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,114 @@
+"""Frame-settle synchronization vs fixed sleeps on a replayed UI sequence.
+
+Replays the sequence of `GetPlayerStrengthsNode`: open character screen, step through 4 characters, and close it.
+Every input starts a transition between two debug screenshots: `input_lag` seconds of nothing, then a cross-fade
+of `duration` seconds. Transition times are rough guesses of the game's UI animations.
+Per action, reports fixed sleep of `Controller`, the wait of `wait_until_settled`, and whether the wait ended
+after the transition was over - a premature wait would let the next input hit a moving UI.
+Then a small element - 10x10 selection square over the turn-order strip - slides to the next enemy after F,
+like in `Controller.select_target_enemy`: a wait ending before the slide is over reads a stale selection.
+
+Run from repository root: python -m benchmarks.bench_settle
+"""
+from time import perf_counter
+
+import numpy as np
+
+from tools.capture import CaptureBackend
+from tools.waiter import frame_difference, wait_until_settled
+from vision.digits import load_frame
+
+
+ROOT = "imgs/debug"
+TIMEOUT_MENU = 1.0  # Controller.timeout_menu
+TIMEOUT = 0.5  # Controller.timeout
+VERIFY_MIN_WAIT = 0.2  # Controller.verify_min_wait
+# Turn-order strip, see `AgentConfig.game_turn_order_region_*`
+STRIP = (660, 45, 900, 140)
+
+
+class Transition(CaptureBackend):
+    """Screen cross-fading from one screenshot to another after an input."""
+    def __init__(self, start: np.ndarray, end: np.ndarray, input_lag: float, duration: float):
+        self.start, self.end = start.astype(np.float32), end.astype(np.float32)
+        self.input_lag, self.duration = input_lag, duration
+        # Fade is quantized to 1/32 steps, and every step is blended once - blending isn't part of the capture cost
+        self.steps: dict[int, np.ndarray] = {}
+        self.t0 = perf_counter()
+
+    @property
+    def over_at(self) -> float:
+        return self.t0 + self.input_lag + self.duration
+
+    def grab(self, region: tuple[int, int, int, int] | None = None) -> np.ndarray:
+        step = int(32 * np.clip((perf_counter() - self.t0 - self.input_lag) / self.duration, 0.0, 1.0))
+        if step not in self.steps:
+            self.steps[step] = (self.start + step / 32 * (self.end - self.start)).astype(np.uint8)
+        left, top, width, height = region if region is not None else (0, 0, 1920, 1080)
+        return self.steps[step][top:top + height, left:left + width].copy()
+
+
+class SelectionSlide(CaptureBackend):
+    """Selection square sliding over a still screenshot of the turn-order strip after an input."""
+    def __init__(self, background: np.ndarray, start: int, end: int, input_lag: float, duration: float, size: int = 10):
+        self.background = background
+        self.start, self.end = start, end
+        self.input_lag, self.duration, self.size = input_lag, duration, size
+        self.t0 = perf_counter()
+
+    @property
+    def over_at(self) -> float:
+        return self.t0 + self.input_lag + self.duration
+
+    def grab(self, region: tuple[int, int, int, int] | None = None) -> np.ndarray:
+        progress = np.clip((perf_counter() - self.t0 - self.input_lag) / self.duration, 0.0, 1.0)
+        x = int(self.start + progress * (self.end - self.start))
+        frame = self.background.copy()
+        frame[100:100 + self.size, x:x + self.size] = (255, 220, 0)
+        return frame
+
+
+# (action, from screenshot, to screenshot, input lag, duration)
+SEQUENCE = [
+    ("esc - open menu", "screenshot-out-of-combat.png", "items_use_menu-1.png", 0.05, 0.30),
+    ("z - character screen", "items_use_menu-1.png", "character_stats-1.png", 0.05, 0.40),
+    ("down - next character", "character_stats-1.png", "character_stats-2.png", 0.03, 0.20),
+    ("down - next character", "character_stats-2.png", "character_stats-1.png", 0.03, 0.20),
+    ("down - next character", "character_stats-1.png", "character_stats-2.png", 0.03, 0.20),
+    ("down - next character", "character_stats-2.png", "character_stats-1.png", 0.03, 0.20),
+    ("esc - back to menu", "character_stats-1.png", "items_use_menu-1.png", 0.05, 0.30),
+    ("esc - close menu", "items_use_menu-1.png", "screenshot-out-of-combat.png", 0.05, 0.30),
+]
+
+
+def main() -> None:
+    frames = {name: load_frame(f"{ROOT}/{name}")[..., :3] for _, start, end, _, _ in SEQUENCE for name in (start, end)}
+    total_fixed, total_settled, premature = 0.0, 0.0, 0
+    print(f"{'action':<24} | {'transition':>10} | {'fixed':>6} | {'settled':>7} | ok")
+    for action, start, end, input_lag, duration in SEQUENCE:
+        screen = Transition(frames[start], frames[end], input_lag, duration)
+        waited = wait_until_settled(screen.grab, TIMEOUT_MENU)
+        ok = screen.t0 + waited >= screen.over_at
+        premature += not ok
+        total_fixed += TIMEOUT_MENU
+        total_settled += waited
+        print(f"{action:<24} | {input_lag + duration:>9.2f}s | {TIMEOUT_MENU:>5.2f}s | {waited:>6.2f}s | {'yes' if ok else 'NO'}")
+    print(f"total: fixed {total_fixed:.2f}s, settled {total_settled:.2f}s ({1 - total_settled / total_fixed:.0%} less), "
+          f"mean per action {total_settled / len(SEQUENCE):.3f}s, premature waits: {premature}")
+
+    left, top, width, height = STRIP
+    strip = frames["screenshot-out-of-combat.png"][top:top + height, left:left + width].copy()
+    print(f"\n{'selection square slide':<24} | {'slide':>10} | {'fixed':>6} | {'settled':>7} | ok | mean diff of a step")
+    premature = 0
+    for start, end, input_lag, duration in ((100, 190, 0.05, 0.10), (190, 280, 0.10, 0.15), (280, 100, 0.05, 0.25)):
+        screen = SelectionSlide(strip, start, end, input_lag, duration)
+        waited = wait_until_settled(screen.grab, TIMEOUT, min_wait=VERIFY_MIN_WAIT)
+        ok = screen.t0 + waited >= screen.over_at
+        premature += not ok
+        step = frame_difference(SelectionSlide(strip, start, start, 0, 1).grab(), SelectionSlide(strip, end, end, 0, 1).grab(), step=1)
+        print(f"{f'x {start} -> {end}':<24} | {input_lag + duration:>9.2f}s | {TIMEOUT:>5.2f}s | {waited:>6.2f}s | {'yes' if ok else 'NO'} | {step:.3f}")
+    print(f"premature waits: {premature}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""Reasoner tool schemas: Qwen tokens per legal subset of tools, and cost of binding them - first time, and memoized.
+
+Requires transformers, langchain, and langchain-litellm. No llama-server needed - nothing is sent. The tokenizer is
+downloaded from Hugging Face, pass path/to/model offline.
+Run from repository root: python -m benchmarks.bench_tool_subsets [tokenizer name or path/to/model]
+"""
+import json
+import sys
+from time import perf_counter
+from langchain_core.messages import SystemMessage
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from transformers import AutoTokenizer
+
+from nodes.llm_wrapper import LLMWrapper
+from state.enemy_stat import EnemyStat
+from state.player_stat import PlayerCharacterStat
+from tools.controller import Controller
+
+
+# (name, EP, CP, Mute, Seal, any enemy within reach)
+SITUATIONS = [
+    ("everything", 120, 80, False, False, True),
+    ("out of reach", 120, 80, False, False, False),
+    ("no EP", 0, 80, False, False, True),
+    ("no EP, no CP", 0, 0, False, False, True),
+    ("muted, sealed", 120, 80, True, True, False),
+]
+
+
+def main(tokenizer: str = "Qwen/Qwen3-30B-A3B") -> None:
+    tokenizer = AutoTokenizer.from_pretrained(tokenizer)
+    controller = Controller.__new__(Controller)  # no screen capture needed
+    llm = LLMWrapper(system_prompt=SystemMessage(content=""))
+
+    print(f"{'situation':<14} | {'tools':>5} | {'tokens':>6} | {'bind':>8} | {'memoized':>8}")
+    for name, ep, cp, mute, seal, reach in SITUATIONS:
+        turn_state = {
+            "player_characters": [PlayerCharacterStat(character_id=0, is_active=True, ep=ep, cp=cp, ailment_mute=mute, ailment_seal=seal)],
+            "enemies": [EnemyStat(enemy_id=0, basic_attack_enabled=reach, hp=1, hp_max=1, attack=1, defense=1,
+                                  arts_attack=1, arts_defense=1, speed=1)]
+        }
+        tools = controller.get_legal_tools(turn_state)
+        schemas = json.dumps([convert_to_openai_tool(t) for t in tools])
+
+        t0 = perf_counter()
+        llm.bind_tools(tools)
+        t_bind = perf_counter() - t0
+        t0 = perf_counter()
+        llm.bind_tools(tools)
+        t_memoized = perf_counter() - t0
+        print(f"{name:<14} | {len(tools):>5} | {len(tokenizer.encode(schemas)):>6} | {1e6 * t_bind:>6.0f}us | {1e6 * t_memoized:>6.1f}us")
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:2])
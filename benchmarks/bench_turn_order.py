@@ -0,0 +1,66 @@
+"""Enemy portrait detector: per-pixel `getpixel` loop vs vectorized detector.
+
+Run from repository root: python -m benchmarks.bench_turn_order
+"""
+from glob import glob
+from timeit import repeat
+import numpy as np
+from PIL import Image
+
+from vision import turn_order
+
+
+ORIGIN = (660, 45)
+SIZE = (900, 140)
+ENEMY_COLOR = (219, 0, 72)
+
+
+def estimate_number_of_enemies_loop(img_player_turn: Image.Image, origin: tuple[int, int], size: tuple[int, int],
+                                    enemy_color: tuple[int, int, int] = (219, 0, 72)) -> tuple[int, list[tuple[int, int]]]:
+    """Previous implementation of VLMNode._estimate_number_of_enemies - exact color match, pixel by pixel."""
+    img_haystack = img_player_turn.crop(origin + (origin[0] + size[0], origin[1] + size[1]))
+    enemy_positions_x = []
+    enemy_positions = []
+    for x in range(img_haystack.size[0]):
+        for y in range(img_haystack.size[1]):
+            if img_haystack.getpixel((x, y)) == enemy_color:
+                enemy_positions_x.append(x)
+                enemy_positions.append((x, y))
+
+    if not enemy_positions_x:
+        return (0, [])
+    enemy_positions_x = np.unique(enemy_positions_x).tolist()
+
+    origins_x = [enemy_positions_x[0]]
+    for x in enemy_positions_x:
+        if x - origins_x[-1] >= 10:
+            origins_x.append(x)
+
+    enemy_coords = {}
+    for x in enemy_positions:
+        if x[0] in origins_x and not enemy_coords.get(x[0]):
+            enemy_coords[x[0]] = x
+
+    enemy_coords = list(enemy_coords.values())
+    return (len(enemy_coords), enemy_coords)
+
+
+def main(pattern: str = "imgs/debug/combat-*.png", max_distance: int = 10) -> None:
+    print(f"{'screenshot':<45} {'loop n':>6} {'loop ms':>9} {'new n':>6} {'new us':>8} {'speedup':>8}")
+    for path in sorted(glob(pattern)):
+        img = Image.open(path).convert("RGB")
+        if img.size != (1920, 1080):
+            continue
+        frame = turn_order.as_frame(img)
+
+        n_loop, _ = estimate_number_of_enemies_loop(img, ORIGIN, SIZE, ENEMY_COLOR)
+        n_new, _ = turn_order.find_enemies(frame, ORIGIN, SIZE, ENEMY_COLOR, max_distance)
+
+        t_loop = min(repeat(lambda: estimate_number_of_enemies_loop(img, ORIGIN, SIZE, ENEMY_COLOR), number=1, repeat=3))
+        t_new = min(repeat(lambda: turn_order.find_enemies(frame, ORIGIN, SIZE, ENEMY_COLOR, max_distance), number=100, repeat=5)) / 100
+
+        print(f"{path:<45} {n_loop:>6} {t_loop * 1e3:>9.1f} {n_new:>6} {t_new * 1e6:>8.0f} {t_loop / t_new:>7.0f}x")
+
+
+if __name__ == "__main__":
+    main()
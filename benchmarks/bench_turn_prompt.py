@@ -0,0 +1,60 @@
+"""Reasoner turn context: tokens, and render time per format of `TurnState` serializer.
+
+Counts tokens with Qwen tokenizer - the reasoner's, or the VLM's, they share the vocabulary.
+Render time is measured with a cold row cache, and with a warm one when a single enemy has changed - like the next turn.
+
+Requires transformers. Run from repository root: python -m benchmarks.bench_turn_prompt [tokenizer name or path/to/model]
+"""
+import sys
+from time import perf_counter
+from transformers import AutoTokenizer
+
+from nodes.graph_state import TurnState
+from state import compact
+from state.enemy_stat import EnemyStat
+from state.player_stat import PlayerCharacterStat
+
+
+def turn_state(n_enemies: int = 5) -> TurnState:
+    characters = [PlayerCharacterStat(character_id=i, is_active=i == 1, hp=2870 - 311 * i, hp_max=3120, ep=204 + 17 * i, ep_max=310,
+                                      cp=85 + 20 * i, attack=1020 + 45 * i, defense=873 + 12 * i, arts_attack=640 + 88 * i,
+                                      arts_defense=702 + 31 * i, speed=156 + i, ailment_burn=i == 2) for i in range(4)]
+    enemies = [EnemyStat(enemy_id=i, basic_attack_enabled=i % 2 == 0, hp=15400 - 1301 * i, hp_max=15400, stun=10 * i,
+                         attack=1340, defense=1105, arts_attack=980, arts_defense=1230, speed=140 + i,
+                         weakness_fire=150, weakness_wind=120 if i % 2 else 100, weakness_earth=50,
+                         ailment_freeze=True, ailment_seal=i % 2 == 1, ailment_blind=True) for i in range(n_enemies)]
+    return TurnState(enemies=enemies, player_characters=characters)
+
+
+def render(state: TurnState, fmt: str) -> str:
+    return f"{TurnState.party_prompt(state, fmt)}\n\n{TurnState.turn_prompt(state, fmt)}"
+
+
+def main(tokenizer: str = "Qwen/Qwen3-30B-A3B", repeat: int = 200) -> None:
+    tokenizer = AutoTokenizer.from_pretrained(tokenizer)
+    state = turn_state()
+
+    print(f"{'format':<6} | {'chars':>6} | {'tokens':>6} | {'party':>6} | {'turn':>6} | {'cold':>8} | {'warm':>8}")
+    baseline = None
+    for fmt in compact.FORMATS:
+        tokens = len(tokenizer.encode(render(state, fmt)))
+        party = len(tokenizer.encode(TurnState.party_prompt(state, fmt)))
+        baseline = baseline or tokens
+
+        t0 = perf_counter()
+        for _ in range(repeat):
+            compact.rows.rows.clear()
+            render(state, fmt)
+        t_cold = (perf_counter() - t0) / repeat
+        t0 = perf_counter()
+        for i in range(repeat):
+            state["enemies"][0].hp = i
+            render(state, fmt)
+        t_warm = (perf_counter() - t0) / repeat
+
+        print(f"{fmt:<6} | {len(render(state, fmt)):>6} | {tokens:>6} | {party:>6} | {tokens - party:>6} | "
+              f"{1e6 * t_cold:>6.1f}us | {1e6 * t_warm:>6.1f}us   {tokens / baseline:.0%} of text")
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:2])
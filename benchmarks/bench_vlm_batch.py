@@ -0,0 +1,75 @@
+"""Enemy profiling latency: nine sequential VLM calls vs a single batched call.
+
+Also checks that greedy batched results are the same as the sequential ones - exits with 1 on a mismatch.
+Requires the VLM and CUDA. Run from repository root: python -m benchmarks.bench_vlm_batch [path/to/screenshot.png]
+"""
+import sys
+from time import perf_counter
+import torch
+from PIL import Image
+
+from nodes.vlm_cache import VLMCache
+from nodes.vlm_wrapper import VLMWrapper
+from nodes.vlm_node import VLMNode
+
+
+SEED = 1741
+# Same regions as in agent.py configurable
+REGIONS = {
+    "hp": ((1552, 284), (214, 28)),
+    "stun": ((1553, 320), (73, 30)),
+    "atk_ats_speed": ((1566, 382), (50, 102)),
+    "def_adf": ((1704, 382), (50, 66)),
+    "weakness_basic": ((1530, 522), (50, 140)),
+    "weakness_higher_elements": ((1715, 522), (50, 104)),
+    "ailments_left": ((1556, 700), (40, 174)),
+    "ailments_right": ((1750, 700), (40, 174)),
+}
+PROMPTS = {
+    "hp": "Extract all numbers as JSON list.",
+    "stun": "Extract all numbers as JSON list.",
+    "atk_ats_speed": "Extract all numbers as JSON list.",
+    "def_adf": "Extract all numbers as JSON list.",
+    "weakness_basic": "List numbers. Just give the numbers.",
+    "weakness_higher_elements": "List numbers. Just give the numbers.",
+    "ailments_left": "List circles, and triangles in order of their occurence in the column. For each circle return 1, for each triangle - 0. Just give the list.",
+    "ailments_right": "List circles, and triangles in order of their occurence in the column. For each circle return 1, for each triangle - 0. Just give the list.",
+}
+
+
+def main(path: str = "imgs/debug/combat-pc-turn1-3-enemy_stats.png", repeat: int = 3) -> None:
+    img = Image.open(path).convert("RGB")
+    requests = [(PROMPTS[key], img.crop(VLMNode.get_crop_box(*REGIONS[key]))) for key in REGIONS]
+    requests.append(("Is there a big red X on screen? Give only yes or no answer.", img))
+
+    # No cache - every query must reach the model
+    vlm = VLMWrapper(greedy=True, cache=VLMCache(max_size=0))
+    # Warm-up
+    vlm.batch(requests[:1])
+
+    n_mismatches = 0
+    for _ in range(repeat):
+        t0 = perf_counter()
+        sequential = []
+        for text, image in requests:
+            torch.manual_seed(SEED)
+            sequential += vlm(text=text, image=image)
+        t_sequential = perf_counter() - t0
+
+        t0 = perf_counter()
+        torch.manual_seed(SEED)
+        batched = vlm.batch(requests)
+        t_batched = perf_counter() - t0
+
+        mismatches = [i for i, (a, b) in enumerate(zip(sequential, batched)) if a != b]
+        n_mismatches += len(mismatches)
+        print(f"{len(requests)} queries: sequential {t_sequential:.2f}s, batched {t_batched:.2f}s, "
+              f"speedup {t_sequential / t_batched:.1f}x, mismatches {mismatches}")
+        for i in mismatches:
+            print(f"  {i}: sequential {sequential[i]!r}, batched {batched[i]!r}")
+    if n_mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:2])
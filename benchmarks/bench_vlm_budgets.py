@@ -0,0 +1,71 @@
+"""Prefill tokens and latency per VLM call site: default pixel budget vs per-request budgets.
+
+Vision tokens are computed with the same resize rule the processor uses, so the first table needs no GPU.
+The second table requires the VLM and CUDA.
+Run from repository root: python -m benchmarks.bench_vlm_budgets
+"""
+from time import perf_counter
+import torch
+from PIL import Image
+from qwen_vl_utils import smart_resize
+
+from nodes.vlm_cache import VLMCache
+from nodes.vlm_wrapper import VLMWrapper
+from nodes.vlm_node import VLMNode
+
+
+SEED = 1741
+# (call site, screenshot, (origin, size) or None for full frame, prompt, budget)
+CALL_SITES = [
+    ("enemy hp", "imgs/debug/combat-pc-turn1-3-enemy_stats.png", ((1552, 284), (214, 28)), "Extract all numbers as JSON list.", "digit_crop"),
+    ("enemy stun", "imgs/debug/combat-pc-turn1-3-enemy_stats.png", ((1553, 320), (73, 30)), "Extract all numbers as JSON list.", "digit_crop"),
+    ("enemy atk/ats/spd", "imgs/debug/combat-pc-turn1-3-enemy_stats.png", ((1566, 382), (50, 102)), "Extract all numbers as JSON list.", "digit_crop"),
+    ("enemy def/adf", "imgs/debug/combat-pc-turn1-3-enemy_stats.png", ((1704, 382), (50, 66)), "Extract all numbers as JSON list.", "digit_crop"),
+    ("enemy weakness", "imgs/debug/combat-pc-turn1-3-enemy_stats.png", ((1530, 522), (50, 140)), "List numbers. Just give the numbers.", "icon_column"),
+    ("enemy ailments", "imgs/debug/combat-pc-turn1-3-enemy_stats.png", ((1556, 700), (40, 174)), "List circles, and triangles in order of their occurence in the column. For each circle return 1, for each triangle - 0. Just give the list.", "icon_column"),
+    ("enemy reach", "imgs/debug/combat-pc-turn1-3-enemy_stats.png", None, "Is there a big red X on screen? Give only yes or no answer.", "full_frame_classifier"),
+    ("party hp/ep/cp", "imgs/debug/combat-pc-turn1.png", ((160, 108), (240, 50)), "Extract values of HP, EP, CP as CSV: name,value", "digit_crop"),
+    ("character speed", "imgs/debug/character_stats-1.png", ((1668, 364), (38, 30)), "What number is it? Just give the number.", "digit_crop"),
+    ("combat over", "imgs/debug/combat-win.png", None, """Is there word "RESULTS" on screen? Give only binary answer - yes or no.""", "full_frame_classifier"),
+    ("agent turn", "imgs/debug/combat-pc-turn1.png", None, """Are there menu items "Attack" and "Defend" on screen? Give only binary answer - yes or no.""", "full_frame_classifier"),
+]
+
+
+def vision_tokens(size: tuple[int, int], budget: tuple[int, int]) -> int:
+    """Number of vision tokens of the image: one token per 28x28 pixels after resize."""
+    height, width = smart_resize(size[1], size[0], factor=28, min_pixels=budget[0], max_pixels=budget[1])
+    return height * width // (28 * 28)
+
+
+def load(path: str, region: tuple | None) -> Image.Image:
+    img = Image.open(path).convert("RGB")
+    return img.crop(VLMNode.get_crop_box(*region)) if region else img
+
+
+def main() -> None:
+    print(f"{'call site':<20} {'size':>10} {'budget':<22} {'default tok':>11} {'budget tok':>10}")
+    for name, path, region, _, budget in CALL_SITES:
+        size = load(path, region).size
+        print(f"{name:<20} {f'{size[0]}x{size[1]}':>10} {budget:<22} "
+              f"{vision_tokens(size, (VLMWrapper.min_pixels, VLMWrapper.max_pixels)):>11} {vision_tokens(size, VLMWrapper.budgets[budget]):>10}")
+
+    if not torch.cuda.is_available():
+        return
+
+    # No cache - every query must reach the model
+    vlm = VLMWrapper(cache=VLMCache(max_size=0))
+    vlm("Hi", load(*CALL_SITES[0][1:3]), "digit_crop")  # Warm-up
+    print(f"\n{'call site':<20} {'default prefill':>15} {'default s':>9} {'budget prefill':>14} {'budget s':>8}  answers equal")
+    for name, path, region, prompt, budget in CALL_SITES:
+        image = load(path, region)
+        row = []
+        for request_budget in (None, budget):
+            torch.manual_seed(SEED)
+            t0 = perf_counter()
+            answer = vlm(text=prompt, image=image, budget=request_budget)[0]
+            row.append((vlm.last_prefill_tokens[0], perf_counter() - t0, answer))
+        print(f"{name:<20} {row[0][0]:>15} {row[0][1]:>9.2f} {row[1][0]:>14} {row[1][1]:>8.2f}  {row[0][2] == row[1][2]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Shared VLM server: throughput and latency of several agents with and without dynamic batching.
+
+Serves CPU-only `StubVLM` - no GPU needed. Every agent connects with its own `VLMClient` and,
+like `VLMNode` per enemy, sends a batch of stat panel crops followed by a yes/no question.
+Last run overloads the server with short deadlines to show backpressure, and expired requests.
+
+Run from repository root: python -m benchmarks.bench_vlm_server [n_agents]
+"""
+import secrets
+import sys
+from threading import Thread
+from time import perf_counter
+
+import numpy as np
+from PIL import Image
+
+from nodes.vlm_server import StubVLM, VLMClient, VLMServer
+
+
+ROUNDS = 10
+# Throwaway key of this run, the key file isn't touched
+AUTHKEY = secrets.token_bytes(32)
+# Crops of `VLMNode.panel_fields` panels of a single enemy
+CROPS = [Image.new("RGB", size) for size in [(214, 28), (73, 30), (50, 102), (50, 66), (50, 140), (50, 104), (40, 174), (40, 174)]]
+BUDGET = (32 * 28 * 28, 64 * 28 * 28)
+
+
+def agent(address: tuple[str, int] | str, latencies: list[float], errors: list[str], timeout: float) -> None:
+    client = VLMClient(f"{address[0]}:{address[1]}" if isinstance(address, tuple) else address, authkey=AUTHKEY, timeout=timeout)
+    for _ in range(ROUNDS):
+        try:
+            t0 = perf_counter()
+            client.batch([("Extract all numbers as JSON list.", crop, BUDGET) for crop in CROPS], seed=1741)
+            latencies.append(perf_counter() - t0)
+            t0 = perf_counter()
+            client.classify("Is there a big red X on screen?", CROPS[0], ("yes", "no"), BUDGET, seed=1741)
+            latencies.append(perf_counter() - t0)
+        except TimeoutError as e:
+            errors.append(str(e))
+    client.close()
+
+
+def run(name: str, n_agents: int, max_batch: int, window: float, max_pending: int = 64, timeout: float = 30.0) -> None:
+    server = VLMServer(StubVLM(), "127.0.0.1:0", authkey=AUTHKEY, max_batch=max_batch, window=window, max_pending=max_pending)
+    server_thread = Thread(target=server.serve_forever, daemon=True)
+    server_thread.start()
+
+    latencies, errors = [], []
+    agents = [Thread(target=agent, args=(server.address, latencies, errors, timeout)) for _ in range(n_agents)]
+    t0 = perf_counter()
+    for thread in agents:
+        thread.start()
+    for thread in agents:
+        thread.join()
+    elapsed = perf_counter() - t0
+    server.close()
+    server_thread.join()
+
+    stats = server.stats()
+    n_requests = stats["requests"]
+    p50, p95 = np.percentile(latencies, [50, 95]) if latencies else (0.0, 0.0)
+    print(f"{name:<28} | {elapsed:>6.2f}s | {n_requests / elapsed:>6.1f} req/s | {p50:>5.3f}s | {p95:>5.3f}s | "
+          f"{stats['mean_batch_size']:>5.2f} | {len(errors):>3} timeouts, {stats['expired']} expired, {stats['rejected']} rejected")
+
+
+def main(n_agents: int = 3) -> None:
+    print(f"{n_agents} agents, {ROUNDS} rounds of {len(CROPS)} crops + 1 classify each")
+    print(f"{'server':<28} | {'total':>7} | {'throughput':>12} | {'p50':>6} | {'p95':>6} | batch | errors")
+    run("serial (max_batch=1)", n_agents, max_batch=1, window=0.0)
+    run("dynamic (16, 0 ms window)", n_agents, max_batch=16, window=0.0)
+    run("dynamic (16, 10 ms window)", n_agents, max_batch=16, window=0.01)
+    run("dynamic (32, 10 ms window)", n_agents, max_batch=32, window=0.01)
+    run("overload (4 pending, 0.3s)", n_agents, max_batch=4, window=0.01, max_pending=4, timeout=0.3)
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:2]])
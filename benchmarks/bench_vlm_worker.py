@@ -0,0 +1,77 @@
+"""VLM worker process: how long inference blocks the controller, in-process vs worker.
+
+Replays `GetPlayerStrengthsNode` with CPU-only `StubVLM` - no GPU needed: for each of 4 characters
+grab a frame, ask VLM about 3 crops, and press "next character" - `UI_WAIT` seconds of waiting for the screen.
+In-process, every query blocks the loop. In the worker, queries are queued, and the loop keeps driving input.
+Also compares the cost of passing a full frame to the worker through shared memory with pickling it.
+
+Run from repository root: python -m benchmarks.bench_vlm_worker
+"""
+import pickle
+from time import perf_counter, sleep
+
+import numpy as np
+
+from nodes.vlm_server import StubVLM
+from nodes.vlm_worker import VLMWorker, as_pixels
+from vision.frames import Frame, as_image
+
+
+UI_WAIT = 0.3
+# Stat panels of the character screen, see `AgentConfig.character_*`
+CROPS = [((1280, 310), (250, 64)), ((1284, 370), (250, 64)), ((1668, 364), (38, 30))]
+BUDGET = (32 * 28 * 28, 64 * 28 * 28)
+
+
+def character_screen(vlm: StubVLM | VLMWorker) -> tuple[float, float]:
+    """Get total duration of the loop, and the time VLM has blocked it."""
+    blocked = 0.0
+    queued = []
+    t_start = perf_counter()
+    for _ in range(4):
+        frame = Frame(np.random.randint(0, 256, (1080, 1920, 3), np.uint8))
+        for origin, size in CROPS:
+            t0 = perf_counter()
+            request = [("What are these values?", frame.crop(origin, size), BUDGET)]
+            if isinstance(vlm, VLMWorker):
+                queued.append(vlm.submit_batch(request, seed=1741))
+            else:
+                vlm.batch([(text, as_image(image), budget) for text, image, budget in request])
+            blocked += perf_counter() - t0
+        # Next character
+        sleep(UI_WAIT)
+    t0 = perf_counter()
+    for answer in queued:
+        answer.result()
+    blocked += perf_counter() - t0
+    return perf_counter() - t_start, blocked
+
+
+def main(repeat: int = 3) -> None:
+    worker = VLMWorker(stub=True)
+    # Wait for the worker to start
+    worker.batch([("warm-up", np.zeros((28, 28, 3), np.uint8), BUDGET)])
+    in_process = StubVLM()
+
+    print(f"{'mode':<12} | {'total':>6} | {'blocked':>7}")
+    for _ in range(repeat):
+        for name, vlm in (("in-process", in_process), ("worker", worker)):
+            total, blocked = character_screen(vlm)
+            print(f"{name:<12} | {total:>5.2f}s | {blocked:>6.2f}s")
+
+    frame = Frame(np.random.randint(0, 256, (1080, 1920, 3), np.uint8))
+    t0 = perf_counter()
+    for _ in range(20):
+        block, _ = worker.slots.write([as_pixels(frame)])
+        worker.slots.release(block)
+    t_shared = (perf_counter() - t0) / 20
+    t0 = perf_counter()
+    for _ in range(20):
+        pickle.loads(pickle.dumps(frame.image))
+    t_pickle = (perf_counter() - t0) / 20
+    print(f"full frame to worker: shared memory {1000 * t_shared:.2f}ms, pickle round trip {1000 * t_pickle:.2f}ms")
+    worker.close()
+
+
+if __name__ == "__main__":
+    main()
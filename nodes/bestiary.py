@@ -0,0 +1,151 @@
+import os
+import sqlite3
+from io import BytesIO
+from json import dumps, loads
+from time import time
+import numpy as np
+from PIL import Image
+from loguru import logger
+
+
+class Bestiary:
+    """On-disk bestiary of static enemy traits - elemental weaknesses and ailment susceptibilities.
+
+    Enemy type is addressed by perceptual hash of its name plate, see `vision.name_plate.name_plate_hash`,
+    and matched within `tolerance` differing bits. Entries are stamped with `VERSION`. Entries of other versions
+    are ignored, and overwritten on the next extraction - bump it whenever panel crops or parsers change.
+    Bad entries are dropped with `invalidate`, or from command line:
+        python -m nodes.bestiary data/bestiary.sqlite --list
+        python -m nodes.bestiary data/bestiary.sqlite --invalidate 1f03...
+    """
+    VERSION = 1
+
+    def __init__(self, path: str = "data/bestiary.sqlite", tolerance: int = 32):
+        """
+        Args:
+            path (str, optional): path/to/bestiary.sqlite. Defaults to "data/bestiary.sqlite".
+            tolerance (int, optional): max Hamming distance of name plate hashes of the same enemy. Defaults to 32.
+        """
+        self.tolerance = tolerance
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS bestiary (name_hash TEXT PRIMARY KEY, version INTEGER, traits TEXT, name_plate BLOB, created REAL, last_used REAL, uses INTEGER)")
+        self.db.commit()
+        # name hash -> traits of the current version. Bestiary is small, so it's kept in memory
+        self.entries: dict[int, dict[str, list]] = {
+            int(name_hash, 16): loads(traits)
+            for name_hash, traits in self.db.execute("SELECT name_hash, traits FROM bestiary WHERE version = ?", (self.VERSION,))
+        }
+
+    def find(self, name_hash: int) -> int | None:
+        """Get hash of the closest known enemy within `tolerance`, or None."""
+        best, best_distance = None, self.tolerance + 1
+        for known_hash in self.entries:
+            distance = (known_hash ^ name_hash).bit_count()
+            if distance < best_distance:
+                best, best_distance = known_hash, distance
+        return best
+
+    def get(self, name_hash: int) -> dict[str, list] | None:
+        """Look up traits of the enemy.
+
+        Args:
+            name_hash (int): name plate hash
+
+        Returns:
+            dict[str, list] | None: request name -> values of its fields, see `VLMNode.panel_fields`. None - unknown enemy
+        """
+        known_hash = self.find(name_hash)
+        if known_hash is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.db.execute("UPDATE bestiary SET last_used = ?, uses = uses + 1 WHERE name_hash = ?", (time(), f"{known_hash:x}"))
+        self.db.commit()
+        return self.entries[known_hash]
+
+    def put(self, name_hash: int, traits: dict[str, list], name_plate: np.ndarray | None = None) -> None:
+        """Store traits of the enemy.
+
+        Args:
+            name_hash (int): name plate hash
+            traits (dict[str, list]): request name -> values of its fields, see `VLMNode.panel_fields`
+            name_plate (np.ndarray | None, optional): crop of the name plate to tell entries apart by eye. Defaults to None.
+        """
+        # Replace entries of the same enemy, incl. stale versions
+        self.invalidate(name_hash)
+        for stale_hash, in self.db.execute("SELECT name_hash FROM bestiary WHERE version != ?", (self.VERSION,)).fetchall():
+            if (int(stale_hash, 16) ^ name_hash).bit_count() <= self.tolerance:
+                self.db.execute("DELETE FROM bestiary WHERE name_hash = ?", (stale_hash,))
+
+        png = None
+        if name_plate is not None:
+            buffer = BytesIO()
+            Image.fromarray(np.ascontiguousarray(name_plate)).save(buffer, format="PNG")
+            png = buffer.getvalue()
+        self.db.execute("INSERT OR REPLACE INTO bestiary VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (f"{name_hash:x}", self.VERSION, dumps(traits), png, time(), time(), 0))
+        self.db.commit()
+        self.entries[name_hash] = traits
+        logger.info(f"Bestiary: new enemy {name_hash:x}")
+
+    def invalidate(self, name_hash: int | None = None) -> int:
+        """Drop the enemy matching `name_hash` within `tolerance`, or the whole bestiary.
+
+        Args:
+            name_hash (int | None, optional): name plate hash. Defaults to None - drop all entries.
+
+        Returns:
+            int: number of dropped entries
+        """
+        if name_hash is None:
+            n = self.db.execute("DELETE FROM bestiary").rowcount
+            self.entries.clear()
+        else:
+            known_hash = self.find(name_hash)
+            if known_hash is None:
+                return 0
+            n = self.db.execute("DELETE FROM bestiary WHERE name_hash = ?", (f"{known_hash:x}",)).rowcount
+            del self.entries[known_hash]
+        self.db.commit()
+        return n
+
+    def stats(self) -> dict[str, int | float]:
+        """Get hit/miss counters."""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self.entries)
+        }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Inspect, and invalidate bestiary entries")
+    parser.add_argument("path", nargs="?", default="data/bestiary.sqlite", help="path/to/bestiary.sqlite")
+    parser.add_argument("--list", action="store_true", help="list all entries")
+    parser.add_argument("--dump", metavar="DIR", help="write name plates of all entries to DIR/<hash>.png")
+    parser.add_argument("--invalidate", metavar="HASH", help="drop the entry by its hash")
+    parser.add_argument("--clear", action="store_true", help="drop all entries")
+    args = parser.parse_args()
+
+    bestiary = Bestiary(args.path)
+    if args.invalidate:
+        print(f"Dropped {bestiary.invalidate(int(args.invalidate, 16))} entries")
+    if args.clear:
+        print(f"Dropped {bestiary.invalidate()} entries")
+    rows = bestiary.db.execute("SELECT name_hash, version, traits, name_plate, uses FROM bestiary ORDER BY created").fetchall()
+    if args.list:
+        for name_hash, version, traits, _, uses in rows:
+            print(f"{name_hash} v{version}{'' if version == Bestiary.VERSION else ' (stale)'} used {uses} times: {traits}")
+    if args.dump:
+        os.makedirs(args.dump, exist_ok=True)
+        for name_hash, _, _, name_plate, _ in rows:
+            if name_plate:
+                with open(os.path.join(args.dump, f"{name_hash}.png"), "wb") as f:
+                    f.write(name_plate)
@@ -0,0 +1,218 @@
+import os
+import sqlite3
+from hashlib import blake2b
+from json import dumps, loads
+from math import ceil
+from random import Random
+from time import time
+from typing import Any
+from loguru import logger
+
+
+def fingerprint(turn_state: object, hp_buckets: int = 4, ep_ratios: tuple[float, ...] = (0.1, 0.5),
+                cp_levels: tuple[int, ...] = (1, 30, 100)) -> str:
+    """Get canonical, quantized fingerprint of the turn. Turns with the same fingerprint are expected to get the same order.
+
+    Fingerprint is made of the active character, and of every character: HP bucket, EP, and CP band, Mute, and Seal;
+    and of every enemy: HP bucket, reach, weaknesses, and resistances. Units go in the order of their IDs -
+    the order is addressed by enemy ID.
+
+    Args:
+        turn_state (object): TurnState
+        hp_buckets (int, optional): number of HP buckets, 0 - dead. Defaults to 4 - quarters of max HP.
+        ep_ratios (tuple[float, ...], optional): EP thresholds, ratios of max EP. Defaults to (0.1, 0.5).
+        cp_levels (tuple[int, ...], optional): CP thresholds. Defaults to (1, 30, 100) - any craft, most crafts, S-craft.
+
+    Returns:
+        str: 128-bit hash of the fingerprint, hex
+    """
+    def hp_bucket(unit: Any) -> int:
+        return min(hp_buckets, ceil(hp_buckets * unit.hp / unit.hp_max)) if unit.hp > 0 and unit.hp_max > 0 else 0
+
+    active = [character.character_id for character in turn_state["player_characters"] if character.is_active]
+    characters = [
+        (character.character_id, hp_bucket(character), sum(character.ep >= ratio * character.ep_max for ratio in ep_ratios),
+         sum(character.cp >= level for level in cp_levels), character.ailment_mute, character.ailment_seal)
+        for character in sorted(turn_state["player_characters"], key=lambda character: character.character_id)
+    ]
+    enemies = []
+    for enemy in sorted(turn_state["enemies"], key=lambda enemy: enemy.enemy_id):
+        weaknesses = {name[len("weakness_"):]: value for name, value in enemy.__dict__.items() if name.startswith("weakness_")}
+        enemies.append((enemy.enemy_id, hp_bucket(enemy), enemy.basic_attack_enabled,
+                        tuple(sorted(element for element, value in weaknesses.items() if value > 100)),
+                        tuple(sorted(element for element, value in weaknesses.items() if value < 100))))
+    return blake2b(repr((active, characters, enemies)).encode(), digest_size=16).hexdigest()
+
+
+class DecisionCache:
+    """On-disk cache of reasoner decisions - tool calls - by fingerprint of the turn, see `fingerprint`.
+
+    Combat is repetitive, so the same turn comes again and again. A hit is answered without the reasoner, except
+    `explore_rate` of hits - they go to the reasoner anyway, and its decision replaces the cached one.
+    Cache holds at most `max_size` decisions, least recently used ones are evicted. Entries are stamped with `VERSION`,
+    entries of other versions are dropped on start - bump it whenever `fingerprint` changes.
+    A decision is only stored, and replayed, if its tool is legal, and its target enemy is on the field, see `is_valid`.
+    A decision whose tool call has failed is dropped with `invalidate`.
+    Cache is inspected, and dropped from command line:
+        python -m nodes.decision_cache data/decisions.sqlite --list
+        python -m nodes.decision_cache data/decisions.sqlite --clear
+    """
+    VERSION = 1
+
+    def __init__(self, path: str = "data/decisions.sqlite", max_size: int = 4096, explore_rate: float = 0.1, seed: int | None = None):
+        """
+        Args:
+            path (str, optional): path/to/decisions.sqlite. Defaults to "data/decisions.sqlite".
+            max_size (int, optional): max number of decisions. Defaults to 4096.
+            explore_rate (float, optional): share of hits to send to the reasoner anyway. Defaults to 0.1.
+            seed (int | None, optional): seed of exploration. Defaults to None - random.
+        """
+        self.max_size = max_size
+        self.explore_rate = explore_rate
+        self.random = Random(seed)
+        self.hits = 0
+        self.misses = 0
+        self.explored = 0
+        # Explored hits the reasoner has decided the same way, and the fingerprint being explored
+        self.agreed = 0
+        self.exploring: str | None = None
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS decisions (fingerprint TEXT PRIMARY KEY, version INTEGER, tool_name TEXT, args TEXT, created REAL, last_used REAL, uses INTEGER)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS decisions_last_used ON decisions (last_used)")
+        self.db.execute("DELETE FROM decisions WHERE version != ?", (self.VERSION,))
+        self.db.commit()
+        # fingerprint -> (tool name, tool arguments)
+        self.entries: dict[str, tuple[str, dict[str, Any]]] = {
+            key: (tool_name, loads(args)) for key, tool_name, args in self.db.execute("SELECT fingerprint, tool_name, args FROM decisions")
+        }
+
+    @staticmethod
+    def is_valid(tool_name: str, args: dict[str, Any], legal: set[str] | None = None, enemy_ids: set[int] | None = None) -> bool:
+        """Check if the decision can be executed in the turn: the tool is legal, and its target enemy, if any, is on the field.
+
+        Args:
+            tool_name (str): name of the tool
+            args (dict[str, Any]): tool arguments
+            legal (set[str] | None, optional): names of the tools the active character can use. Defaults to None - any.
+            enemy_ids (set[int] | None, optional): IDs of the enemies on the field. Defaults to None - any.
+
+        Returns:
+            bool: True if the decision can be executed
+        """
+        if legal is not None and tool_name not in legal:
+            return False
+        return enemy_ids is None or "enemy_id" not in args or args["enemy_id"] in enemy_ids
+
+    def get(self, key: str, legal: set[str] | None = None, enemy_ids: set[int] | None = None) -> tuple[str, dict[str, Any]] | None:
+        """Look up the decision of the turn.
+
+        Args:
+            key (str): fingerprint of the turn, see `fingerprint`
+            legal (set[str] | None, optional): names of the tools the active character can use. Defaults to None - any.
+            enemy_ids (set[int] | None, optional): IDs of the enemies on the field. Defaults to None - any.
+
+        Returns:
+            tuple[str, dict[str, Any]] | None: tool name, and tool arguments. None - ask the reasoner: a miss, invalid decision, or exploration
+        """
+        # Exploration lasts until the next `put`, or the next lookup
+        self.exploring = None
+        decision = self.entries.get(key)
+        if decision is None or not self.is_valid(*decision, legal, enemy_ids):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.db.execute("UPDATE decisions SET last_used = ?, uses = uses + 1 WHERE fingerprint = ?", (time(), key))
+        self.db.commit()
+        if self.random.random() < self.explore_rate:
+            self.explored += 1
+            self.exploring = key
+            logger.debug(f"Decision cache: exploring {key}")
+            return None
+        return decision
+
+    def put(self, key: str, tool_name: str, args: dict[str, Any], legal: set[str] | None = None,
+            enemy_ids: set[int] | None = None) -> bool:
+        """Store the decision of the turn, and evict the least recently used decisions beyond `max_size`.
+
+        Args:
+            key (str): fingerprint of the turn, see `fingerprint`
+            tool_name (str): name of the tool
+            args (dict[str, Any]): tool arguments
+            legal (set[str] | None, optional): names of the tools the active character can use. Defaults to None - any.
+            enemy_ids (set[int] | None, optional): IDs of the enemies on the field. Defaults to None - any.
+
+        Returns:
+            bool: True if stored, False - the decision can't be executed in the turn, see `is_valid`
+        """
+        if not self.is_valid(tool_name, args, legal, enemy_ids):
+            logger.debug(f"Decision cache: {tool_name}({args}) can't be executed in {key}, not stored")
+            self.exploring = None
+            return False
+        if key == self.exploring and self.entries.get(key) == (tool_name, args):
+            self.agreed += 1
+        self.exploring = None
+        self.db.execute("INSERT OR REPLACE INTO decisions VALUES (?, ?, ?, ?, ?, ?, ?)", (key, self.VERSION, tool_name, dumps(args), time(), time(), 0))
+        self.entries[key] = (tool_name, args)
+        excess = len(self.entries) - self.max_size
+        if excess > 0:
+            evicted = self.db.execute("SELECT fingerprint FROM decisions ORDER BY last_used LIMIT ?", (excess,)).fetchall()
+            self.db.executemany("DELETE FROM decisions WHERE fingerprint = ?", evicted)
+            for evicted_key, in evicted:
+                del self.entries[evicted_key]
+        self.db.commit()
+        return True
+
+    def invalidate(self, key: str) -> bool:
+        """Drop the decision of the turn, e.g. when its tool call has failed.
+
+        Args:
+            key (str): fingerprint of the turn, see `fingerprint`
+
+        Returns:
+            bool: True if there was a decision to drop
+        """
+        self.db.execute("DELETE FROM decisions WHERE fingerprint = ?", (key,))
+        self.db.commit()
+        return self.entries.pop(key, None) is not None
+
+    def clear(self) -> int:
+        """Drop all decisions.
+
+        Returns:
+            int: number of dropped decisions
+        """
+        n = self.db.execute("DELETE FROM decisions").rowcount
+        self.db.commit()
+        self.entries.clear()
+        return n
+
+    def stats(self) -> dict[str, int | float]:
+        """Get hit/miss counters. Explored hits count as hits, agreement is the share of them the reasoner has confirmed."""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "explored": self.explored,
+            "agreement": self.agreed / self.explored if self.explored else 0.0,
+            "size": len(self.entries)
+        }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Inspect, and drop cached reasoner decisions")
+    parser.add_argument("path", nargs="?", default="data/decisions.sqlite", help="path/to/decisions.sqlite")
+    parser.add_argument("--list", action="store_true", help="list all decisions")
+    parser.add_argument("--clear", action="store_true", help="drop all decisions")
+    args = parser.parse_args()
+
+    cache = DecisionCache(args.path)
+    if args.clear:
+        print(f"Dropped {cache.clear()} decisions")
+    if args.list:
+        for key, tool_name, tool_args, uses in cache.db.execute("SELECT fingerprint, tool_name, args, uses FROM decisions ORDER BY last_used DESC"):
+            print(f"{key} used {uses} times: {tool_name}({tool_args})")
@@ -0,0 +1,155 @@
+from functools import partial
+from typing import Any, Callable
+from uuid import uuid4
+import numpy as np
+from langchain_core.messages import AIMessage
+
+from state.player_stat import PlayerCharacterStat
+
+
+# Decision of a rule: (tool name, tool arguments, confidence in [0, 1])
+Decision = tuple[str, dict[str, Any], float]
+# Rule: (TurnState, names of the tools the active character can use) -> decision, or None if the rule doesn't apply
+Rule = Callable[[object, set[str]], Decision | None]
+
+
+def active_character(turn_state: object) -> PlayerCharacterStat | None:
+    for character in turn_state["player_characters"]:
+        if character.is_active:
+            return character
+    return None
+
+
+def _in_danger(turn_state: object, hp_ratio: float) -> bool:
+    """Check if any living character has HP below `hp_ratio` of max - healing, or defending may matter more than damage."""
+    return any(0 < character.hp < hp_ratio * character.hp_max for character in turn_state["player_characters"])
+
+
+def last_enemy(turn_state: object, legal: set[str], danger_hp_ratio: float = 0.25) -> Decision | None:
+    """A single enemy is left: basic attack if it is within reach, craft, or art otherwise.
+
+    Args:
+        turn_state (object): TurnState
+        legal (set[str]): names of the tools the active character can use
+        danger_hp_ratio (float, optional): HP ratio of a character in danger, see `_in_danger`. Defaults to 0.25.
+
+    Returns:
+        Decision | None: decision, None - more than one enemy, or no damaging tool
+    """
+    enemies = [enemy for enemy in turn_state["enemies"] if enemy.hp > 0]
+    if len(enemies) != 1:
+        return None
+
+    enemy = enemies[0]
+    penalty = 0.3 if _in_danger(turn_state, danger_hp_ratio) else 0.0
+    if enemy.basic_attack_enabled and "action_attack" in legal:
+        return "action_attack", {"enemy_id": enemy.enemy_id}, 0.9 - penalty
+    if "action_use_craft" in legal:
+        return "action_use_craft", {"enemy_id": enemy.enemy_id}, 0.85 - penalty
+    if "action_use_art" in legal:
+        # Arts are cast with a delay
+        return "action_use_art", {"enemy_id": enemy.enemy_id}, 0.6 - penalty
+    return None
+
+
+def finishing_blow(turn_state: object, legal: set[str], hp_ratio: float = 0.1, danger_hp_ratio: float = 0.25) -> Decision | None:
+    """Basic attack on the weakest enemy within reach with HP below `hp_ratio` of max.
+
+    Args:
+        turn_state (object): TurnState
+        legal (set[str]): names of the tools the active character can use
+        hp_ratio (float, optional): max HP ratio of an enemy to finish off. Defaults to 0.1.
+        danger_hp_ratio (float, optional): HP ratio of a character in danger, see `_in_danger`. Defaults to 0.25.
+
+    Returns:
+        Decision | None: decision, None - no such enemy, or basic attack isn't available
+    """
+    if "action_attack" not in legal:
+        return None
+    candidates = [enemy for enemy in turn_state["enemies"] if enemy.basic_attack_enabled and 0 < enemy.hp <= hp_ratio * enemy.hp_max]
+    if not candidates:
+        return None
+
+    enemy = min(candidates, key=lambda enemy: enemy.hp)
+    # Several candidates - it may matter which one goes first
+    confidence = 0.95 if len(candidates) == 1 else 0.85
+    if _in_danger(turn_state, danger_hp_ratio):
+        confidence -= 0.3
+    return "action_attack", {"enemy_id": enemy.enemy_id}, confidence
+
+
+def tool_call_message(tool_name: str, args: dict[str, Any], content: str = "") -> AIMessage:
+    """Get reasoner-like message with a single tool call, for `ToolNode` to execute."""
+    return AIMessage(content=content, tool_calls=[{"name": tool_name, "args": args, "id": f"call_{uuid4().hex}", "type": "tool_call"}])
+
+
+def rule_name(rule: Rule) -> str:
+    return rule.func.__name__ if isinstance(rule, partial) else getattr(rule, "__name__", repr(rule))
+
+
+class FastPathPolicy:
+    """Deterministic rules over `TurnState` in front of the reasoner.
+
+    Every rule either passes, or proposes a tool call with confidence. The most confident proposal is taken if its confidence
+    reaches `min_confidence`, the reasoner decides otherwise. Proposal is turned into the same `AIMessage` with `tool_calls`
+    the reasoner returns, so `ToolNode` executes it as is.
+    Turn latencies are recorded by path - "rule", "reasoner", or any other way the turn is decided -
+    to report how often, and how much the reasoner is bypassed.
+    """
+    def __init__(self, rules: list[Rule] | None = None, min_confidence: float = 0.8, finish_hp_ratio: float = 0.1,
+                 danger_hp_ratio: float = 0.25):
+        """
+        Args:
+            rules (list[Rule] | None, optional): rules to try. Defaults to None - `last_enemy`, and `finishing_blow`.
+            min_confidence (float, optional): minimal confidence of a rule to bypass the reasoner. Defaults to 0.8.
+            finish_hp_ratio (float, optional): max HP ratio of an enemy to finish off, see `finishing_blow`. Defaults to 0.1.
+            danger_hp_ratio (float, optional): HP ratio of a character in danger, lowers confidence of default rules. Defaults to 0.25.
+        """
+        self.rules = rules if rules is not None else [
+            partial(last_enemy, danger_hp_ratio=danger_hp_ratio),
+            partial(finishing_blow, hp_ratio=finish_hp_ratio, danger_hp_ratio=danger_hp_ratio)
+        ]
+        self.min_confidence = min_confidence
+        # Turn latencies, seconds, by path
+        self.latencies: dict[str, list[float]] = {"rule": [], "reasoner": []}
+
+    def decide(self, turn_state: object, legal: set[str]) -> tuple[str, Decision] | None:
+        """Get the most confident decision of the rules.
+
+        Args:
+            turn_state (object): TurnState
+            legal (set[str]): names of the tools the active character can use
+
+        Returns:
+            tuple[str, Decision] | None: name of the rule, and its decision. None - ask the reasoner
+        """
+        best = None
+        for rule in self.rules:
+            decision = rule(turn_state, legal)
+            if decision is not None and decision[0] in legal and (best is None or decision[2] > best[1][2]):
+                best = (rule_name(rule), decision)
+        if best is None or best[1][2] < self.min_confidence:
+            return None
+        return best
+
+    @staticmethod
+    def to_message(rule: str, decision: Decision) -> AIMessage:
+        """Get reasoner-like message with the tool call of the decision."""
+        tool_name, args, confidence = decision
+        return tool_call_message(tool_name, args, f"Fast path: rule {rule} with confidence {confidence:.2f}")
+
+    def record(self, path: str, latency: float) -> None:
+        """Record turn latency, seconds, of the path, e.g. "rule", or "reasoner"."""
+        self.latencies.setdefault(path, []).append(latency)
+
+    def stats(self) -> dict[str, float | int]:
+        """Get bypass rate - share of turns decided without the reasoner, and turn latency percentiles, seconds, by path."""
+        every = [latency for latencies in self.latencies.values() for latency in latencies]
+        n_reasoner = len(self.latencies["reasoner"])
+        stats = {"turns": len(every), "bypass_rate": 1 - n_reasoner / len(every) if every else 0.0}
+        for path, latencies in self.latencies.items():
+            for q in (50, 90, 99):
+                stats[f"{path}_p{q}"] = float(np.percentile(latencies, q)) if latencies else 0.0
+        for q in (50, 90, 99):
+            stats[f"turn_p{q}"] = float(np.percentile(every, q)) if every else 0.0
+        return stats
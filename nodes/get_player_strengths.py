@@ -1,19 +1,36 @@
+from concurrent.futures import Future
+from typing import Callable
 import torch
 from loguru import logger
 from tools.controller import Controller
 from nodes.vlm_wrapper import VLMWrapper
-from nodes.vlm_node import VLMNode
 from nodes.graph_state import CombatState, AgentConfig, TurnState
 from state.player_stat import PlayerCharacterStat
+from vision.digits import DigitReader
+
+
+def parse_pair(first: str, second: str) -> Callable[[str], dict[str, int]]:
+    """Get parser of VLM answer with "...Strength: N" and "...Defense: M" lines into {first: N, second: M}."""
+    def parse(result: str) -> dict[str, int]:
+        params = {}
+        for line in result.lower().splitlines():
+            if "str" in line:
+                params[first] = int(line.split(":")[-1])
+            if "def" in line:
+                params[second] = int(line.split(":")[-1])
+        return params
+    return parse
 
 
 class GetPlayerStrengthsNode:
     """Get player strengths node. Query first four characters before the combat happens, then just quickly passes control to next node.
     
-    Relies on VLM, and Controller.
+    Relies on digit reader, VLM, and Controller. VLM reads only what digit reader isn't sure about.
+    VLM queries are queued, and the node moves on to the next character while VLM worker answers them.
     """
-    def __init__(self, vlm: VLMWrapper, controller: Controller):
+    def __init__(self, vlm: VLMWrapper, controller: Controller, digits: DigitReader | None = None):
         self.vlm = vlm
+        self.digits = digits or DigitReader()
         self.controller = controller
         # Initialize four default PlayerCharacterStat objects
         self.player_characters = [
@@ -32,7 +49,7 @@ class GetPlayerStrengthsNode:
             return state
         
         # Get config
-        path_to_screenshot = config["configurable"]["path_to_screenshot"]
+        debug_frame_path = Controller.debug_frame_path(config)
         seed = config["configurable"]["seed_vlm_node"]
         character_atk_def_origin = config["configurable"]["character_atk_def_origin"]
         character_atk_def_size = config["configurable"]["character_atk_def_size"]
@@ -40,6 +57,8 @@ class GetPlayerStrengthsNode:
         character_ats_adf_size = config["configurable"]["character_ats_adf_size"]
         character_speed_origin = config["configurable"]["character_speed_origin"]
         character_speed_size = config["configurable"]["character_speed_size"]
+        digit_reader = config["configurable"]["digit_reader"]
+        min_confidence = config["configurable"]["digit_reader_min_confidence"]
 
         logger.debug("---CHARACTER STRENGTHS: GETTING PLAYER CHARACTERS STRENGTHS---")
         # 0. Assume agent is out of combat
@@ -47,59 +66,64 @@ class GetPlayerStrengthsNode:
         # 2. Go to character screen
         self.controller.action_open_character_screen()
         # 3. Extract basic parameters
+        params: list[dict[str, int]] = [{} for _ in self.player_characters]
+        # (character index, VLM answer, parser of the answer)
+        queued: list[tuple[int, Future, Callable[[str], dict[str, int]]]] = []
         for idx, _ in enumerate(self.player_characters):
-            img_character_screen = self.controller.screenshot(path_to_screenshot)
+            img_character_screen = self.controller.screenshot(debug_frame_path)
             # 3.1. Attack/Def - Origin: 1280, 310. Size (W,H): 250,64
             origin = character_atk_def_origin #(1280, 310)
             size = character_atk_def_size #(250, 64)
-            img_atk_def = img_character_screen.crop(VLMNode.get_crop_box(origin, size))
-            text_prompt_atk_def = """First value is Strength, and second value is Defense. What are these values? Be very concise.""" # ok
-            # seed = 1741
-            torch.manual_seed(seed)
-            result = self.vlm(text=text_prompt_atk_def, image=img_atk_def)[0]
-            # Extract values
-            params = {}
-            for line in result.lower().splitlines():
-                if "str" in line:
-                    params["str"] = int(line.split(":")[-1])
-                if "def" in line:
-                    params["def"] = int(line.split(":")[-1])
+            img_atk_def = img_character_screen.crop(origin, size)
+            numbers = self.digits.read(img_atk_def, "character_screen", 2, min_confidence) if digit_reader else None
+            if numbers is not None:
+                params[idx]["str"], params[idx]["def"] = numbers
+            else:
+                text_prompt_atk_def = """First value is Strength, and second value is Defense. What are these values? Be very concise.""" # ok
+                # seed = 1741
+                torch.manual_seed(seed)
+                queued.append((idx, self.vlm.submit([(text_prompt_atk_def, img_atk_def, "digit_crop")]), parse_pair("str", "def")))
 
             # 3.2. Arts attack/Arts def - Origin: 1284, 370. Size (W,H): 250,64
             origin = character_ats_adf_origin #(1284, 370)
             size = character_ats_adf_size #(250, 64)
-            img_ats_adf = img_character_screen.crop(VLMNode.get_crop_box(origin, size))
-            text_prompt_ats_adf = """First value is Arts Strength, and second value is Arts Defense. What are these values? Be very concise.""" # ok
-            # seed = 1741
-            torch.manual_seed(seed)
-            result = self.vlm(text=text_prompt_ats_adf, image=img_ats_adf)[0]
-            for line in result.lower().splitlines():
-                if "str" in line:
-                    params["ats"] = int(line.split(":")[-1])
-                if "def" in line:
-                    params["adf"] = int(line.split(":")[-1])
+            img_ats_adf = img_character_screen.crop(origin, size)
+            numbers = self.digits.read(img_ats_adf, "character_screen", 2, min_confidence) if digit_reader else None
+            if numbers is not None:
+                params[idx]["ats"], params[idx]["adf"] = numbers
+            else:
+                text_prompt_ats_adf = """First value is Arts Strength, and second value is Arts Defense. What are these values? Be very concise.""" # ok
+                # seed = 1741
+                torch.manual_seed(seed)
+                queued.append((idx, self.vlm.submit([(text_prompt_ats_adf, img_ats_adf, "digit_crop")]), parse_pair("ats", "adf")))
 
             # 3.3. Speed - Origin: 1668,364. Size (W,H): 38,30
             origin = character_speed_origin #(1668,364)
             size = character_speed_size #(38,30)
-            img_speed = img_character_screen.crop(VLMNode.get_crop_box(origin, size))
-            text_prompt_speed = """What number is it? Just give the number.""" # ok
-            # seed = 1741
-            torch.manual_seed(seed)
-            result = self.vlm(text=text_prompt_speed, image=img_speed)[0]
-            params["speed"] = int(result)
+            img_speed = img_character_screen.crop(origin, size)
+            numbers = self.digits.read(img_speed, "character_screen", 1, min_confidence) if digit_reader else None
+            if numbers is not None:
+                params[idx]["speed"] = numbers[0]
+            else:
+                text_prompt_speed = """What number is it? Just give the number.""" # ok
+                # seed = 1741
+                torch.manual_seed(seed)
+                queued.append((idx, self.vlm.submit([(text_prompt_speed, img_speed, "digit_crop")]), lambda result: {"speed": int(result)}))
 
-            # Update stats
-            self.player_characters[idx].attack = params["str"]
-            self.player_characters[idx].defense = params["def"]
-            self.player_characters[idx].arts_attack = params["ats"]
-            self.player_characters[idx].arts_defense = params["adf"]
-            self.player_characters[idx].speed = params["speed"]
-
-            # 4. Select next character
+            # 4. Select next character. Queued VLM queries are answered meanwhile
             self.controller.action_next_menu_item()
 
         self.controller.action_close_character_screen()
+
+        # Update stats
+        for idx, answer, parse in queued:
+            params[idx] |= parse(answer.result()[0])
+        for character, character_params in zip(self.player_characters, params):
+            character.attack = character_params["str"]
+            character.defense = character_params["def"]
+            character.arts_attack = character_params["ats"]
+            character.arts_defense = character_params["adf"]
+            character.speed = character_params["speed"]
         self.need_to_update = False
 
         # Update agent's state to reflect garnered info
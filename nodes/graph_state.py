@@ -1,8 +1,10 @@
 from typing_extensions import TypedDict
 from langgraph.graph import MessagesState
+import numpy as np
 
 from state.enemy_stat import EnemyStat
 from state.player_stat import PlayerCharacterStat
+from state import compact
 
 
 class TurnState(TypedDict):
@@ -10,6 +12,8 @@ class TurnState(TypedDict):
     enemies: list[EnemyStat]
     enemy_coords: list[tuple[int,int]] | None  # Coordinates of enemy portraits in turn-order region
     player_characters: list[PlayerCharacterStat]
+    enemy_panels: list[dict[str, np.ndarray]] | None  # Stat panel crops of `enemies` - to re-read only what has changed next turn
+    target_order: list[int] | None  # Enemy IDs in order of F presses, observed while profiling. None - unknown
 
     @staticmethod
     def to_prompt(turn_state: object) -> str:
@@ -29,6 +33,38 @@ class TurnState(TypedDict):
 
         return f"# CHARACTERS STATS\n{character_str_context}\n\n{active_character_str_context}\n\n# ENEMIES STATS\n{enemy_str_context}"
 
+    @staticmethod
+    def party_prompt(turn_state: object, fmt: str = "text") -> str:
+        """Get static part of LLM reasoner context - strengths of player characters. It's the same turn after turn.
+
+        Args:
+            turn_state (object): TurnState
+            fmt (str, optional): "text", "table", or "json", see `state.compact`. Defaults to "text".
+        """
+        character_str_context = compact.section("strengths", [compact.strength_row(character, fmt) for character in turn_state["player_characters"]], fmt)
+        legend = f"{compact.LEGEND[fmt]}\n\n" if fmt in compact.LEGEND else ""
+        return f"{legend}# CHARACTERS STRENGTHS\n{character_str_context}"
+
+    @staticmethod
+    def turn_prompt(turn_state: object, fmt: str = "text") -> str:
+        """Get volatile part of LLM reasoner context - status of player characters, active character, and enemies.
+
+        Rows of units are re-rendered only if the units have changed since the last turn, see `state.compact.RowCache`.
+
+        Args:
+            turn_state (object): TurnState
+            fmt (str, optional): "text", "table", or "json", see `state.compact`. Defaults to "text".
+        """
+        enemy_str_context = compact.section("enemies", [compact.enemy_row(enemy, fmt) for enemy in turn_state["enemies"]], fmt)
+        character_str_context = compact.section("status", [compact.status_row(character, fmt) for character in turn_state["player_characters"]], fmt)
+
+        active_character_str_context = ""
+        for character in turn_state["player_characters"]:
+            if character.is_active:
+                active_character_str_context = f"You can give orders to Character {character.character_id}."
+
+        return f"# CHARACTERS STATUS\n{character_str_context}\n\n{active_character_str_context}\n\n# ENEMIES STATS\n{enemy_str_context}"
+
 
 
 class CombatState(MessagesState):
@@ -41,22 +77,69 @@ class AgentConfig(TypedDict):
     """Agent config.
         seed_vlm - seed for agentic use of VLM outside of VLMNode
         seed_vlm_node - seed for VLM to use inside of VLMNode
-        path_to_screenshot - path to where the screenshot is stored
-        timeout_screenshot_sec - timeout between taking two screenshots
+        path_to_screenshot - path to write captured frames to in debug mode
+        debug_save_frames - write every captured frame to `path_to_screenshot`. Frames are kept in memory otherwise
+        timeout_screenshot_sec - max interval between two samples of command-menu region while waiting for agent's turn
+        wait_region_origin, wait_region_size - command-menu region sampled while waiting for agent's turn
+        wait_poll_min_sec - interval between two samples while the region changes
+        wait_poll_backoff - growth factor of sampling interval while nothing happens
+        wait_change_threshold - min mean pixel difference of two samples to consider the region changed
+        wait_settle_threshold - max mean pixel difference of two samples to consider the region still
+        wait_settle_samples - number of still samples in a row to classify the screen
+        wait_timeout_sec - max duration of waiting for agent's turn
+        vlm_batch_profiling - send all enemy profiling queries to VLM in a single batch
+        pipelined_profiling - cycle targets in a thread while VLM profiles already captured enemies
+        profiling_queue_size - max number of captured enemies waiting for VLM
+        target_settle_sec - max wait after target change for "View Specifics" panel to settle
+        digit_reader - read numeric stat panels with glyph templates, VLM reads only the uncertain ones
+        digit_reader_min_confidence - minimal confidence of digit reader to trust its read
+        ailment_classifier - classify ailment susceptibility symbols by their pixels, VLM reads them only if unsure
+        ailment_classifier_min_confidence - minimal confidence of ailment classifier to trust its result
+        reach_detector - look for red X of enemy out of reach by its pixels, VLM looks for it if none is found.
+            Off until validated on real out-of-reach screenshots
+        reach_detector_min_confidence - minimal confidence of reach detector to trust its result
+        incremental_profiling - re-read only stat panels of enemies that changed since the previous turn
+        enemy_panel_min_changed_pixels - min number of changed pixels of stat panel to re-read it
+        bestiary - keep weaknesses and ailment susceptibilities of every met enemy type on disk, and don't re-read them
+        bestiary_path - path to bestiary SQLite database
+        bestiary_tolerance - max number of differing bits of name plate hashes of the same enemy type
     """
     seed_vlm: int = 1643
     seed_vlm_node: int = 1741
     path_to_screenshot: str = "imgs\\screenshot.png"
-    timeout_screenshot_sec: float = 2.5
+    timeout_screenshot_sec: float = 0.5
+    wait_region_origin: tuple[int, int] = (0, 640)
+    wait_region_size: tuple[int, int] = (720, 400)
+    wait_poll_min_sec: float = 0.05
+    wait_poll_backoff: float = 1.5
+    wait_change_threshold: float = 8.0
+    wait_settle_threshold: float = 2.0
+    wait_settle_samples: int = 3
+    wait_timeout_sec: float = 300.0
+    vlm_batch_profiling: bool = True
+    pipelined_profiling: bool = True
+    profiling_queue_size: int = 2
+    target_settle_sec: float = 0.2
+    digit_reader: bool = True
+    digit_reader_min_confidence: float = 0.3
+    ailment_classifier: bool = True
+    ailment_classifier_min_confidence: float = 0.5
+    reach_detector: bool = False
+    reach_detector_min_confidence: float = 0.6
+    incremental_profiling: bool = True
+    enemy_panel_min_changed_pixels: int = 24
+    bestiary: bool = True
+    bestiary_path: str = "data/bestiary.sqlite"
+    bestiary_tolerance: int = 32
     # Settings to process screenshots with VLM Node. All values are in pixels. Default resolution: 1920x1080
     game_turn_order_region_origin: tuple[int, int] = (660, 45)
     game_turn_order_region_crop_size: tuple[int, int] = (900, 140)
     game_turn_order_enemy_shade_rgb: tuple[int, int, int] = (219, 0, 72)
     game_turn_order_enemy_max_distance: int = 10
-    enemy_stat_hp_origin: tuple[int,int] = (1566,284)
-    enemy_stat_hp_size: tuple[int,int] = (200,28)
-    enemy_stat_stun_origin: tuple[int,int] = (1566, 320)
-    enemy_stat_stun_size: tuple[int,int] = (60,30)
+    enemy_stat_hp_origin: tuple[int,int] = (1552,284)
+    enemy_stat_hp_size: tuple[int,int] = (214,28)
+    enemy_stat_stun_origin: tuple[int,int] = (1553, 320)
+    enemy_stat_stun_size: tuple[int,int] = (73,30)
     enemy_stat_atk_ats_speed_origin: tuple[int,int] = (1566,382)
     enemy_stat_atk_ats_speed_size: tuple[int,int] = (50,102)
     enemy_stat_def_adf_origin: tuple[int,int] = (1704,382)
@@ -69,6 +152,10 @@ class AgentConfig(TypedDict):
     enemy_stat_ailments_left_size: tuple[int, int] = (40, 174)
     enemy_stat_ailments_right_origin: tuple[int, int] = (1750, 700)
     enemy_stat_ailments_right_size: tuple[int, int] = (40, 174)
+    enemy_reach_region_origin: tuple[int, int] = (760, 230) # Region around targeting reticle
+    enemy_reach_region_size: tuple[int, int] = (400, 420)
+    enemy_name_plate_origin: tuple[int, int] = (1455, 242)
+    enemy_name_plate_size: tuple[int, int] = (300, 36)
     enemy_target_detect_origin_delta: tuple[int, int] = (20, 0)
     enemy_target_detect_size: int = 10
     character_strength_origin: list[tuple[int, int]] = [(90, 108), (90, 208), (90, 308), (90, 408)] # 1st, 2nd, 3rd, 4th
@@ -84,4 +171,17 @@ class AgentConfig(TypedDict):
     reasoner_model_name: str = "openai/qwen3-30b-a3b"
     reasoner_system_prompt: str = ""
     reasoner_nothink_prompt: bool = False # True - turn off reasoning
+    reasoner_cache_prompt: bool = True # Ask llama-server to reuse KV cache of the common prompt prefix
+    reasoner_slot: int = 0 # llama-server slot to pin reasoner requests to, so its KV cache holds the previous turn. -1 - any idle slot
+    reasoner_context_format: str = "text" # Format of turn context: "text" - sentences, "table" - fixed-column table, "json" - minified JSON
+    reasoner_dynamic_tools: bool = True # Offer only the tools the active character can use this turn
+    reasoner_fast_path: bool = True # Decide obvious turns with rules, see `nodes.fast_path`. The reasoner decides the rest
+    reasoner_fast_path_min_confidence: float = 0.8 # Minimal confidence of a rule to bypass the reasoner
+    reasoner_fast_path_finish_hp_ratio: float = 0.1 # Max HP ratio of an enemy within reach to finish it off with basic attack
+    reasoner_decision_cache: bool = True # Decide turns seen before the same way, see `nodes.decision_cache`
+    reasoner_decision_cache_path: str = "data/decisions.sqlite" # SQLite database of cached decisions
+    reasoner_decision_cache_size: int = 4096 # Max number of cached decisions, least recently used are evicted
+    reasoner_decision_cache_explore_rate: float = 0.1 # Share of cache hits sent to the reasoner anyway
+    reasoner_decision_cache_hp_buckets: int = 4 # Number of HP buckets of turn fingerprint
     debug_reasoner_off: bool = False
+    debug_save_frames: bool = False
@@ -1,14 +1,27 @@
+from hashlib import blake2b
+from time import perf_counter
 from loguru import logger
 from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
 from litellm.exceptions import APIError
 
 from tools.controller import Controller
 from nodes.llm_wrapper import LLMWrapper
+from nodes.fast_path import FastPathPolicy, tool_call_message
+from nodes.decision_cache import DecisionCache, fingerprint
 from nodes.graph_state import CombatState, AgentConfig, TurnState
 
 
 class LLMNode:
     """LLM Node responsible for thinking about the next action to take.
+
+    Request is laid out for llama-server prompt cache: system prompt and tool schemas, then strengths of player characters,
+    which stay the same during combat, and only then the turn context. Only the turn context is prefilled every turn.
+    With `reasoner_dynamic_tools` only the tools the active character can use are offered, see `Controller.get_legal_tools`.
+    Qwen3 chat template renders tool schemas into the system message, after its text, and ahead of every other message,
+    so a change of the subset invalidates the prefix from the tools on - strengths of characters included. It's rare - once EP,
+    or CP runs out, or reach of the enemies changes.
+    With `reasoner_fast_path` obvious turns are decided by rules without the reasoner, see `nodes.fast_path.FastPathPolicy`.
+    With `reasoner_decision_cache` turns seen before are decided the same way, see `nodes.decision_cache.DecisionCache`.
     """
     system_prompt: SystemMessage
     max_tokens: int = 4096
@@ -18,6 +31,12 @@ class LLMNode:
         self.controller = controller
         self.disabled = True
         self.nothink_prompt = False
+        # Hash of the static part of the previous request. Its change invalidates llama-server prompt cache
+        self.prefix_hash = None
+        self.policy: FastPathPolicy | None = None
+        self.decisions: DecisionCache | None = None
+        # Fingerprint of the last turn whose decision is in the decision cache
+        self.decided_turn: str | None = None
 
     def __call__(self, state: CombatState, config: AgentConfig) -> str:
         self.disabled = config["configurable"]["debug_reasoner_off"]
@@ -37,7 +56,8 @@ class LLMNode:
             self.nothink_prompt = config["configurable"]["reasoner_nothink_prompt"]
             logger.warning("Starting LLM Node")
             self.system_prompt = SystemMessage(content=config["configurable"]["reasoner_system_prompt"])
-            self.llm = LLMWrapper(system_prompt=self.system_prompt, max_tokens=self.max_tokens, model=config["configurable"]["reasoner_model_name"])
+            self.llm = LLMWrapper(system_prompt=self.system_prompt, max_tokens=self.max_tokens, model=config["configurable"]["reasoner_model_name"],
+                                  cache_prompt=config["configurable"]["reasoner_cache_prompt"], id_slot=config["configurable"]["reasoner_slot"])
             try:
                 self.llm(r"Hi/no_think")
                 self.llm.bind_tools(self.controller.get_tools())
@@ -48,27 +68,100 @@ class LLMNode:
                 exit(-1)
 
         logger.debug("---REASONER IS PLANNING---")
-        # 1. Convert context from the current turn's TurnState object
-        turn_context = TurnState.to_prompt(state["turn_state"])
-        logger.info(f"Turn context:\n{turn_context}")
+        t0 = perf_counter()
+        self.decided_turn = None
+        legal_tools = self.controller.get_legal_tools(state["turn_state"])
+        legal = {t.name for t in legal_tools}
+        if self.policy is None:
+            self.policy = FastPathPolicy(min_confidence=config["configurable"]["reasoner_fast_path_min_confidence"],
+                                         finish_hp_ratio=config["configurable"]["reasoner_fast_path_finish_hp_ratio"])
+        # 0. Obvious turns are decided by rules
+        if config["configurable"]["reasoner_fast_path"]:
+            decision = self.policy.decide(state["turn_state"], legal)
+            if decision is not None:
+                result = FastPathPolicy.to_message(*decision)
+                self._record("rule", perf_counter() - t0)
+                logger.info(f"Fast path decision:\n{result}")
+                return {
+                    "messages": [result],
+                    "turn_state": state["turn_state"]
+                }
+
+        # Turns seen before are decided the same way
+        turn_key = None
+        enemy_ids = {enemy.enemy_id for enemy in state["turn_state"]["enemies"]}
+        if config["configurable"]["reasoner_decision_cache"]:
+            if self.decisions is None:
+                self.decisions = DecisionCache(path=config["configurable"]["reasoner_decision_cache_path"],
+                                               max_size=config["configurable"]["reasoner_decision_cache_size"],
+                                               explore_rate=config["configurable"]["reasoner_decision_cache_explore_rate"])
+            turn_key = fingerprint(state["turn_state"], hp_buckets=config["configurable"]["reasoner_decision_cache_hp_buckets"])
+            cached = self.decisions.get(turn_key, legal, enemy_ids)
+            if cached is not None:
+                self.decided_turn = turn_key
+                result = tool_call_message(*cached, content=f"Decision cache: turn {turn_key}")
+                self._record("cache", perf_counter() - t0)
+                logger.info(f"Cached decision:\n{result}")
+                return {
+                    "messages": [result],
+                    "turn_state": state["turn_state"]
+                }
+
+        # Offer only the tools the active character can use
+        if config["configurable"]["reasoner_dynamic_tools"]:
+            self.llm.bind_tools(legal_tools)
+        # 1. Convert context from the current turn's TurnState object: static part, and the turn itself
+        context_format = config["configurable"]["reasoner_context_format"]
+        party_context = HumanMessage(content=TurnState.party_prompt(state["turn_state"], context_format))
+        turn_context = TurnState.turn_prompt(state["turn_state"], context_format)
+        logger.info(f"Turn context:\n{party_context.content}\n\n{turn_context}")
+        prefix_hash = blake2b(f"{self.llm.tool_names}\n{self.system_prompt.content}\n{party_context.content}".encode(), digest_size=8).hexdigest()
+        if prefix_hash != self.prefix_hash:
+            logger.info(f"Reasoner: static prompt prefix {prefix_hash} has changed, it will be prefilled")
+            self.prefix_hash = prefix_hash
         
-        # 2. Conflate system message, context, and prompt
+        # 2. Conflate system message, context, and prompt. Static part goes first
         reasoner_prompt = f"{turn_context}\n\nIt is your turn now. Give order to the active character."
         if self.nothink_prompt:
             reasoner_prompt += "/no_think"
         reasoner_prompt = HumanMessage(content=reasoner_prompt)
-        result = self.llm(reasoner_prompt)
+        result = self.llm([self.system_prompt, party_context, reasoner_prompt])
         logger.info(f"Reasoner decision:\n{result}")
         if len(result.tool_calls) == 0:
             logger.debug("LLM Node: No tool calling. Re-run with enabled reasoning")
-            result = self.llm(reasoner_prompt.replace("/no_think", ""))
+            reasoner_prompt = HumanMessage(content=reasoner_prompt.content.replace("/no_think", ""))
+            result = self.llm([self.system_prompt, party_context, reasoner_prompt])
+        self._record("reasoner", perf_counter() - t0)
+        if turn_key is not None and len(result.tool_calls) > 0:
+            if self.decisions.put(turn_key, result.tool_calls[0]["name"], result.tool_calls[0]["args"], legal, enemy_ids):
+                self.decided_turn = turn_key
+        elif turn_key is not None:
+            # Nothing to compare the explored decision with
+            self.decisions.exploring = None
 
         return {
             "messages": [
                 self.system_prompt,
+                party_context,
                 reasoner_prompt,
                 result
             ],
             "turn_state": state["turn_state"]
         }
 
+    def forget_decision(self) -> None:
+        """Drop the cached decision of the last turn - its tool call has failed."""
+        if self.decisions is not None and self.decided_turn is not None and self.decisions.invalidate(self.decided_turn):
+            logger.warning(f"Decision cache: tool call has failed, decision of {self.decided_turn} is dropped")
+        self.decided_turn = None
+
+    def _record(self, path: str, latency: float) -> None:
+        """Record turn latency of the path, and log bypass rate, latency percentiles, and decision cache hit rate."""
+        self.policy.record(path, latency)
+        stats = self.policy.stats()
+        percentiles = ", ".join(f"{p} p50/p90 {stats[f'{p}_p50']:.3f}/{stats[f'{p}_p90']:.3f}s" for p in self.policy.latencies)
+        logger.info(f"Reasoner: {path} turn {latency:.3f}s. Bypass rate {stats['bypass_rate']:.0%} of {stats['turns']} turns, {percentiles}")
+        if self.decisions is not None:
+            cache_stats = self.decisions.stats()
+            logger.info(f"Decision cache: hit rate {cache_stats['hit_rate']:.0%}, {cache_stats['explored']} explored, "
+                        f"agreement {cache_stats['agreement']:.0%}, {cache_stats['size']} decisions")
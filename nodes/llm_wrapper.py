@@ -1,14 +1,25 @@
+from time import perf_counter
 from typing import overload
-from langchain_core.messages import SystemMessage, HumanMessage, AIMessage, AnyMessage
+from loguru import logger
+from langchain_core.messages import SystemMessage, HumanMessage, AIMessage, AnyMessage, message_chunk_to_message
 from langchain_core.runnables import Runnable
 from langchain_litellm import ChatLiteLLM
 
 
 class LLMWrapper:
     """LLM Node to reason about the next player character's action
+
+    llama-server keeps KV cache of the last prompt in a slot. With `cache_prompt` it prefills only the part of the prompt
+    after the longest common prefix with the previous one, so the static part of the prompt must come first, and stay
+    byte-identical. Requests are pinned to slot `id_slot`, otherwise the previous turn may live in another slot.
+    Responses are streamed to measure time to first token.
+    Runnables bound to tools are kept per distinct set of tools, so switching between the sets costs nothing after the first time.
     """
     def __init__(self, system_prompt: SystemMessage, max_tokens: int = 512, model: str = "openai/qwen3-30b-a3b",
-                 temperature: float = 0.6, top_k: int = 20, top_p: float = 0.95, min_p: float = 0.01):
+                 temperature: float = 0.6, top_k: int = 20, top_p: float = 0.95, min_p: float = 0.01,
+                 cache_prompt: bool = True, id_slot: int = 0):
+        # Stats of the last request: time to first token, total time, prompt tokens, and prompt tokens served from KV cache
+        self.last_stats: dict[str, float | int | None] = {}
         self.llm = ChatLiteLLM(
             model=model,
             api_base="http://127.0.0.1:8080",
@@ -19,20 +30,36 @@ class LLMWrapper:
             top_p=top_p,
             model_kwargs={
                 "min_p" : min_p,
-                "repeat_penalty":1.17
+                "repeat_penalty":1.17,
+                # llama-server extensions
+                "cache_prompt": cache_prompt,
+                "id_slot": id_slot
             }
         )
 
         self.system_prompt = system_prompt
+        # Model without tools, and models bound to tools by names of the tools
+        self.base_llm = self.llm
+        self.bound_llms: dict[tuple[str, ...], Runnable] = {}
+        self.tool_names: tuple[str, ...] = ()
 
     def bind_tools(self, tools: list[Runnable] | None = None) -> None:
         """Bind tools. Wrapper for Runnable.bind_tools() method.
 
+        Tools replace the previously bound ones. Bound runnable is memoized by names of the tools, in their order -
+        the order is a part of the prompt.
+
         Args:
-            tools (list[Runnable] | None, optional): List of tools to bind.
+            tools (list[Runnable] | None, optional): List of tools to bind. None, or empty list - unbind tools.
         """
-        if tools:
-            self.llm = self.llm.bind_tools(tools=tools)
+        self.tool_names = tuple(t.name for t in tools or [])
+        if not self.tool_names:
+            self.llm = self.base_llm
+            return
+        if self.tool_names not in self.bound_llms:
+            logger.debug(f"Reasoner: binding tools {self.tool_names}")
+            self.bound_llms[self.tool_names] = self.base_llm.bind_tools(tools=tools)
+        self.llm = self.bound_llms[self.tool_names]
 
     @overload
     def __call__(self, prompt: HumanMessage) -> AIMessage: ...
@@ -42,7 +69,7 @@ class LLMWrapper:
     def __call__(self, prompt: list[AnyMessage]) -> AIMessage: ...
     def __call__(self, prompt: str | HumanMessage | list[AnyMessage]) -> AIMessage:
         if isinstance(prompt, list):
-            result = self.llm.invoke(
+            result = self._invoke(
                 prompt
             )
             return result
@@ -55,7 +82,40 @@ class LLMWrapper:
             prompt
         ]
 
-        return self.llm.invoke(messages)
+        return self._invoke(messages)
+
+    def _invoke(self, messages: list[AnyMessage]) -> AIMessage:
+        """Stream the response, and log time to first token, and number of prompt tokens served from KV cache.
+
+        Empty stream is retried without streaming - time to first token is then the duration of the request.
+        """
+        t0 = perf_counter()
+        ttft = None
+        result = None
+        # Usage is only reported in the last chunk when asked for. Not a parameter of non-streaming requests
+        for chunk in self.llm.stream(messages, stream_options={"include_usage": True}):
+            if ttft is None:
+                ttft = perf_counter() - t0
+            result = chunk if result is None else result + chunk
+
+        if result is None:
+            # Some servers close the stream without a single chunk - e.g. on an error mid-request
+            logger.warning(f"Reasoner: empty stream after {perf_counter() - t0:.2f}s. Falling back to a non-streaming request")
+            t0 = perf_counter()
+            result = self.llm.invoke(messages)
+            ttft = perf_counter() - t0
+
+        usage = result.usage_metadata or {}
+        self.last_stats = {
+            "ttft": ttft,
+            "duration": perf_counter() - t0,
+            "prompt_tokens": usage.get("input_tokens"),
+            # Reported by llama-server builds with `prompt_tokens_details` in usage
+            "cached_tokens": usage.get("input_token_details", {}).get("cache_read")
+        }
+        logger.info(f"Reasoner: TTFT {ttft:.2f}s, total {self.last_stats['duration']:.2f}s, "
+                    f"prompt tokens {self.last_stats['prompt_tokens']}, cached {self.last_stats['cached_tokens']}")
+        return message_chunk_to_message(result)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,155 @@
+import sqlite3
+from collections import OrderedDict
+from hashlib import blake2b
+from json import dumps, loads
+from time import time
+from PIL import Image
+
+
+class VLMCache:
+    """Content-addressed cache of VLM results with LRU eviction.
+
+    Entry is addressed by the request prefix - hash of (prompt, seed, generation parameters), and the image.
+    Image is matched either by hash of its pixels, or, if `tolerance` is set, by perceptual hash (dHash)
+    within `tolerance` differing bits. Optional on-disk tier in SQLite database survives restarts.
+    """
+    def __init__(self, max_size: int = 256, path: str | None = None, max_disk_size: int = 4096, tolerance: int | None = None):
+        """
+        Args:
+            max_size (int, optional): max number of entries in memory. Defaults to 256. 0 - nothing is cached in memory.
+            path (str | None, optional): path/to/cache.sqlite for on-disk tier. Defaults to None - memory only.
+            max_disk_size (int, optional): max number of entries on disk. Defaults to 4096.
+            tolerance (int | None, optional): max Hamming distance of perceptual hashes of two matching images.
+                Defaults to None - images must be identical.
+        """
+        self.max_size = max_size
+        self.max_disk_size = max_disk_size
+        self.tolerance = tolerance
+        # key -> (prefix, image hash, value)
+        self.entries: OrderedDict[str, tuple[str, int, object]] = OrderedDict()
+        # prefix -> {key: image hash}. Used to find perceptually similar images
+        self.prefixes: dict[str, dict[str, int]] = {}
+        self.hits = 0
+        self.misses = 0
+
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, prefix TEXT, image_hash TEXT, value TEXT, last_used REAL)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS cache_prefix ON cache (prefix)")
+            self.db.commit()
+
+    @staticmethod
+    def image_hash(image: Image.Image) -> int:
+        """Get 128-bit hash of image pixels."""
+        digest = blake2b(digest_size=16)
+        digest.update(f"{image.mode}{image.size}".encode())
+        digest.update(image.tobytes())
+        return int.from_bytes(digest.digest(), "big")
+
+    @staticmethod
+    def perceptual_hash(image: Image.Image) -> int:
+        """Get 64-bit difference hash (dHash) of the image."""
+        pixels = image.convert("L").resize((9, 8), Image.Resampling.BILINEAR).tobytes()
+        bits = 0
+        for row in range(8):
+            for col in range(8):
+                bits = (bits << 1) | (pixels[row * 9 + col] < pixels[row * 9 + col + 1])
+        return bits
+
+    @staticmethod
+    def prefix(*params: object) -> str:
+        """Get hash of prompt, seed, and generation parameters."""
+        return blake2b(repr(params).encode(), digest_size=16).hexdigest()
+
+    def key(self, prefix: str, image: Image.Image) -> tuple[str, int]:
+        """Get cache key, and image hash of the request."""
+        image_hash = self.perceptual_hash(image) if self.tolerance is not None else self.image_hash(image)
+        return f"{prefix}:{image_hash:x}", image_hash
+
+    def get(self, prefix: str, image: Image.Image) -> tuple[str, int, object | None]:
+        """Look up cached result.
+
+        Args:
+            prefix (str): request prefix. See `prefix`
+            image (Image.Image): request image
+
+        Returns:
+            tuple[str, int, object | None]: key, and image hash to store the result with, and cached result or None
+        """
+        key, image_hash = self.key(prefix, image)
+        value = self._lookup(key, prefix, image_hash)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return key, image_hash, value
+
+    def put(self, key: str, prefix: str, image_hash: int, value: object) -> None:
+        """Store result."""
+        self._remember(key, prefix, image_hash, value)
+        if self.db is not None:
+            self.db.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?)", (key, prefix, f"{image_hash:x}", dumps(value), time()))
+            self.db.execute("DELETE FROM cache WHERE key NOT IN (SELECT key FROM cache ORDER BY last_used DESC LIMIT ?)", (self.max_disk_size,))
+            self.db.commit()
+
+    def stats(self) -> dict[str, int | float]:
+        """Get hit/miss counters."""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self.entries)
+        }
+
+    def clear(self) -> None:
+        """Drop all entries, including on-disk tier."""
+        self.entries.clear()
+        self.prefixes.clear()
+        if self.db is not None:
+            self.db.execute("DELETE FROM cache")
+            self.db.commit()
+
+    def _lookup(self, key: str, prefix: str, image_hash: int) -> object | None:
+        # 1. Exact match in memory
+        if key not in self.entries and self.tolerance:
+            # 2. Perceptually similar image in memory
+            for similar_key, similar_hash in self.prefixes.get(prefix, {}).items():
+                if (similar_hash ^ image_hash).bit_count() <= self.tolerance:
+                    key = similar_key
+                    break
+
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key][2]
+
+        if self.db is None:
+            return None
+
+        # 3. On-disk tier
+        if self.tolerance:
+            rows = self.db.execute("SELECT key, image_hash, value FROM cache WHERE prefix = ?", (prefix,)).fetchall()
+        else:
+            rows = self.db.execute("SELECT key, image_hash, value FROM cache WHERE key = ?", (key,)).fetchall()
+        for disk_key, disk_hash, value in rows:
+            disk_hash = int(disk_hash, 16)
+            if disk_key == key or (self.tolerance and (disk_hash ^ image_hash).bit_count() <= self.tolerance):
+                value = loads(value)
+                self.db.execute("UPDATE cache SET last_used = ? WHERE key = ?", (time(), disk_key))
+                self.db.commit()
+                self._remember(disk_key, prefix, disk_hash, value)
+                return value
+
+        return None
+
+    def _remember(self, key: str, prefix: str, image_hash: int, value: object) -> None:
+        self.entries[key] = (prefix, image_hash, value)
+        self.entries.move_to_end(key)
+        self.prefixes.setdefault(prefix, {})[key] = image_hash
+        # Evict least recently used
+        while len(self.entries) > self.max_size:
+            evicted_key, (evicted_prefix, _, _) = self.entries.popitem(last=False)
+            del self.prefixes[evicted_prefix][evicted_key]
+            if not self.prefixes[evicted_prefix]:
+                del self.prefixes[evicted_prefix]
@@ -1,4 +1,9 @@
+from contextlib import closing
 from json import loads
+from queue import Queue
+from threading import Event, Thread
+from time import perf_counter
+from typing import Iterator
 import torch
 from loguru import logger
 from PIL import Image
@@ -10,25 +15,46 @@ from nodes.vlm_wrapper import VLMWrapper
 from state.enemy_stat import EnemyStat
 from state.player_stat import PlayerCharacterStat
 from tools.controller import Controller
+from vision import turn_order
+from vision.frames import Frame, changed_pixels
+from vision.ailments import classify_ailments
+from vision.reach import find_red_cross
+from vision.digits import DigitReader
+from vision.name_plate import name_plate_hash
+from nodes.bestiary import Bestiary
 
 
 class VLMNode:
     """VLM Node responsible for context extraction for LLM Node."""
-    def __init__(self, controller: Controller):
+    def __init__(self, controller: Controller, vlm_server: str | None = None, vlm_worker: bool = False):
+        """
+        Args:
+            controller (Controller): game controller
+            vlm_server (str | None, optional): address of `nodes.vlm_server`. Defaults to None - load VLM in-process.
+            vlm_worker (bool, optional): load VLM in a dedicated worker process. Defaults to False.
+        """
         logger.warning("Starting VLM")
-        self.vlm = VLMWrapper()
+        self.vlm = VLMWrapper(server=vlm_server, worker=vlm_worker)
+        self.digits = DigitReader()
         self.controller = controller
+        self.bestiary: Bestiary | None = None
         logger.warning("VLM Node is ready")
 
     def __call__(self, state: CombatState, config: AgentConfig) -> CombatState:
         logger.debug("---UPDATING COMBAT STATS---")
         # TODO: Implement VLM
         # Get config
-        self.path_to_screenshot = config["configurable"]["path_to_screenshot"]
+        self.debug_frame_path = Controller.debug_frame_path(config)
         self.seed = config["configurable"]["seed_vlm_node"]
+        self.batch_profiling = config["configurable"]["vlm_batch_profiling"]
+        self.digit_reader = config["configurable"]["digit_reader"]
+        self.digit_reader_min_confidence = config["configurable"]["digit_reader_min_confidence"]
+        self.ailment_classifier = config["configurable"]["ailment_classifier"]
+        self.ailment_classifier_min_confidence = config["configurable"]["ailment_classifier_min_confidence"]
         self.origin = config["configurable"]["game_turn_order_region_origin"]
         self.size = config["configurable"]["game_turn_order_region_crop_size"]
         self.enemy_color = config["configurable"]["game_turn_order_enemy_shade_rgb"]
+        self.enemy_max_distance = config["configurable"]["game_turn_order_enemy_max_distance"]
         self.enemy_stat_hp_origin = config["configurable"]["enemy_stat_hp_origin"]
         self.enemy_stat_hp_size = config["configurable"]["enemy_stat_hp_size"]
         self.enemy_stat_stun_origin = config["configurable"]["enemy_stat_stun_origin"]
@@ -45,6 +71,21 @@ class VLMNode:
         self.enemy_stat_ailments_left_size = config["configurable"]["enemy_stat_ailments_left_size"]
         self.enemy_stat_ailments_right_origin = config["configurable"]["enemy_stat_ailments_right_origin"]
         self.enemy_stat_ailments_right_size = config["configurable"]["enemy_stat_ailments_right_size"]
+        self.enemy_reach_region_origin = config["configurable"]["enemy_reach_region_origin"]
+        self.enemy_reach_region_size = config["configurable"]["enemy_reach_region_size"]
+        self.reach_detector = config["configurable"]["reach_detector"]
+        self.reach_detector_min_confidence = config["configurable"]["reach_detector_min_confidence"]
+        self.incremental_profiling = config["configurable"]["incremental_profiling"]
+        self.enemy_panel_min_changed_pixels = config["configurable"]["enemy_panel_min_changed_pixels"]
+        self.pipelined_profiling = config["configurable"]["pipelined_profiling"]
+        self.profiling_queue_size = config["configurable"]["profiling_queue_size"]
+        self.target_settle_sec = config["configurable"]["target_settle_sec"]
+        self.enemy_name_plate_origin = config["configurable"]["enemy_name_plate_origin"]
+        self.enemy_name_plate_size = config["configurable"]["enemy_name_plate_size"]
+        if config["configurable"]["bestiary"] and self.bestiary is None:
+            self.bestiary = Bestiary(config["configurable"]["bestiary_path"], config["configurable"]["bestiary_tolerance"])
+        elif not config["configurable"]["bestiary"]:
+            self.bestiary = None
         self.enemy_target_detect_origin_delta = config["configurable"]["enemy_target_detect_origin_delta"]
         self.enemy_target_detect_size = config["configurable"]["enemy_target_detect_size"]
         self.character_strength_origin = config["configurable"]["character_strength_origin"]
@@ -52,11 +93,14 @@ class VLMNode:
         self.character_active_strength_origin = config["configurable"]["character_active_strength_origin"]
         self.character_active_strength_size = config["configurable"]["character_active_strength_size"]
 
-        # Get screenshot of current player turn
-        img_player_turn = Image.open(self.path_to_screenshot)
+        # Get frame of current player turn, captured on its detection
+        img_player_turn = self.controller.frames.get()
         # Get enemies' profiles
-        n_enemies, enemy_coords = self._estimate_number_of_enemies(img_player_turn, self.origin, self.size, self.enemy_color)
-        enemy_stat = self._get_enemy_strength(img_player_turn, n_enemies, enemy_coords, self.seed)
+        n_enemies, enemy_coords = self._estimate_number_of_enemies(img_player_turn, self.origin, self.size, self.enemy_color, self.enemy_max_distance)
+        previous = list(zip(state["turn_state"].get("enemies") or [], state["turn_state"].get("enemy_panels") or []))
+        enemy_stat, enemy_panels = self._get_enemy_strength(img_player_turn, n_enemies, enemy_coords, self.seed, previous)
+        # F cycle is known only if it went through every enemy
+        target_order = self.target_order if sorted(self.target_order) == list(range(n_enemies)) else None
         # Update player characters' profiles
         pc_stat = self._update_active_characters_strengths(img_player_turn, state["turn_state"]["player_characters"], self.seed)
         
@@ -65,7 +109,9 @@ class VLMNode:
             turn_state=TurnState(
                 enemies=enemy_stat,
                 player_characters=pc_stat,
-                enemy_coords=enemy_coords
+                enemy_coords=enemy_coords,
+                enemy_panels=enemy_panels,
+                target_order=target_order
             )
         )
 
@@ -84,75 +130,92 @@ class VLMNode:
         """
         return origin + (origin[0] + size[0], origin[1] + size[1])
 
-    def _estimate_number_of_enemies(self, img_player_turn: Image.Image, origin: tuple[int, int], size: tuple[int, int], 
-                                    enemy_color: tuple[int, int, int] = (219, 0, 72)) -> tuple[int, list[tuple[int, int]]]:
+    def _estimate_number_of_enemies(self, img_player_turn: Frame, origin: tuple[int, int], size: tuple[int, int], 
+                                    enemy_color: tuple[int, int, int] = (219, 0, 72), max_distance: int = 10) -> tuple[int, list[tuple[int, int]]]:
         """Estimate number of enemies engaged in combat.
 
         Args:
             origin (tuple[int, int]): Origin coordinates to crop turn-order area
             size (tuple[int, int]): Size of turn-order area
+            enemy_color (tuple[int, int, int]): Color of the tip of red-shaped left chevron on enemy portrait
+            max_distance (int): Per-channel tolerance to `enemy_color`
 
         Returns:
             int: number of enemies
             list[tuple[int, int]]: enemy portrait coordinates on turn order image region
         """
         logger.debug("STAT_UPDATER: Counting enemies")
-        # 1. Get screenshot of current turn
-        # img_player_turn = Image.open(self.path_to_screenshot)
-        # 2. Crop turn order from it. Origin: 660, 45. Size (W, H): 900, 140
-        crop_area = self.get_crop_box(origin, size)
-        img_turn_order = img_player_turn.crop(crop_area)
-        # 3. Look for all occurences of the specific pixel
-        pixel_needle = enemy_color# (219, 0, 72) # Color of the tip of red-shaped left chevron on enemy portrait
-        img_haystack = img_turn_order
-
-        # 3.1. Get all unique `x` coordinates for specific color
-        enemy_positions_x = []
-        enemy_positions = []
-        for x in range(img_haystack.size[0]):
-            for y in range(img_haystack.size[1]):
-                pixel = img_haystack.getpixel((x, y))
-                if pixel == pixel_needle:
-                    enemy_positions_x.append(x)
-                    enemy_positions.append((x, y))
-
-        enemy_positions_x = np.unique_values(enemy_positions_x).tolist()
-
-        # 3.2. Filter every `x` coordinate that is too far from the origin point
-        origins_x = [enemy_positions_x[0]]
-        max_distance = 10
-        for x in enemy_positions_x:
-            if x - origins_x[-1] >= max_distance:
-                origins_x.append(x)
-
-        # Gather enemy coordinates
-        enemy_coords = {}
-        for x in enemy_positions:
-            if x[0] in origins_x:
-                if not enemy_coords.get(x[0]):
-                    enemy_coords[x[0]] = x
-
-        enemy_coords = list(enemy_coords.values())
-
-        logger.info(f"STAT UPDATER: Enemies number: {len(origins_x)}")
-        return (len(enemy_coords), enemy_coords)
-        # return (len(origins_x), origins_x)
+        n_enemies, enemy_coords = turn_order.find_enemies(turn_order.as_frame(img_player_turn), origin, size, enemy_color, max_distance)
+        logger.info(f"STAT UPDATER: Enemies number: {n_enemies}")
+        return (n_enemies, enemy_coords)
     
-    def _get_enemy_strength(self, img_player_turn: Image.Image, n_enemies: int, enemy_coords: list[tuple[int,int]], seed: int = 1741) -> list[EnemyStat]:
+    def _get_enemy_strength(self, img_player_turn: Frame, n_enemies: int, enemy_coords: list[tuple[int,int]], seed: int = 1741,
+                            previous: list[tuple[EnemyStat, dict[str, np.ndarray]]] | None = None) -> tuple[list[EnemyStat], list[dict[str, np.ndarray]]]:
         """Iterate through found enemies, and get their stats.
+            Args:
+                previous (list[tuple[EnemyStat, dict[str, np.ndarray]]] | None, optional): enemy stats and their panel crops
+                    from the previous turn. Defaults to None - profile every enemy from scratch.
             Returns:
                 list[EnemyStat]: list of enemy stats
+                list[dict[str, np.ndarray]]: panel crops of every enemy. See `__profile_selected_enemy`
         """
         logger.debug("STAT_UPDATER: Getting enemies' strengths and weaknesses")
+        t0 = perf_counter()
+        self.profiling_stats = {"refreshed": 0, "reused": 0}
+        previous = previous if self.incremental_profiling and previous else []
         # 1. Activate "View Specifics"
         self.controller.toggle_display_enemy_specifics() # TODO: Uncomment when ready to use on actual gameplay
         self.controller.target_direction_f = True
-        profiled_enemies = []
-        profiled_enemies_indices = []
+        profiled = {}
+        inference_time = 0.0
+
+        # 2. Controller cycles targets, and VLM profiles captured frames.
+        # Pipelined - targets are cycled in a thread while the frames are being profiled
+        targets = self._cycle_targets(n_enemies, enemy_coords)
+        if self.pipelined_profiling:
+            targets = self._run_in_thread(targets, self.profiling_queue_size)
+        with closing(targets):
+            for img_player_turn, enemy_id, target_direction_f in targets:
+                t_inference = perf_counter()
+                profiled[enemy_id] = self.__profile_selected_enemy(img_player_turn, seed, enemy_id, target_direction_f, previous)
+                inference_time += perf_counter() - t_inference
+
+        # 3. Assemble results by enemy index
+        profiled_enemies_indices = sorted(profiled)
+        profiled_enemies = [profiled[enemy_id][0] for enemy_id in profiled_enemies_indices]
+        profiled_panels = [profiled[enemy_id][1] for enemy_id in profiled_enemies_indices]
 
+        logger.debug(f"Enemies profiled: {profiled_enemies_indices=}")
+        self.profiling_stats["duration"] = perf_counter() - t0
+        self.profiling_stats["inference"] = inference_time
+        self.profiling_stats["capture"] = self.capture_time
+        logger.info(f"STAT_UPDATER: {len(profiled_enemies)} enemies profiled in {self.profiling_stats['duration']:.2f}s "
+                    f"(capture {self.capture_time:.2f}s, inference {inference_time:.2f}s, {'pipelined' if self.pipelined_profiling else 'sequential'}): "
+                    f"{self.profiling_stats['refreshed']} fields refreshed, {self.profiling_stats['reused']} reused")
+        return profiled_enemies, profiled_panels
+
+    def _cycle_targets(self, n_enemies: int, enemy_coords: list[tuple[int,int]]) -> Iterator[tuple[Frame, int, bool]]:
+        """Cycle through targets, and capture frame of every enemy once.
+
+        Target is changed right after the frame of current enemy has been yielded. Consumed in place, the generator
+        resumes only when the consumer is done with the frame, so capture and profiling alternate. With `pipelined_profiling`
+        it runs in a thread, see `_run_in_thread`, and keeps changing targets while the consumer profiles earlier frames -
+        up to `profiling_queue_size` captured frames wait for it. Every capture is a new frame, so queued frames aren't overwritten.
+
+        Yields:
+            Frame: frame with "View Specifics" panel of the selected enemy
+            int: enemy index
+            bool: True - enemy is targeted with F, False - with R
+        """
+        self.capture_time = 0.0
+        # Enemy indices in order of F presses - for targeting planner. See `Controller.select_target_enemy`
+        self.target_order = []
+        f_cycle_closed = False
+        profiled_enemies_indices = []
         for i in range(2 * n_enemies + 1): # Limit max target iterations
             # Update screenshot
-            img_player_turn = self.controller.screenshot(self.path_to_screenshot)
+            t_capture = perf_counter()
+            img_player_turn = self.controller.screenshot(self.debug_frame_path)
             # Check if this enemy has already been profiled
             # 1 2 3 4
             # first_enemy = 3
@@ -161,11 +224,13 @@ class VLMNode:
             # profiled_enemies = [3,4,1] # F->profile->F->profile->F->already_profiled->R until it's 2 ->profile->END
 
             # 2. Find which enemy is selected - it's the 1st
-            #   2.1. Produce black-and-white image out of red channel from HSV-representation of the image
-            img_turn_order_bw = self.produce_bw_image(img_player_turn, self.origin, self.size)
-            enemy_id, _ = self.find_selected_target(img_turn_order_bw, enemy_coords, self.enemy_target_detect_origin_delta, self.enemy_target_detect_size)
-
-            # TODO: Fix algorithm to find all enemies - including ones not detected by specific pixel color
+            enemy_id, _ = self.find_selected_target(img_player_turn, enemy_coords)
+            self.capture_time += perf_counter() - t_capture
+            if self.controller.target_direction_f and not f_cycle_closed:
+                if enemy_id in self.target_order:
+                    f_cycle_closed = True
+                else:
+                    self.target_order.append(enemy_id)
 
             # 2.3. If this enemy has already been profiled, then attempt to select next
             if enemy_id in profiled_enemies_indices:
@@ -176,93 +241,303 @@ class VLMNode:
                     break
 
                 # 2.5. Iterate through targets to the right
+                t_capture = perf_counter()
                 self.controller.change_target() # TODO: Uncomment when it's ready to deploy
+                self.controller.wait_until_settled(self.controller.specifics_region, self.target_settle_sec)
+                self.capture_time += perf_counter() - t_capture
                 continue
 
             profiled_enemies_indices.append(enemy_id)
 
             # 2.6. Profile enemy
-            profiled_enemies.append(self.__profile_selected_enemy(img_player_turn, seed, enemy_id, self.controller.target_direction_f))
+            yield img_player_turn, enemy_id, self.controller.target_direction_f
 
+            t_capture = perf_counter()
             self.controller.change_target()
+            self.controller.wait_until_settled(self.controller.specifics_region, self.target_settle_sec)
+            self.capture_time += perf_counter() - t_capture
 
-        logger.debug(f"Enemies profiled: {profiled_enemies_indices=}")
-        return profiled_enemies
+    @staticmethod
+    def _run_in_thread(items: Iterator, queue_size: int) -> Iterator:
+        """Run producer in a thread, and consume its items through a bounded queue.
+
+        Producer's exception is re-raised in consumer's thread.
+
+        Args:
+            items (Iterator): producer
+            queue_size (int): max number of items waiting for consumer
 
-    def __profile_selected_enemy(self, img_player_turn: Image.Image, seed: int, enemy_id: int, target_direction_f: bool = True) -> EnemyStat:
+        Yields:
+            item of the producer
+        """
+        queue: Queue = Queue(maxsize=queue_size)
+        done = object()
+        stop = Event()
+        error = []
+
+        def produce() -> None:
+            try:
+                for item in items:
+                    if stop.is_set():
+                        break
+                    queue.put(item)
+            except Exception as e:
+                error.append(e)
+            finally:
+                queue.put(done)
+
+        producer = Thread(target=produce, name="target_cycler", daemon=True)
+        producer.start()
+        try:
+            while (item := queue.get()) is not done:
+                yield item
+        finally:
+            # Consumer failed - unblock producer, and let it finish
+            stop.set()
+            while producer.is_alive():
+                while not queue.empty():
+                    queue.get_nowait()
+                producer.join(timeout=0.05)
+        if error:
+            raise error[0]
+
+    def __profile_selected_enemy(self, img_player_turn: Frame, seed: int, enemy_id: int, target_direction_f: bool = True,
+                                 previous: list[tuple[EnemyStat, dict[str, np.ndarray]]] | None = None) -> tuple[EnemyStat, dict[str, np.ndarray]]:
         """Profile selected enemy
 
+        If the enemy has been profiled on the previous turn, only the panels that have changed since are re-read.
+        Weaknesses and ailment susceptibilities of known enemy type are taken from the bestiary.
+        Reach is checked every time - the region around targeting reticle is a part of 3D scene.
+
         Args:
-            img_player_turn (Image.Image): screenshot of current player turn
+            img_player_turn (Frame): frame of current player turn
             seed (int): generation seed
+            previous (list[tuple[EnemyStat, dict[str, np.ndarray]]] | None, optional): enemy stats and their panel crops
+                from the previous turn. Defaults to None - profile from scratch.
 
         Returns:
             EnemyStat: enemy stat object
+            dict[str, np.ndarray]: request name -> copy of its panel crop
         """
+        t0 = perf_counter()
+        requests = self.__enemy_profile_requests(img_player_turn)
+        panels = {key: image.copy() for key, (_, image, _) in requests.items()}
+        # Reuse whatever hasn't changed since the previous turn
+        reused = self.__reuse_previous_profile(panels, previous or [])
+        for key in reused:
+            del requests[key]
+        # Static traits of known enemy type come from the bestiary
+        name_hash = None
+        if self.bestiary is not None and any(key in requests for key in self.stable_panels):
+            name_hash = name_plate_hash(img_player_turn, self.enemy_name_plate_origin, self.enemy_name_plate_size)
+            traits = self.bestiary.get(name_hash) if name_hash is not None else None
+            if traits is not None:
+                reused |= {key: values for key, values in traits.items() if key in requests}
+                for key in traits:
+                    requests.pop(key, None)
+                # Known enemy - nothing to store
+                name_hash = None
+        results = dict(reused)
+        # Panels read from pixels of this frame by digit reader, or ailment classifier - only they go to the bestiary
+        from_pixels = set()
+        # Numeric panels are read with glyph templates, VLM gets only what the reader isn't sure about
+        if self.digit_reader:
+            for key, (panel, count) in self.digit_panels.items():
+                if key not in requests:
+                    continue
+                numbers = self.digits.read(requests[key][1], panel, count, self.digit_reader_min_confidence)
+                if numbers is not None:
+                    results[key] = numbers
+                    from_pixels.add(key)
+                    del requests[key]
+        # Ailment symbols are classified by their pixels
+        if self.ailment_classifier and ("ailments_left" in requests or "ailments_right" in requests):
+            susceptible, confidence = classify_ailments(img_player_turn, (self.enemy_stat_ailments_left_origin, self.enemy_stat_ailments_right_origin))
+            if confidence >= self.ailment_classifier_min_confidence:
+                for key, column in (("ailments_left", susceptible[:5]), ("ailments_right", susceptible[5:])):
+                    if key in requests:
+                        results[key] = column
+                        from_pixels.add(key)
+                        del requests[key]
+            else:
+                logger.debug(f"STAT_UPDATER: Ailment classifier confidence {confidence:.2f}. Falling back to VLM")
+        n_read = len(results) - len(reused)
+
+        if self.batch_profiling:
+            torch.manual_seed(seed)
+            results |= dict(zip(requests, self.vlm.batch(list(requests.values()))))
+        else:
+            for key, (text, image, budget) in requests.items():
+                torch.manual_seed(seed)
+                results[key] = self.vlm(text=text, image=image, budget=budget)[0]
+
         # 1. Get enemy parameters
-        enemy_params = self.__extract_enemy_parameters(img_player_turn, seed)
+        enemy_params = self.__parse_enemy_parameters(results)
         # 2. Get enemy weaknesses
-        enemy_weakness = self.__extract_enemy_weaknesses(img_player_turn, seed)
+        enemy_weakness = self.__parse_enemy_weaknesses(results)
         # 3. Get enemy ailments
-        enemy_ailments = self.__extract_enemy_ailments(img_player_turn, seed)
+        enemy_ailments = self.__parse_enemy_ailments(results)
         # 4. Check if it can be attacked by basic attack
-        enemy_can_be_attacked = self.__is_enemy_within_reach(img_player_turn, seed)
-        return EnemyStat.from_dicts(enemy_id, target_direction_f, enemy_can_be_attacked, enemy_params, enemy_weakness, enemy_ailments)
+        enemy_can_be_attacked = self.__is_enemy_within_reach(img_player_turn)
+        enemy = EnemyStat.from_dicts(enemy_id, target_direction_f, enemy_can_be_attacked, enemy_params, enemy_weakness, enemy_ailments)
+
+        # First extraction of unknown enemy type, where every stable panel has been read from pixels.
+        # VLM answers, and the panels reused from the previous turn may be wrong - they aren't stored for every later encounter
+        if name_hash is not None and all(key in from_pixels for key in self.stable_panels):
+            traits = {key: [getattr(enemy, field) for field in self.panel_fields[key]] for key in self.stable_panels}
+            self.bestiary.put(name_hash, traits, img_player_turn.crop(self.enemy_name_plate_origin, self.enemy_name_plate_size))
+
+        # Reach is always refreshed
+        n_reused_fields = sum(len(self.panel_fields[key]) for key in reused)
+        self.profiling_stats["reused"] += n_reused_fields
+        self.profiling_stats["refreshed"] += sum(len(fields) for fields in self.panel_fields.values()) + 1 - n_reused_fields
+
+        t0 = perf_counter() - t0
+        logger.info(f"STAT_UPDATER: Enemy {enemy_id} profiled in {t0:.2f}s ({len(reused)} panels reused, {n_read} read from pixels, {len(requests)} queries, {'batched' if self.batch_profiling else 'sequential'}, and 1 reach check)")
+        return enemy, panels
+
+    # Request name -> digit reader panel, and number of numbers on it
+    digit_panels: dict[str, tuple[str, int]] = {
+        "hp": ("enemy_stats", 2),
+        "stun": ("enemy_stats", 1),
+        "atk_ats_speed": ("enemy_stats", 3),
+        "def_adf": ("enemy_stats", 2),
+        "weakness_basic": ("enemy_weakness", 4),
+        "weakness_higher_elements": ("enemy_weakness", 3),
+    }
+
+    # Request name -> EnemyStat fields read from its panel, in order of their appearance on the panel
+    panel_fields: dict[str, tuple[str, ...]] = {
+        "hp": ("hp", "hp_max"),
+        "stun": ("stun",),
+        "atk_ats_speed": ("attack", "arts_attack", "speed"),
+        "def_adf": ("defense", "arts_defense"),
+        "weakness_basic": ("weakness_earth", "weakness_water", "weakness_fire", "weakness_wind"),
+        "weakness_higher_elements": ("weakness_time", "weakness_space", "weakness_mirage"),
+        "ailments_left": ("ailment_stat_down", "ailment_burn", "ailment_seal", "ailment_rot", "ailment_fear"),
+        "ailments_right": ("ailment_delay", "ailment_freeze", "ailment_mute", "ailment_blind", "ailment_deathblow"),
+    }
+
+    # Panels that never change within a combat. Enemy of the previous turn is recognized by them
+    stable_panels: tuple[str, ...] = ("weakness_basic", "weakness_higher_elements", "ailments_left", "ailments_right")
+
+    def __reuse_previous_profile(self, panels: dict[str, np.ndarray], previous: list[tuple[EnemyStat, dict[str, np.ndarray]]]) -> dict[str, list]:
+        """Get values of panels that haven't changed since the previous turn.
+
+        Enemy order in turn order changes every turn, so the selected enemy is matched against all enemies of
+        the previous turn by its stable panels. Twins are told apart by the rest of the panels.
+
+        Args:
+            panels (dict[str, np.ndarray]): request name -> panel crop of the selected enemy
+            previous (list[tuple[EnemyStat, dict[str, np.ndarray]]]): enemy stats and their panel crops from the previous turn
+
+        Returns:
+            dict[str, list]: request name -> values of its fields. Same as read by digit reader or ailment classifier
+        """
+        best, best_changed = None, None
+        for enemy, previous_panels in previous:
+            changed = {key: changed_pixels(panels[key], previous_panels[key]) for key in panels if key in previous_panels}
+            if any(changed.get(key, self.enemy_panel_min_changed_pixels) >= self.enemy_panel_min_changed_pixels for key in self.stable_panels):
+                continue
+            if best_changed is None or sum(changed.values()) < sum(best_changed.values()):
+                best, best_changed = enemy, changed
+        if best is None:
+            return {}
+
+        return {
+            key: [getattr(best, field) for field in self.panel_fields[key]]
+            for key, n_changed in best_changed.items() if n_changed < self.enemy_panel_min_changed_pixels
+        }
+
+    def __enemy_profile_requests(self, img_player_turn: Frame) -> dict[str, tuple[str, np.ndarray, str]]:
+        """Multimodal prompts required to profile selected enemy.
+
+        Args:
+            img_player_turn (Frame): frame of current player turn
+
+        Returns:
+            dict[str, tuple[str, np.ndarray, str]]: request name -> (text prompt, crop view, pixel budget)
+        """
+        prompt_get_param = "Extract all numbers as JSON list."
+        prompt_get_weakness_numbers = """List numbers. Just give the numbers."""
+        prompt_get_ailments = """List circles, and triangles in order of their occurence in the column. For each circle return 1, for each triangle - 0. Just give the list."""
 
-    def __is_enemy_within_reach(self, img_player_turn: Image.Image, seed: int) -> bool:
+        crop = img_player_turn.crop
+
+        return {
+            # Parameters
+            "hp": (prompt_get_param, crop(self.enemy_stat_hp_origin, self.enemy_stat_hp_size), "digit_crop"),
+            "stun": (prompt_get_param, crop(self.enemy_stat_stun_origin, self.enemy_stat_stun_size), "digit_crop"),
+            "atk_ats_speed": (prompt_get_param, crop(self.enemy_stat_atk_ats_speed_origin, self.enemy_stat_atk_ats_speed_size), "digit_crop"),
+            "def_adf": (prompt_get_param, crop(self.enemy_stat_def_adf_origin, self.enemy_stat_def_adf_size), "digit_crop"),
+            # Weaknesses: Ea, Wa, F, Wi, and higher elements
+            "weakness_basic": (prompt_get_weakness_numbers, crop(self.enemy_stat_weakness_basic_origin, self.enemy_stat_weakness_basic_size), "icon_column"),
+            "weakness_higher_elements": (prompt_get_weakness_numbers, crop(self.enemy_stat_weakness_higher_elements_origin, self.enemy_stat_weakness_higher_elements_size), "icon_column"),
+            # Ailments: 1st and 2nd columns
+            "ailments_left": (prompt_get_ailments, crop(self.enemy_stat_ailments_left_origin, self.enemy_stat_ailments_left_size), "icon_column"),
+            "ailments_right": (prompt_get_ailments, crop(self.enemy_stat_ailments_right_origin, self.enemy_stat_ailments_right_size), "icon_column"),
+        }
+
+    def __is_enemy_within_reach(self, img_player_turn: Frame) -> bool:
         """Check if selected enemy can be attacked with basic attack.
 
         Args:
-            img_player_turn (Image.Image): screenshot of current player turn
-            seed (int): generation seed
+            img_player_turn (Frame): frame of current player turn
 
         Returns:
             bool: True - can be attacked
         """
+        if self.reach_detector:
+            red_cross, confidence = find_red_cross(turn_order.as_frame(img_player_turn), self.enemy_reach_region_origin, self.enemy_reach_region_size)
+            if confidence >= self.reach_detector_min_confidence:
+                return not red_cross
+            logger.debug(f"STAT_UPDATER: Reach detector confidence {confidence:.2f}. Falling back to VLM")
+
         text_prompt = """Is there a big red X on screen? Give only yes or no answer."""
-        torch.manual_seed(seed)
-        return False if "yes" in self.vlm(text=text_prompt, image=img_player_turn)[0].lower() else True
+        answer, _ = self.vlm.classify(text=text_prompt, image=img_player_turn, budget="full_frame_classifier")
+        return answer != "yes"
 
-    @staticmethod
-    def find_selected_target(img_turn_order_bw: Image.Image, enemy_coords: list[tuple[int,int]], origin_delta: tuple[int,int] = (20, 0), size:int = 10, significance: float = 0.5) -> tuple[int,float]:
+    def find_selected_target(self, img_player_turn: Image.Image | Frame | np.ndarray, enemy_coords: list[tuple[int,int]], significance: float = 0.5, name: str | None = None) -> tuple[int,float]:
         """Get index of enemy coordinates that correspond to currently selected enemy
 
         Args:
-            img_turn_order_bw (Image.Image): image with turn order
+            img_player_turn (Image.Image | Frame | np.ndarray): screenshot of current player turn
             enemy_coords (list[tuple[int,int]]): list of enemy (x,y) coordinates
+            significance (float, optional): minimal proportion of white pixels. Defaults to 0.5.
+            name (str | None, optional): filename to save black-and-white turn order image if needed. Defaults to None - don't save.
 
         Returns:
             tuple[int,float]: Index of enemy_coords, level of confidence
         """
-        # TODO: Make it robust. It skips on profiles of some enemies
-        def is_white(bw_color: int) -> bool:
-            return bw_color == 255
-
-        # Get 10x10 region with coordinates (20, 0) relative to the selected portrait
-        proportions = []
-        for idx, pos in enumerate(enemy_coords):
-            pos = (pos[0] + origin_delta[0], pos[1] + origin_delta[1] - size)
-            crop_area = VLMNode.get_crop_box(origin=pos, size=(size, size))
-            pixels = list(img_turn_order_bw.crop(crop_area).getdata())
-            proportions.append(np.count_nonzero(np.array(pixels)) / len(pixels))
-            # If it's perfectly white - it is selected enemy
-            if all(is_white(px) for px in pixels):
-                return (idx, 1.0)
-        
-        # If no perfect white square has been found - return enemy index with maximum proportion of white
-        # Threshold = 0.5
-        enemy_id = np.argmax(proportions).item()
-        if proportions[enemy_id] < significance:
-            return len(enemy_coords) + 1, 1.0
-        
-        return enemy_id, proportions[enemy_id]
+        frame = turn_order.as_frame(img_player_turn)
+        # Frame of a screen region only - see `selection_region`
+        origin = img_player_turn.local(self.origin) if isinstance(img_player_turn, Frame) else self.origin
+        if name:
+            self.produce_bw_image(frame, origin, self.size, name)
+
+        return turn_order.find_selected_target(frame, origin, enemy_coords, self.enemy_target_detect_origin_delta, self.enemy_target_detect_size, significance)
+
+    def selection_region(self) -> tuple[tuple[int, int], tuple[int, int]]:
+        """Get screen region that `find_selected_target` needs: turn-order region with selection squares around portraits.
+
+        Returns:
+            tuple[int, int]: origin of the region
+            tuple[int, int]: size of the region
+        """
+        dx, dy = self.enemy_target_detect_origin_delta
+        square = self.enemy_target_detect_size
+        left = max(self.origin[0] + min(dx, 0), 0)
+        top = max(self.origin[1] + min(dy - square, 0), 0)
+        right = self.origin[0] + self.size[0] + max(dx + square, 0)
+        bottom = self.origin[1] + self.size[1] + max(dy, 0)
+        return (left, top), (right - left, bottom - top)
 
     @staticmethod
-    def produce_bw_image(image: Image.Image, origin: tuple[int,int], size: tuple[int,int], name: str | None = None) -> Image.Image:
+    def produce_bw_image(image: Image.Image | np.ndarray, origin: tuple[int,int], size: tuple[int,int], name: str | None = None) -> Image.Image:
         """Produce black-and-white image out of red channel from HSV-representation of the image
 
         Args:
-            image (Image.Image): screenshot of current player turn
+            image (Image.Image | np.ndarray): screenshot of current player turn
             origin (tuple[int,int]): origin of turn order region
             size (tuple[int,int]): size of turn order region
             name (str | None, optional): filename to save image if needed. Defaults to None - don't save.
@@ -270,37 +545,21 @@ class VLMNode:
         Returns:
             Image.Image: black-and-white image in RGB
         """
-        img_s = image.crop(VLMNode.get_crop_box(origin=origin, size=size)).convert("HSV").getchannel("S")
-        img_v = image.crop(VLMNode.get_crop_box(origin=origin, size=size)).convert("HSV").getchannel("V")
-
-        # Filter to increase contrast
-        threshold = 127
-        img_v.putdata([255 if x >= threshold else 0 for x in list(img_v.getdata())])
-        img_s.putdata([255 if x >= threshold else 0 for x in list(img_s.getdata())])
-
-        bw_image = Image.merge("HSV", [Image.new("L", size=img_v.size), img_s, img_v]).convert("RGB").getchannel("R")
+        bw_image = Image.fromarray(turn_order.binarize(turn_order.crop(turn_order.as_frame(image), origin, size)))
         if name:
             bw_image.convert("RGB").save(name)
         
         return bw_image
 
-    def __extract_enemy_parameters(self, img_player_turn: Image.Image, seed: int) -> dict:
-        # TODO: Rework internals so the VLM is fed only with cropped images depicting actual numbers
-        # torch.manual_seed(seed)
-        # prompt_get_enemy_parameters = """Focus on "Enemy Data" information panel. Extract numbers of current HP, maximum HP, Stun, Attack, Defense, Arts strenght, Arts Defense, Speed."""
-        # result = self.vlm(text=prompt_get_enemy_parameters, image=img_player_turn)[0]
-
-        prompt_get_param = "Extract all numbers as JSON list."
-        # Get parameters regions
-        img_hp_origin = img_player_turn.crop(self.get_crop_box(self.enemy_stat_hp_origin, self.enemy_stat_hp_size))
-        img_stun = img_player_turn.crop(self.get_crop_box(self.enemy_stat_stun_origin, self.enemy_stat_stun_size))
-        img_atk_ats_speed = img_player_turn.crop(self.get_crop_box(self.enemy_stat_atk_ats_speed_origin, self.enemy_stat_atk_ats_speed_size))
-        img_def_adf = img_player_turn.crop(self.get_crop_box(self.enemy_stat_def_adf_origin, self.enemy_stat_def_adf_size))
-
+    @staticmethod
+    def __parse_enemy_parameters(results: dict[str, str | list[int]]) -> dict:
         values = []
-        for img in [img_hp_origin, img_stun, img_atk_ats_speed, img_def_adf]:
-            torch.manual_seed(seed)
-            result = self.vlm(text=prompt_get_param, image=img)[0]
+        for key in ["hp", "stun", "atk_ats_speed", "def_adf"]:
+            result = results[key]
+            # Read by digit reader
+            if isinstance(result, list):
+                values += result
+                continue
             start_pos = result.find("```json") + len("```json")
             result = result[start_pos:result.find("```", start_pos)]
             values += loads(result)
@@ -317,37 +576,26 @@ class VLMNode:
 
         return enemy_params
 
-    def __extract_enemy_weaknesses(self, img_player_turn: Image.Image, seed: int) -> dict:
-        #   3.1. Crop basic elements region. Origin: 1530, 522. Size (W, H): 50, 140
-        # origin = (1530, 522)
-        # size = (50, 140)
-        origin = self.enemy_stat_weakness_basic_origin
-        size = self.enemy_stat_weakness_basic_size
-        crop_area = self.get_crop_box(origin, size)
-        img_weaknesses = img_player_turn.crop(crop_area)
-        #   3.2. Query VLM to get values for Ea, Wa, F, Wi
-        prompt_get_weakness_numbers = """List numbers. Just give the numbers."""
-        torch.manual_seed(seed)
-        result = self.vlm(text=prompt_get_weakness_numbers, image=img_weaknesses)[0]
-        result = result.replace("\n", ",").split(",")
+    @staticmethod
+    def __parse_enemy_weaknesses(results: dict[str, str | list[int]]) -> dict:
+        def split(result: str | list[int]) -> list:
+            # Read by digit reader
+            if isinstance(result, list):
+                return result
+            return result.replace("\n", ",").split(",")
+
+        # Basic elements: Ea, Wa, F, Wi
+        result = split(results["weakness_basic"])
 
         enemy_weakness = {
-            "earth": int(result[0].strip()),
-            "water": int(result[1].strip()),
-            "fire": int(result[2].strip()),
-            "wind": int(result[3].strip())
+            "earth": int(str(result[0]).strip()),
+            "water": int(str(result[1]).strip()),
+            "fire": int(str(result[2]).strip()),
+            "wind": int(str(result[3]).strip())
         }
 
-        #   3.2. Crop higher elements region. Origin: 1715, 522. Size (W, H): 50, 104
-        # origin = (1715, 522)
-        # size = (50, 104)
-        origin = self.enemy_stat_weakness_higher_elements_origin
-        size = self.enemy_stat_weakness_higher_elements_size
-        crop_area = self.get_crop_box(origin, size)
-        img_weaknesses = img_player_turn.crop(crop_area)
-        torch.manual_seed(seed)
-        result = self.vlm(text=prompt_get_weakness_numbers, image=img_weaknesses)[0]
-        result = result.replace("\n", ",").split(",")
+        # Higher elements
+        result = split(results["weakness_higher_elements"])
         # Simple anti-hallucination sanity check
         if len(result) > 3:
             enemy_weakness = enemy_weakness | {
@@ -357,27 +605,23 @@ class VLMNode:
             }
         else:
             enemy_weakness = enemy_weakness | {
-                "time": int(result[0].strip()),
-                "space": int(result[1].strip()),
-                "mirage": int(result[2].strip())
+                "time": int(str(result[0]).strip()),
+                "space": int(str(result[1]).strip()),
+                "mirage": int(str(result[2]).strip())
             }
         
         return enemy_weakness
 
-    def __extract_enemy_ailments(self, img_player_turn: Image.Image, seed: int) -> dict:
-        #   4.1. Crop 1st column. Origin: 1556, 700. Size (W, H): 40, 174
-        # origin = (1556, 700)
-        # size = (40, 174)
-        origin = self.enemy_stat_ailments_left_origin
-        size = self.enemy_stat_ailments_left_size
-        crop_area = self.get_crop_box(origin, size)
-        img_ailments = img_player_turn.crop(crop_area)
-        #   4.2. Query VLM to get ailments
-        prompt_get_ailments = """List circles, and triangles in order of their occurence in the column. For each circle return 1, for each triangle - 0. Just give the list."""
-        torch.manual_seed(seed)
-        result = self.vlm(text=prompt_get_ailments, image=img_ailments)[0]
-        result = result.split(",")
-        #   4.3. Process returned string
+    @staticmethod
+    def __parse_enemy_ailments(results: dict[str, str | list[bool]]) -> dict:
+        def split(result: str | list[bool]) -> list:
+            # Classified by ailment classifier
+            if isinstance(result, list):
+                return result
+            return result.split(",")
+
+        # 1st column
+        result = split(results["ailments_left"])
         enemy_ailments = {
             "ailment_stat_down": bool(int(result[0])),
             "ailment_burn": bool(int(result[1])),
@@ -385,18 +629,8 @@ class VLMNode:
             "ailment_rot": bool(int(result[3])),
             "ailment_fear": bool(int(result[4]))
         }
-        #   4.4. Crop 2nd column. Origin: 1750, 700. Size (W, H): 40, 174
-        # origin = (1750, 700)
-        # size = (40, 174)
-        origin = self.enemy_stat_ailments_right_origin
-        size = self.enemy_stat_ailments_right_size
-        crop_area = self.get_crop_box(origin, size)
-        img_ailments = img_player_turn.crop(crop_area)
-        #   4.5. Query VLM to get ailments
-        torch.manual_seed(seed)
-        result = self.vlm(text=prompt_get_ailments, image=img_ailments)[0]
-        result = result.split(",")
-        #   4.6. Process returned string
+        # 2nd column
+        result = split(results["ailments_right"])
         enemy_ailments = enemy_ailments | {
             "ailment_delay": bool(int(result[0])),
             "ailment_freeze": bool(int(result[1])),
@@ -407,7 +641,7 @@ class VLMNode:
 
         return enemy_ailments   
     
-    def _update_active_characters_strengths(self, img_player_turn: Image.Image, player_characters: list[PlayerCharacterStat], seed: int = 1741) -> list[PlayerCharacterStat]:
+    def _update_active_characters_strengths(self, img_player_turn: Frame, player_characters: list[PlayerCharacterStat], seed: int = 1741) -> list[PlayerCharacterStat]:
         logger.debug("STAT_UPDATER: Updating awareness on active characters")
         active_character_index = None
 
@@ -421,30 +655,32 @@ class VLMNode:
             #     size = character_strength_size[i] #(240, 50)
             
             # Prepare HP,EP,CP area
-            crop_area = self.get_crop_box(origin, size)
-            img_player_stats = img_player_turn.crop(crop_area)
+            img_player_stats = img_player_turn.crop(origin, size)
             
             # Extract HP, EP, CP
-            prompt_get_player_hpepcp = """Extract values of HP, EP, CP as CSV: name,value"""
-            torch.manual_seed(seed)
-            result = self.vlm(text=prompt_get_player_hpepcp, image=img_player_stats)
-
             character_params = {"character_id": i, "is_active": False}
-            for line in result[0].splitlines():
-                if len(line) <= 20 and "," in line.lower():
-                    if "hp" in line.lower():
-                        character_params["hp"] = int(line.split(",")[-1])
-                    if "ep" in line.lower():
-                        character_params["ep"] = int(line.split(",")[-1])
-                    if "cp" in line.lower():
-                        character_params["cp"] = int(line.split(",")[-1])
+            numbers = self.digits.read(img_player_stats, "party", 3, self.digit_reader_min_confidence) if self.digit_reader else None
+            if numbers is not None:
+                character_params["hp"], character_params["ep"], character_params["cp"] = numbers
+            else:
+                prompt_get_player_hpepcp = """Extract values of HP, EP, CP as CSV: name,value"""
+                torch.manual_seed(seed)
+                result = self.vlm(text=prompt_get_player_hpepcp, image=img_player_stats, budget="digit_crop")
+
+                for line in result[0].splitlines():
+                    if len(line) <= 20 and "," in line.lower():
+                        if "hp" in line.lower():
+                            character_params["hp"] = int(line.split(",")[-1])
+                        if "ep" in line.lower():
+                            character_params["ep"] = int(line.split(",")[-1])
+                        if "cp" in line.lower():
+                            character_params["cp"] = int(line.split(",")[-1])
 
             # Find out if it's active character
             if not active_character_index:
                 prompt_get_player_hpepcp = """Are words HP, EP, CP all present on the image? Give only answer."""
-                torch.manual_seed(seed)
-                result = self.vlm(text=prompt_get_player_hpepcp, image=img_player_stats)
-                if result[0].lower() == "yes":
+                answer, _ = self.vlm.classify(text=prompt_get_player_hpepcp, image=img_player_stats, budget="digit_crop")
+                if answer == "yes":
                     active_character_index = i
                     character_params["is_active"] = True
                     logger.info(f"STAT_UPDATER: Active character ID: {active_character_index}")
@@ -0,0 +1,435 @@
+import ipaddress
+import os
+import secrets
+import socket
+from concurrent.futures import Future
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Connection, Listener
+from queue import Empty, Full, Queue
+from threading import Lock, Thread
+from time import monotonic, sleep
+from typing import Any
+from loguru import logger
+from PIL import Image
+
+
+# Server and clients authenticate each other with a shared key. Messages are pickled - anyone with the key can run code
+# in the server, so the key is secret: taken from the environment variable, or from the key file, readable by the owner only
+AUTHKEY_ENV = "KURO2_VLM_AUTHKEY"
+AUTHKEY_PATH = "data/vlm_server.key"
+# A request to the server: (text prompt, image, (min_pixels, max_pixels))
+Request = tuple[str, Image.Image, tuple[int, int]]
+
+
+def parse_address(address: str) -> tuple[str, int] | str:
+    """Parse "host:port" of TCP socket. Anything else is a path of Unix socket, or a name of Windows pipe."""
+    host, _, port = address.rpartition(":")
+    if host and port.isdigit():
+        return host, int(port)
+    return address
+
+
+def load_authkey(path: str = AUTHKEY_PATH, create: bool = False) -> bytes:
+    """Get the shared key of server and clients: `AUTHKEY_ENV` environment variable, or contents of the key file.
+
+    Args:
+        path (str, optional): path/to/vlm_server.key. Defaults to AUTHKEY_PATH.
+        create (bool, optional): generate the key file with owner-only permissions if it doesn't exist. Defaults to False.
+
+    Raises:
+        FileNotFoundError: no environment variable, and no key file to read
+
+    Returns:
+        bytes: key
+    """
+    if os.environ.get(AUTHKEY_ENV):
+        return os.environ[AUTHKEY_ENV].encode()
+    if create and not os.path.exists(path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # Created with 0600 at once - the key is never readable by others
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "w") as f:
+            f.write(secrets.token_hex(32))
+        logger.info(f"Generated VLM server key {path}")
+    try:
+        with open(path, encoding="utf-8") as f:
+            return f.read().strip().encode()
+    except FileNotFoundError:
+        raise FileNotFoundError(f"No VLM server key: set {AUTHKEY_ENV}, or start the server to generate {path}") from None
+
+
+def is_loopback(address: tuple[str, int] | str) -> bool:
+    """Check if the address is reachable from this machine only: loopback host, Unix socket, or Windows pipe."""
+    if isinstance(address, str):
+        return True
+    host = address[0]
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        pass
+    try:
+        return all(ipaddress.ip_address(info[4][0]).is_loopback for info in socket.getaddrinfo(host, None))
+    except socket.gaierror:
+        return False
+
+
+class StubVLM:
+    """CPU-only stand-in for `VLMWrapper` to load-test the server on a machine without GPU.
+
+    `batch` sleeps `latency + per_request * len(requests)` seconds - one `generate` call costs mostly the same
+    for a single and for a few requests, and answers with prompt length and image size.
+    """
+    def __init__(self, latency: float = 0.12, per_request: float = 0.015):
+        """
+        Args:
+            latency (float, optional): duration of a single `generate` call, seconds. Defaults to 0.12.
+            per_request (float, optional): extra duration per request of the batch, seconds. Defaults to 0.015.
+        """
+        self.latency = latency
+        self.per_request = per_request
+
+    def manual_seed(self, seed: int) -> None:
+        pass
+
+    def batch(self, requests: list[Request]) -> list[str]:
+        sleep(self.latency + self.per_request * len(requests))
+        return [f"{len(text)} {image.size[0]}x{image.size[1]}" for text, image, _ in requests]
+
+    def classify(self, text: str, image: Image.Image, labels: tuple[str, ...] = ("yes", "no"),
+                 budget: tuple[int, int] | None = None) -> tuple[str, float]:
+        sleep(self.latency)
+        return labels[0], 1.0
+
+
+class DynamicBatcher:
+    """Coalesce requests arriving within a short window into a single `generate` call.
+
+    The first pending request opens a window of `window` seconds. Every request arriving within the window,
+    up to `max_batch` requests, joins the batch. Requests with different seeds go to separate `generate` calls,
+    and `classify` requests are answered one by one - each is a single forward pass anyway.
+    At most `max_pending` requests wait for the model, and `submit` blocks once there are more - clients
+    are slowed down instead of the queue growing without bound.
+    """
+    def __init__(self, backend: Any, max_batch: int = 8, window: float = 0.01, max_pending: int = 64):
+        """
+        Args:
+            backend (Any): `VLMWrapper` or `StubVLM`. It's used from the batcher thread only
+            max_batch (int, optional): max number of requests per batch. Defaults to 8.
+            window (float, optional): time to wait for more requests after the first one, seconds. Defaults to 0.01.
+            max_pending (int, optional): max number of requests waiting for the model. Defaults to 64.
+        """
+        self.backend = backend
+        self.max_batch = max_batch
+        self.window = window
+        # (kind, request, seed, deadline, future). None stops the batcher
+        self.pending: Queue[tuple[str, tuple, int | None, float, Future] | None] = Queue(max_pending)
+        # Metrics
+        self.batches = 0
+        self.requests = 0
+        self.expired = 0
+        self.rejected = 0
+        self.stopped = False
+        self.thread = Thread(target=self._run, name="vlm-batcher", daemon=True)
+        self.thread.start()
+
+    def submit(self, kind: str, request: tuple, seed: int | None, deadline: float) -> Future:
+        """Queue the request.
+
+        Args:
+            kind (str): "generate" - request is (text, image, budget) for `backend.batch`,
+                "classify" - request is (text, image, labels, budget) for `backend.classify`
+            request (tuple): request
+            seed (int | None): generation seed of the client. None - keep the current one
+            deadline (float): `time.monotonic()` by which the result is useless to the client
+
+        Returns:
+            Future: result of the request
+        """
+        if self.stopped:
+            raise RuntimeError("Server is shutting down")
+        future = Future()
+        try:
+            self.pending.put((kind, request, seed, deadline, future), timeout=max(deadline - monotonic(), 0.0))
+        except Full:
+            self.rejected += 1
+            raise TimeoutError(f"Server is busy: {self.pending.qsize()} pending requests")
+        return future
+
+    def stop(self) -> None:
+        """Answer the collected requests, and fail the rest."""
+        self.stopped = True
+        self.pending.put(None)
+        self.thread.join()
+        while not self.pending.empty():
+            item = self.pending.get_nowait()
+            if item is not None and item[-1].set_running_or_notify_cancel():
+                item[-1].set_exception(RuntimeError("Server is shutting down"))
+
+    def stats(self) -> dict[str, int | float]:
+        """Get batching metrics."""
+        return {
+            "batches": self.batches,
+            "requests": self.requests,
+            "mean_batch_size": self.requests / self.batches if self.batches else 0.0,
+            "expired": self.expired,
+            "rejected": self.rejected,
+            "pending": self.pending.qsize()
+        }
+
+    def _collect(self) -> list[tuple[str, tuple, int | None, float, Future]] | None:
+        """Wait for the first request, and for the others arriving within the window."""
+        first = self.pending.get()
+        if first is None:
+            return None
+        batch = [first]
+        window_end = monotonic() + self.window
+        while len(batch) < self.max_batch:
+            try:
+                item = self.pending.get(timeout=max(window_end - monotonic(), 0.0)) if self.window > 0 else self.pending.get_nowait()
+            except Empty:
+                break
+            if item is None:
+                # Answer the collected requests first
+                self.pending.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self) -> None:
+        while (batch := self._collect()) is not None:
+            now = monotonic()
+            generate: dict[int | None, list[tuple[tuple, Future]]] = {}
+            classify: list[tuple[tuple, int | None, Future]] = []
+            for kind, request, seed, deadline, future in batch:
+                # Client has given up on the request
+                if not future.set_running_or_notify_cancel():
+                    continue
+                if deadline < now:
+                    self.expired += 1
+                    future.set_exception(TimeoutError("Deadline exceeded while waiting for the model"))
+                elif kind == "generate":
+                    generate.setdefault(seed, []).append((request, future))
+                else:
+                    classify.append((request, seed, future))
+
+            for seed, items in generate.items():
+                self._answer([future for _, future in items], seed, self.backend.batch, [request for request, _ in items])
+                self.batches += 1
+                self.requests += len(items)
+            for request, seed, future in classify:
+                self._answer([future], seed, lambda request: [self.backend.classify(*request)], request)
+                self.batches += 1
+                self.requests += 1
+
+    def _answer(self, futures: list[Future], seed: int | None, method: Any, payload: Any) -> None:
+        """Run `method(payload)` with the seed, and set results of the futures."""
+        try:
+            if seed is not None:
+                self.backend.manual_seed(seed)
+            results = method(payload)
+        except Exception as e:
+            logger.exception(f"Error during model inference: {str(e)}")
+            for future in futures:
+                future.set_exception(RuntimeError(f"Model inference failed: {str(e)}"))
+            return
+        for future, result in zip(futures, results):
+            future.set_result(result)
+
+
+class VLMServer:
+    """Local inference service around a single copy of the model, shared by agent processes.
+
+    Clients connect with `VLMClient`, or `VLMWrapper(server=...)`. Every connection is served by its own thread,
+    and all the requests go through a `DynamicBatcher`.
+    """
+    def __init__(self, backend: Any, address: str = "127.0.0.1:8091", authkey: bytes | None = None,
+                 max_batch: int = 8, window: float = 0.01, max_pending: int = 64, timeout: float = 30.0,
+                 allow_remote: bool = False):
+        """
+        Args:
+            backend (Any): `VLMWrapper` or `StubVLM`
+            address (str, optional): "host:port", path of Unix socket, or name of Windows pipe. Defaults to "127.0.0.1:8091".
+            authkey (bytes | None, optional): shared secret of server and clients. Defaults to None - `load_authkey`,
+                the key file is generated if needed.
+            max_batch (int, optional): max number of requests per batch. Defaults to 8.
+            window (float, optional): time to wait for more requests after the first one, seconds. Defaults to 0.01.
+            max_pending (int, optional): max number of requests waiting for the model. Defaults to 64.
+            timeout (float, optional): deadline of requests without one, seconds. Defaults to 30.0.
+            allow_remote (bool, optional): allow to listen on non-loopback host. Defaults to False.
+
+        Raises:
+            ValueError: non-loopback host without `allow_remote`
+        """
+        parsed = parse_address(address)
+        if not is_loopback(parsed):
+            if not allow_remote:
+                raise ValueError(f"Refusing to listen on non-loopback {address}: anyone with the key can run code in the server. "
+                                 "Pass allow_remote=True, or --allow-remote, to do it anyway")
+            logger.warning(f"VLM server listens on non-loopback {address}")
+        self.batcher = DynamicBatcher(backend, max_batch, window, max_pending)
+        self.timeout = timeout
+        self.authkey = authkey if authkey is not None else load_authkey(create=True)
+        self.listener = Listener(parsed, authkey=self.authkey)
+        self.connections = 0
+        self.closed = False
+
+    @property
+    def address(self) -> tuple[str, int] | str:
+        """Address the server listens on, e.g. with port 0 resolved."""
+        return self.listener.address
+
+    def serve_forever(self) -> None:
+        logger.info(f"VLM server is listening on {self.address}")
+        try:
+            while not self.closed:
+                try:
+                    connection = self.listener.accept()
+                except AuthenticationError:
+                    logger.warning("Rejected VLM client with wrong authkey")
+                    continue
+                if self.closed:
+                    connection.close()
+                    break
+                self.connections += 1
+                Thread(target=self._serve, args=(connection,), name=f"vlm-client-{self.connections}", daemon=True).start()
+        finally:
+            self.listener.close()
+            self.batcher.stop()
+
+    def close(self) -> None:
+        """Stop `serve_forever` from another thread."""
+        self.closed = True
+        # Closing the listener doesn't interrupt a blocked accept() - connect to wake it up
+        try:
+            Client(self.address, authkey=self.authkey).close()
+        except OSError:
+            pass
+
+    def stats(self) -> dict[str, int | float]:
+        return {"connections": self.connections} | self.batcher.stats()
+
+    def _serve(self, connection: Connection) -> None:
+        with connection:
+            while True:
+                try:
+                    message = connection.recv()
+                except (EOFError, OSError):
+                    break
+                connection.send(self._handle(message))
+
+    def _handle(self, message: dict[str, Any]) -> tuple[str, Any]:
+        """Answer a client message.
+
+        Args:
+            message (dict[str, Any]): {"op": "batch", "requests": [...], "seed": ..., "timeout": ...},
+                {"op": "classify", "request": (text, image, labels, budget), "seed": ..., "timeout": ...}, or {"op": "stats"}
+
+        Returns:
+            tuple[str, Any]: ("ok", result), ("timeout", reason), or ("error", reason)
+        """
+        op = message["op"]
+        if op == "stats":
+            return "ok", self.stats()
+
+        deadline = monotonic() + message.get("timeout", self.timeout)
+        seed = message.get("seed")
+        futures = []
+        try:
+            if op == "batch":
+                futures = [self.batcher.submit("generate", request, seed, deadline) for request in message["requests"]]
+            elif op == "classify":
+                futures = [self.batcher.submit("classify", message["request"], seed, deadline)]
+            else:
+                return "error", f"Unknown operation: {op}"
+            results = [future.result(timeout=max(deadline - monotonic(), 0.0)) for future in futures]
+        except TimeoutError as e:
+            for future in futures:
+                future.cancel()
+            return "timeout", str(e) or "Deadline exceeded"
+        except Exception as e:
+            return "error", str(e)
+        return "ok", results if op == "batch" else results[0]
+
+
+class VLMClient:
+    """Connection to `VLMServer`. Thread-safe - requests of several threads are sent one after another."""
+    def __init__(self, address: str = "127.0.0.1:8091", authkey: bytes | None = None, timeout: float = 30.0):
+        """
+        Args:
+            address (str, optional): address of the server. Defaults to "127.0.0.1:8091".
+            authkey (bytes | None, optional): shared secret of server and clients. Defaults to None - `load_authkey`.
+            timeout (float, optional): deadline of every request, seconds. Defaults to 30.0.
+        """
+        self.address = parse_address(address)
+        self.authkey = authkey if authkey is not None else load_authkey()
+        self.timeout = timeout
+        self.lock = Lock()
+        self.connection: Connection | None = None
+
+    def batch(self, requests: list[Request], seed: int | None = None, timeout: float | None = None) -> list[str]:
+        """Query VLM with several normalized requests, see `VLMWrapper._normalize_request`."""
+        return self._request({"op": "batch", "requests": requests, "seed": seed, "timeout": timeout or self.timeout})
+
+    def classify(self, text: str, image: Image.Image, labels: tuple[str, ...], budget: tuple[int, int],
+                 seed: int | None = None, timeout: float | None = None) -> tuple[str, float]:
+        """Answer closed question, see `VLMWrapper.classify`."""
+        return tuple(self._request({"op": "classify", "request": (text, image, labels, budget), "seed": seed,
+                                    "timeout": timeout or self.timeout}))
+
+    def stats(self) -> dict[str, int | float]:
+        return self._request({"op": "stats"})
+
+    def close(self) -> None:
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+    def _request(self, message: dict[str, Any]) -> Any:
+        """Send the message, and wait for the answer. Reconnects once if the server has dropped the connection."""
+        with self.lock:
+            for attempt in range(2):
+                if self.connection is None:
+                    self.connection = Client(self.address, authkey=self.authkey)
+                try:
+                    self.connection.send(message)
+                    status, result = self.connection.recv()
+                    break
+                except (EOFError, OSError):
+                    self.connection.close()
+                    self.connection = None
+                    if attempt:
+                        raise
+        if status == "timeout":
+            raise TimeoutError(result)
+        if status == "error":
+            raise RuntimeError(result)
+        return result
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serve VLM to agent processes over a local socket")
+    parser.add_argument("--address", default="127.0.0.1:8091", help="host:port, path of Unix socket, or name of Windows pipe")
+    parser.add_argument("--model-path", help="path/to/model. Defaults to VLMWrapper.model_path")
+    parser.add_argument("--stub", action="store_true", help="serve CPU-only stub model for load tests")
+    parser.add_argument("--max-batch", type=int, default=8, help="max number of requests per batch")
+    parser.add_argument("--window-ms", type=float, default=10.0, help="time to wait for more requests after the first one")
+    parser.add_argument("--max-pending", type=int, default=64, help="max number of requests waiting for the model")
+    parser.add_argument("--allow-remote", action="store_true", help="allow to listen on non-loopback host")
+    args = parser.parse_args()
+
+    if args.stub:
+        backend = StubVLM()
+    else:
+        from nodes.vlm_wrapper import VLMWrapper
+        backend = VLMWrapper(model_path=args.model_path)
+
+    server = VLMServer(backend, args.address, max_batch=args.max_batch, window=args.window_ms / 1000, max_pending=args.max_pending,
+                       allow_remote=args.allow_remote)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.close()
+        logger.info(f"VLM server stopped: {server.stats()}")
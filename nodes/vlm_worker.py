@@ -0,0 +1,296 @@
+from concurrent.futures import Future
+from multiprocessing import get_context
+from multiprocessing.connection import Connection
+from multiprocessing.shared_memory import SharedMemory
+from queue import Queue
+from threading import Lock, Thread
+from time import monotonic
+from typing import Any
+import numpy as np
+from loguru import logger
+from PIL import Image
+
+from nodes.vlm_server import DynamicBatcher, StubVLM
+
+
+# Pixels of a request image in shared memory: (name of the block, offset, shape)
+ImageRef = tuple[str, int, tuple[int, ...]]
+
+
+def as_pixels(image: object) -> np.ndarray:
+    """Get HxWx3 RGB pixels out of path/to/image.png, PIL.Image, Frame, or ndarray without copying them if possible."""
+    if isinstance(image, str):
+        image = Image.open(image)
+    if isinstance(image, Image.Image) and image.mode != "RGB":
+        image = image.convert("RGB")
+    return np.asarray(image)[..., :3]
+
+
+class FrameSlots:
+    """Pool of shared memory blocks to pass pixels to the worker without pickling.
+
+    Images of a request are written to a single slot one after another. A request that doesn't fit into a slot
+    gets a block of its own. Slot is busy until the worker answers the request - `write` blocks while all slots are busy.
+    """
+    def __init__(self, n_slots: int = 4, slot_size: int = 1920 * 1080 * 3):
+        """
+        Args:
+            n_slots (int, optional): number of slots - max number of requests in flight. Defaults to 4.
+            slot_size (int, optional): size of a slot, bytes. Defaults to 1920 * 1080 * 3 - a full frame.
+        """
+        self.slot_size = slot_size
+        self.blocks = [SharedMemory(create=True, size=slot_size) for _ in range(n_slots)]
+        self.free: Queue[SharedMemory] = Queue()
+        for block in self.blocks:
+            self.free.put(block)
+
+    def write(self, images: list[np.ndarray]) -> tuple[SharedMemory, list[ImageRef]]:
+        """Copy images to a free slot.
+
+        Returns:
+            tuple[SharedMemory, list[ImageRef]]: block to `release` once the request is answered, and references of the images
+        """
+        nbytes = sum(image.nbytes for image in images)
+        block = self.free.get() if nbytes <= self.slot_size else SharedMemory(create=True, size=max(nbytes, 1))
+        refs, offset = [], 0
+        for image in images:
+            np.copyto(np.ndarray(image.shape, np.uint8, block.buf, offset), image)
+            refs.append((block.name, offset, image.shape))
+            offset += image.nbytes
+        return block, refs
+
+    def is_pooled(self, block: SharedMemory) -> bool:
+        return any(block is pooled for pooled in self.blocks)
+
+    def release(self, block: SharedMemory) -> None:
+        if self.is_pooled(block):
+            self.free.put(block)
+        else:
+            block.close()
+            block.unlink()
+
+    def close(self) -> None:
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks.clear()
+
+
+def _worker_main(connection: Connection, backend_kwargs: dict[str, Any] | None, max_batch: int, window: float) -> None:
+    """Body of the worker process: load the model, and answer requests until None or the pipe is closed.
+
+    Requests are run through a `DynamicBatcher`, so the requests queued while the model is busy go to a single `generate` call.
+    """
+    if backend_kwargs is None:
+        backend = StubVLM()
+    else:
+        from nodes.vlm_wrapper import VLMWrapper
+        backend = VLMWrapper(**backend_kwargs)
+    batcher = DynamicBatcher(backend, max_batch, window)
+    lock = Lock()
+    # Slots of the pool stay attached
+    blocks: dict[str, SharedMemory] = {}
+
+    def read(ref: ImageRef, pooled: bool) -> Image.Image:
+        name, offset, shape = ref
+        if pooled:
+            if name not in blocks:
+                blocks[name] = SharedMemory(name=name)
+            block = blocks[name]
+        else:
+            block = SharedMemory(name=name)
+        # Image.fromarray copies RGB pixels - the block may be released right after the answer
+        image = Image.fromarray(np.ndarray(shape, np.uint8, block.buf, offset))
+        if not pooled:
+            block.close()
+        return image
+
+    def answer(request_id: int, futures: list[Future], single: bool) -> None:
+        remaining = [len(futures)]
+        if not futures:
+            with lock:
+                connection.send((request_id, "ok", []))
+            return
+
+        def on_done(_: Future) -> None:
+            with lock:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            try:
+                results = [future.result() for future in futures]
+                message = (request_id, "ok", results[0] if single else results)
+            except TimeoutError as e:
+                message = (request_id, "timeout", str(e))
+            except Exception as e:
+                message = (request_id, "error", str(e))
+            with lock:
+                connection.send(message)
+
+        for future in futures:
+            future.add_done_callback(on_done)
+
+    while True:
+        try:
+            message = connection.recv()
+        except (EOFError, OSError):
+            break
+        if message is None:
+            break
+        request_id, op, payload, seed, timeout, pooled = message
+        deadline = monotonic() + timeout
+        try:
+            if op == "batch":
+                futures = [batcher.submit("generate", (text, read(ref, pooled), budget), seed, deadline) for text, ref, budget in payload]
+            else:
+                text, ref, labels, budget = payload
+                futures = [batcher.submit("classify", (text, read(ref, pooled), labels, budget), seed, deadline)]
+        except Exception as e:
+            with lock:
+                connection.send((request_id, "timeout" if isinstance(e, TimeoutError) else "error", str(e)))
+            continue
+        answer(request_id, futures, single=op == "classify")
+
+    batcher.stop()
+    for block in blocks.values():
+        block.close()
+
+
+class VLMWorker:
+    """VLM in a dedicated process.
+
+    Tokenization, image preprocessing, and generation don't hold the GIL of the agent process, and a CUDA or bitsandbytes
+    crash takes down only the worker - pending requests fail, and the next request starts a new worker.
+    Pixels go to the worker through `FrameSlots`, only text and references to the pixels are pickled.
+    Requests are answered with futures, see `submit_batch`, and `submit_classify`. `batch`, and `classify` wait for them.
+    """
+    def __init__(self, model_path: str | None = None, max_new_tokens: int = 512, greedy: bool = True, stub: bool = False,
+                 n_slots: int = 4, max_batch: int = 8, window: float = 0.0, timeout: float = 60.0):
+        """
+        Args:
+            model_path (str | None, optional): path/to/model. Defaults to None - `VLMWrapper.model_path`.
+            max_new_tokens (int, optional): max number of generated tokens. Defaults to 512.
+            greedy (bool, optional): greedy decoding, see `VLMWrapper.batch`. Defaults to True.
+            stub (bool, optional): run CPU-only `StubVLM` instead of the model. Defaults to False.
+            n_slots (int, optional): max number of requests in flight, see `FrameSlots`. Defaults to 4.
+            max_batch (int, optional): max number of queued requests per `generate` call. Defaults to 8.
+            window (float, optional): time to wait for more requests after the first one, seconds. Defaults to 0.0.
+            timeout (float, optional): deadline of a request since the worker has received it, seconds. Defaults to 60.0.
+        """
+        self.backend_kwargs = None if stub else {"model_path": model_path, "max_new_tokens": max_new_tokens, "greedy": greedy}
+        self.max_batch = max_batch
+        self.window = window
+        self.timeout = timeout
+        self.slots = FrameSlots(n_slots)
+        self.lock = Lock()
+        self.next_id = 0
+        self.restarts = -1
+        self._start()
+
+    def submit_batch(self, requests: list[tuple[str, object, tuple[int, int]]], seed: int | None = None,
+                     timeout: float | None = None) -> Future:
+        """Queue VLM query with several prompts.
+
+        Args:
+            requests (list[tuple[str, object, tuple[int, int]]]): list of (text prompt, image, (min_pixels, max_pixels)).
+                Image is path/to/image.png, PIL.Image, Frame, or HxWx3 ndarray crop
+            seed (int | None, optional): generation seed. Defaults to None - keep the current one.
+            timeout (float | None, optional): deadline, seconds. Defaults to None - `self.timeout`.
+
+        Returns:
+            Future: list[str] - VLM results in the order of requests
+        """
+        block, refs = self.slots.write([as_pixels(image) for _, image, _ in requests])
+        payload = [(text, ref, budget) for (text, _, budget), ref in zip(requests, refs)]
+        return self._submit("batch", payload, seed, timeout, block)
+
+    def submit_classify(self, text: str, image: object, labels: tuple[str, ...], budget: tuple[int, int],
+                        seed: int | None = None, timeout: float | None = None) -> Future:
+        """Queue closed question, see `VLMWrapper.classify`.
+
+        Returns:
+            Future: tuple[str, float] - most probable label, and its probability among labels
+        """
+        block, refs = self.slots.write([as_pixels(image)])
+        return self._submit("classify", (text, refs[0], labels, budget), seed, timeout, block)
+
+    def batch(self, requests: list[tuple[str, object, tuple[int, int]]], seed: int | None = None, timeout: float | None = None) -> list[str]:
+        return self.submit_batch(requests, seed, timeout).result()
+
+    def classify(self, text: str, image: object, labels: tuple[str, ...], budget: tuple[int, int],
+                 seed: int | None = None, timeout: float | None = None) -> tuple[str, float]:
+        return tuple(self.submit_classify(text, image, labels, budget, seed, timeout).result())
+
+    def stats(self) -> dict[str, int]:
+        return {"restarts": self.restarts, "pending": len(self.pending), "free_slots": self.slots.free.qsize()}
+
+    def close(self) -> None:
+        """Stop the worker, and free shared memory."""
+        with self.lock:
+            try:
+                self.connection.send(None)
+            except OSError:
+                pass
+            self.process.join(5.0)
+            if self.process.is_alive():
+                self.process.terminate()
+            self.connection.close()
+        self.reader.join()
+        self.slots.close()
+
+    def _start(self) -> None:
+        """Start a worker process, and a thread reading its answers."""
+        context = get_context("spawn")
+        self.connection, child = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child, self.backend_kwargs, self.max_batch, self.window),
+                                       name="vlm-worker", daemon=True)
+        self.process.start()
+        child.close()
+        self.restarts += 1
+        # request id -> (future, block) of requests sent to this worker
+        self.pending: dict[int, tuple[Future, SharedMemory]] = {}
+        self.reader = Thread(target=self._read, args=(self.connection, self.process, self.pending), name="vlm-worker-reader", daemon=True)
+        self.reader.start()
+        logger.info(f"VLM worker started, pid {self.process.pid}")
+
+    def _submit(self, op: str, payload: Any, seed: int | None, timeout: float | None, block: SharedMemory) -> Future:
+        future = Future()
+        with self.lock:
+            if not self.process.is_alive():
+                logger.error(f"VLM worker has died with exit code {self.process.exitcode}. Restarting")
+                self._start()
+            request_id = self.next_id
+            self.next_id += 1
+            self.pending[request_id] = (future, block)
+            try:
+                self.connection.send((request_id, op, payload, seed, timeout or self.timeout, self.slots.is_pooled(block)))
+            except OSError as e:
+                del self.pending[request_id]
+                self.slots.release(block)
+                future.set_exception(RuntimeError(f"VLM worker is unreachable: {str(e)}"))
+        return future
+
+    def _read(self, connection: Connection, process: Any, pending: dict[int, tuple[Future, SharedMemory]]) -> None:
+        """Resolve futures with answers of the worker. Fail the pending ones once the worker is gone."""
+        while True:
+            try:
+                request_id, status, result = connection.recv()
+            except (EOFError, OSError):
+                break
+            with self.lock:
+                future, block = pending.pop(request_id)
+            self.slots.release(block)
+            if status == "ok":
+                future.set_result(result)
+            elif status == "timeout":
+                future.set_exception(TimeoutError(result))
+            else:
+                future.set_exception(RuntimeError(result))
+
+        process.join(1.0)
+        with self.lock:
+            lost = list(pending.values())
+            pending.clear()
+        for future, block in lost:
+            self.slots.release(block)
+            future.set_exception(RuntimeError(f"VLM worker has died with exit code {process.exitcode}"))
@@ -1,6 +1,8 @@
+from concurrent.futures import Future
 from time import perf_counter
 from loguru import logger
 from PIL import Image
+import numpy as np
 import torch
 from transformers import (
     AutoTokenizer,
@@ -10,18 +12,43 @@ from transformers import (
 )
 from qwen_vl_utils import process_vision_info
 
+from nodes.vlm_cache import VLMCache
+from nodes.vlm_server import VLMClient
+from nodes.vlm_worker import VLMWorker
+from vision.frames import as_image
+
 
 class VLMWrapper:
     """Wrapper around VLM class
+
+    In client mode (`server` is set) the model isn't loaded. Requests are sent to `nodes.vlm_server`,
+    which batches them with requests of other agent processes:
+        python -m nodes.vlm_server --address 127.0.0.1:8091
+    In worker mode (`worker` is set) the model is loaded in a dedicated process, see `nodes.vlm_worker.VLMWorker`.
+    `submit` then queues the query and returns right away.
     """
     model_path:str = r"D:\models\Qwen2.5-VL-7B-Instruct-unsloth-bnb-4bit"
+    # Default pixel budget of the image. One vision token covers 28x28 pixels
     min_pixels:int = 256*28*28
     max_pixels:int = 1024*28*28
+    # Named pixel budgets (min_pixels, max_pixels) for call sites
+    budgets: dict[str, tuple[int, int]] = {
+        "digit_crop": (32*28*28, 64*28*28),             # Few numbers on a small crop: upscale a bit, a few dozen tokens
+        "icon_column": (48*28*28, 96*28*28),            # Column of icons or percentages
+        "full_frame_classifier": (64*28*28, 256*28*28)  # Yes/no question about the whole screen
+    }
+    # Images are resized per request, so processor bounds must not interfere
+    processor_min_pixels:int = 4*28*28
+    processor_max_pixels:int = 16384*28*28
 
     def __init__(self, model_path: str | None = None,
                  min_pixels: int | None = None,
                  max_pixels: int | None = None,
-                 max_new_tokens: int = 512):
+                 max_new_tokens: int = 512,
+                 greedy: bool = True,
+                 cache: VLMCache | None = None,
+                 server: str | None = None,
+                 worker: bool = False):
         if model_path:
             self.model_path = model_path
 
@@ -32,6 +59,25 @@ class VLMWrapper:
             self.max_pixels = max_pixels
 
         self.max_new_tokens = max_new_tokens
+        # Greedy decoding - a result doesn't depend on the seed, nor on the other requests of the batch
+        self.greedy = greedy
+        # Cache of results. Hits skip preprocessing, and inference
+        self.cache = cache if cache is not None else VLMCache()
+
+        # Number of prompt tokens per request of the last batch
+        self.last_prefill_tokens: list[int] = []
+        # Label -> ids of its first token. See `classify`
+        self.label_token_ids: dict[str, list[int]] = {}
+
+        # Client, and worker modes - model, and cache live in another process
+        self.client: VLMClient | VLMWorker | None = None
+        if server:
+            self.client = VLMClient(server)
+            logger.info(f"Using VLM server at {server}")
+            return
+        if worker:
+            self.client = VLMWorker(model_path=self.model_path, max_new_tokens=max_new_tokens, greedy=greedy)
+            return
 
         logger.info("Attempting to load VLM")
         t0 = perf_counter()
@@ -43,9 +89,11 @@ class VLMWrapper:
         self.tokenizer = AutoTokenizer.from_pretrained(self.model_path)
         logger.info("Tokenizer successfully loaded")
         self.processor = AutoProcessor.from_pretrained(self.model_path,
-                                            min_pixels=self.min_pixels,
-                                            max_pixels=self.max_pixels
+                                            min_pixels=self.processor_min_pixels,
+                                            max_pixels=self.processor_max_pixels
                                             )
+        # Batched prompts must end at the same position
+        self.processor.tokenizer.padding_side = "left"
         logger.info("Processor successfully loaded")
 
         self.model = Qwen2_5_VLForConditionalGeneration.from_pretrained(
@@ -59,69 +107,265 @@ class VLMWrapper:
         logger.info(f"Model successfully loaded in {t0:.2f}s")
 
 
-    def __call__(self, text: str, image: str | Image.Image) -> list[str]:
+    def __call__(self, text: str, image: str | Image.Image | np.ndarray, budget: str | int | tuple[int, int] | None = None) -> list[str]:
         """Query VLM with multimodal prompt
 
         Args:
             text (str): text prompt
-            image (str | Image.Image): path/to/image.png or PIL.Image
+            image (str | Image.Image | np.ndarray): path/to/image.png, PIL.Image, Frame, or HxWx3 ndarray crop
+            budget (str | int | tuple[int, int] | None, optional): pixel budget of the image. See `get_budget`. Defaults to None.
 
         Returns:
             list[str]: VLM result
         """
+        return self.batch([(text, image, budget)])
+
+    def get_budget(self, budget: str | int | tuple[int, int] | None = None) -> tuple[int, int]:
+        """Get pixel budget of the image.
+
+        Args:
+            budget (str | int | tuple[int, int] | None, optional): name of the budget from `budgets`,
+                number of pixels to resize image to, or (min_pixels, max_pixels).
+                Defaults to None - (self.min_pixels, self.max_pixels).
+
+        Returns:
+            tuple[int, int]: min_pixels, max_pixels
+        """
+        if budget is None:
+            return (self.min_pixels, self.max_pixels)
+        if isinstance(budget, str):
+            return self.budgets[budget]
+        if isinstance(budget, int):
+            return (budget, budget)
+        return tuple(budget)
+
+    def batch(self, requests: list[tuple[str, str | Image.Image | np.ndarray] | tuple[str, str | Image.Image | np.ndarray, str | int | tuple[int, int] | None]]) -> list[str]:
+        """Query VLM with several multimodal prompts in a single `generate` call.
+
+        Prompts are left-padded to the same length, so every prompt ends at the same position.
+        With `greedy` decoding a result is the same as the one of a separate `__call__`, see `benchmarks.bench_vlm_batch`.
+        Otherwise decoding follows generation config of the model: random numbers are drawn for the whole batch,
+        so a result depends on the seed, and on the other requests. Such results are cached apart from the ones of `__call__`.
+
+        Args:
+            requests (list[tuple]): list of (text prompt, path/to/image.png, PIL.Image, Frame, or ndarray crop[, pixel budget])
+
+        Returns:
+            list[str]: VLM results in the order of requests
+        """
+        if isinstance(self.client, VLMWorker):
+            return self.submit(requests).result()
+
         t0 = perf_counter()
-        with torch.no_grad():
-            logger.info("Prepare inputs")
+        requests = [self._normalize_request(request) for request in requests]
+        result = ["" for _ in requests]
 
-            if not isinstance(image, Image.Image):
-                pil_image = Image.open(image)
-            else:
-                pil_image = image
+        if self.client is not None:
+            try:
+                result = self.client.batch(requests, seed=torch.initial_seed())
+                logger.info(f"Success in {perf_counter() - t0:.2f}s (VLM server)")
+            except Exception as e:
+                logger.exception(f"Error during model inference: {str(e)}")
+            return result
 
-            messages = [
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": text},
-                        {"type": "image", "image": pil_image}
-                    ],
-                }
-            ]
+        # Look up cached results. Sampling depends on the seed, and on the batch
+        seed = None if self.greedy else torch.initial_seed()
+        kind = "generate" if self.greedy or len(requests) == 1 else "generate_batch"
+        misses = []
+        for idx, (text, image, budget) in enumerate(requests):
+            prefix = VLMCache.prefix(kind, text, seed, self.max_new_tokens, budget)
+            key, image_hash, value = self.cache.get(prefix, image)
+            if value is None:
+                misses.append((idx, key, prefix, image_hash))
+            else:
+                result[idx] = value
 
-            text = self.processor.apply_chat_template(
-                messages, tokenize=False, add_generation_prompt=True
-            )
+        if not misses:
+            logger.info(f"Cache hit: {len(requests)}/{len(requests)}. {self.cache.stats()}")
+            return result
 
-            image_inputs, video_inputs = process_vision_info(messages)
-            inputs = self.processor(
-                text=[text],
-                images=image_inputs,
-                videos=video_inputs,
-                padding=True,
-                return_tensors="pt",
-            ).to("cuda")
+        with torch.no_grad():
+            inputs = self._prepare_inputs([requests[idx] for idx, *_ in misses])
 
             # Generate
-            logger.info("Generating")
+            logger.info(f"Generating, prefill tokens: {self.last_prefill_tokens}")
             try:
-                generated_ids = self.model.generate(**inputs, max_new_tokens=self.max_new_tokens)
-                generated_ids_trimmed = [
-                    out_ids[len(in_ids):] for in_ids, out_ids in zip(inputs.input_ids, generated_ids)
-                ]
-                result = self.processor.batch_decode(
+                sampling = {"do_sample": False, "temperature": None, "top_p": None, "top_k": None} if self.greedy else {}
+                generated_ids = self.model.generate(**inputs, max_new_tokens=self.max_new_tokens, **sampling)
+                # Left padding - every prompt ends at the same position
+                generated_ids_trimmed = generated_ids[:, inputs.input_ids.shape[1]:]
+                generated = self.processor.batch_decode(
                     generated_ids_trimmed,
                     skip_special_tokens=True,
                     clean_up_tokenization_spaces=False,
                     temperature=0.7,
                 )
+                for (idx, key, prefix, image_hash), value in zip(misses, generated):
+                    result[idx] = value
+                    self.cache.put(key, prefix, image_hash, value)
                 
                 t0 = perf_counter() - t0
-                logger.info(f"Success in {t0:.2f}s")
+                logger.info(f"Success in {t0:.2f}s. Cache hit: {len(requests) - len(misses)}/{len(requests)}")
             except Exception as e:
                 logger.exception(f"Error during model inference: {str(e)}")
 
             return result
 
+    def submit(self, requests: list[tuple[str, str | Image.Image | np.ndarray] | tuple[str, str | Image.Image | np.ndarray, str | int | tuple[int, int] | None]]) -> Future:
+        """Queue VLM query with several multimodal prompts, see `batch`.
+
+        In worker mode returns right away, so the caller may keep driving the game while the worker runs inference.
+        Otherwise the query runs right away, and the returned future is already done.
+
+        Args:
+            requests (list[tuple]): list of (text prompt, path/to/image.png, PIL.Image, Frame, or ndarray crop[, pixel budget])
+
+        Returns:
+            Future: list[str] - VLM results in the order of requests. Empty strings if inference has failed, like `batch`
+        """
+        if not isinstance(self.client, VLMWorker):
+            done = Future()
+            done.set_result(self.batch(requests))
+            return done
+
+        t0 = perf_counter()
+        # Pixels go to the worker as they are, without PIL.Image in between
+        requests = [self._normalize_request(request, open_image=False) for request in requests]
+        result = Future()
+
+        def on_done(submitted: Future) -> None:
+            try:
+                value = submitted.result()
+                logger.info(f"Success in {perf_counter() - t0:.2f}s (VLM worker)")
+            except Exception as e:
+                logger.exception(f"Error during model inference: {str(e)}")
+                value = ["" for _ in requests]
+            result.set_result(value)
+
+        self.client.submit_batch(requests, seed=torch.initial_seed()).add_done_callback(on_done)
+        return result
+
+    def classify(self, text: str, image: str | Image.Image | np.ndarray, labels: tuple[str, ...] = ("yes", "no"),
+                 budget: str | int | tuple[int, int] | None = None) -> tuple[str, float]:
+        """Answer closed question with a single forward pass - no sampling, and no decoding loop.
+
+        Compares logits of the first token of every label (in lower, capitalized, and upper case)
+        at the position of the first answer token. Labels sharing a first token can't be told apart - ValueError.
+
+        Args:
+            text (str): text prompt
+            image (str | Image.Image | np.ndarray): path/to/image.png, PIL.Image, Frame, or HxWx3 ndarray crop
+            labels (tuple[str, ...], optional): possible answers. Defaults to ("yes", "no").
+            budget (str | int | tuple[int, int] | None, optional): pixel budget of the image. See `get_budget`. Defaults to None.
+
+        Returns:
+            tuple[str, float]: most probable label, and its probability among labels
+        """
+        t0 = perf_counter()
+        text, image, budget = self._normalize_request((text, image, budget), open_image=not isinstance(self.client, VLMWorker))
+        if self.client is not None:
+            label, probability = self.client.classify(text, image, tuple(labels), budget, seed=torch.initial_seed())
+            logger.info(f"Classified as '{label}' ({probability:.3f}) in {perf_counter() - t0:.2f}s ({'VLM worker' if isinstance(self.client, VLMWorker) else 'VLM server'})")
+            return label, probability
+
+        self._check_labels(labels)
+        prefix = VLMCache.prefix("classify", text, tuple(labels), budget)
+        key, image_hash, value = self.cache.get(prefix, image)
+        if value is not None:
+            logger.info(f"Cache hit: classified as '{value[0]}' ({value[1]:.3f}). {self.cache.stats()}")
+            return tuple(value)
+
+        with torch.no_grad():
+            inputs = self._prepare_inputs([(text, image, budget)])
+            logger.info(f"Classifying, prefill tokens: {self.last_prefill_tokens}")
+            logits = self.model(**inputs).logits[0, -1].float()
+
+        label_logits = torch.stack([torch.logsumexp(logits[self._label_token_ids(label)], dim=0) for label in labels])
+        probabilities = torch.softmax(label_logits, dim=0)
+        best = int(probabilities.argmax())
+        self.cache.put(key, prefix, image_hash, [labels[best], probabilities[best].item()])
+
+        t0 = perf_counter() - t0
+        logger.info(f"Classified as '{labels[best]}' ({probabilities[best].item():.3f}) in {t0:.2f}s")
+        return labels[best], probabilities[best].item()
+
+    def manual_seed(self, seed: int) -> None:
+        """Set generation seed. Used by `nodes.vlm_server` before every batch of its clients."""
+        torch.manual_seed(seed)
+
+    def _label_token_ids(self, label: str) -> list[int]:
+        """Get ids of the first token of the label in lower, capitalized, and upper case."""
+        if label not in self.label_token_ids:
+            variants = {label.lower(), label.capitalize(), label.upper()}
+            self.label_token_ids[label] = sorted({self.processor.tokenizer.encode(variant, add_special_tokens=False)[0] for variant in variants})
+        return self.label_token_ids[label]
+
+    def _check_labels(self, labels: tuple[str, ...]) -> None:
+        """Make sure no two labels share a first token in any case, see `_label_token_ids`.
+
+        Raises:
+            ValueError: labels sharing a first token
+        """
+        owners: dict[int, str] = {}
+        for label in labels:
+            for token_id in self._label_token_ids(label):
+                if owners.setdefault(token_id, label) != label:
+                    raise ValueError(f"Labels '{owners[token_id]}' and '{label}' share first token {token_id}")
+
+    def _normalize_request(self, request: tuple, open_image: bool = True) -> tuple[str, Image.Image, tuple[int, int]]:
+        """Open image, and resolve pixel budget of the request.
+
+        Args:
+            request (tuple): (text prompt, path/to/image.png or PIL.Image[, pixel budget])
+            open_image (bool, optional): convert image to PIL.Image. Defaults to True.
+
+        Returns:
+            tuple[str, Image.Image, tuple[int, int]]: text prompt, image, (min_pixels, max_pixels)
+        """
+        text, image, *budget = request
+        if open_image:
+            image = as_image(image)
+        return text, image, self.get_budget(budget[0] if budget else None)
+
+    def _prepare_inputs(self, requests: list[tuple[str, Image.Image, tuple[int, int]]]) -> object:
+        """Tokenize prompts, and preprocess images of the requests.
+
+        Args:
+            requests (list[tuple[str, Image.Image, tuple[int, int]]]): list of normalized requests. See `_normalize_request`
+
+        Returns:
+            BatchFeature: left-padded model inputs on GPU
+        """
+        logger.info(f"Prepare inputs: {len(requests)}")
+
+        messages = []
+        for text, image, (min_pixels, max_pixels) in requests:
+            messages.append([
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": text},
+                        {"type": "image", "image": image, "min_pixels": min_pixels, "max_pixels": max_pixels}
+                    ],
+                }
+            ])
+
+        texts = [
+            self.processor.apply_chat_template(message, tokenize=False, add_generation_prompt=True)
+            for message in messages
+        ]
+
+        image_inputs, video_inputs = process_vision_info(messages)
+        inputs = self.processor(
+            text=texts,
+            images=image_inputs,
+            videos=video_inputs,
+            padding=True,
+            return_tensors="pt",
+        ).to("cuda")
+        self.last_prefill_tokens = inputs.attention_mask.sum(dim=1).tolist()
+        return inputs
+
 
 if __name__ == "__main__":
     vlm = VLMWrapper()
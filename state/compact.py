@@ -0,0 +1,167 @@
+from collections import OrderedDict
+from json import dumps
+from typing import Callable
+
+from state.enemy_stat import EnemyStat
+from state.player_stat import PlayerCharacterStat
+
+
+# Formats of LLM reasoner context: "text" - English sentences, "table" - fixed-column table, "json" - minified JSON
+FORMATS = ("text", "table", "json")
+ELEMENTS = ("earth", "water", "fire", "wind", "time", "space", "mirage")
+AILMENTS = ("stat_down", "burn", "seal", "rot", "fear", "delay", "freeze", "mute", "blind", "deathblow")
+
+# Goes to the static part of the context, so it's prefilled once
+LEGEND = {
+    "table": "Columns: atk - attack, def - defense, ats - arts strength, adf - arts defense, spd - initiative, "
+             "hp/ep/cp - current/max, ailments - ailments in effect, weak/resist - element and % of arts damage it deals, "
+             "susceptible - ailments enemy may get, reach - basic: within reach of basic attack, far: only crafts and attack arts. "
+             "- means none.",
+    "json": "Keys: atk - attack, def - defense, ats - arts strength, adf - arts defense, spd - initiative, "
+            "hp/ep/cp - [current, max], ailments - ailments in effect, weak/resist - element: % of arts damage it deals, "
+            "susceptible - ailments enemy may get, reach - basic: within reach of basic attack, far: only crafts and attack arts. "
+            "Missing key means none."
+}
+HEADERS = {
+    "strengths": "id|atk|def|ats|adf|spd",
+    "status": "id|hp|ep|cp|ailments",
+    "enemies": "id|hp|stun%|atk|def|ats|adf|spd|weak|resist|susceptible|reach"
+}
+
+
+class RowCache:
+    """Rendered rows of units. Row is re-rendered only when fields of its unit change.
+
+    Units are pydantic models updated in place turn after turn, so a row is addressed by (format, kind, unit id),
+    and compared by the values of all fields of the unit.
+    """
+    def __init__(self, max_size: int = 256):
+        """
+        Args:
+            max_size (int, optional): max number of rows. Defaults to 256.
+        """
+        self.max_size = max_size
+        # (format, kind, unit id) -> (values of fields, row)
+        self.rows: OrderedDict[tuple[str, str, int], tuple[tuple, str]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, fmt: str, kind: str, unit: PlayerCharacterStat | EnemyStat, render: Callable[[], str]) -> str:
+        """Get row of the unit, rendering it with `render` if the unit has changed.
+
+        Args:
+            fmt (str): format, see `FORMATS`
+            kind (str): kind of the row, e.g. "strengths"
+            unit (PlayerCharacterStat | EnemyStat): unit
+            render (Callable[[], str]): function rendering the row
+
+        Returns:
+            str: row
+        """
+        key = (fmt, kind, unit.character_id if isinstance(unit, PlayerCharacterStat) else unit.enemy_id)
+        fields = tuple(unit.__dict__.values())
+        cached = self.rows.get(key)
+        if cached is not None and cached[0] == fields:
+            self.hits += 1
+            self.rows.move_to_end(key)
+            return cached[1]
+
+        self.misses += 1
+        row = render()
+        self.rows[key] = (fields, row)
+        self.rows.move_to_end(key)
+        while len(self.rows) > self.max_size:
+            self.rows.popitem(last=False)
+        return row
+
+    def stats(self) -> dict[str, int | float]:
+        """Get hit/miss counters."""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self.rows)
+        }
+
+
+# Rows of all TurnState prompts
+rows = RowCache()
+
+
+def check_format(fmt: str) -> None:
+    """Raise ValueError if `fmt` isn't one of `FORMATS`."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown reasoner context format {fmt!r}, expected one of {FORMATS}")
+
+
+def _ailments(unit: PlayerCharacterStat | EnemyStat) -> list[str]:
+    return [ailment for ailment in AILMENTS if getattr(unit, f"ailment_{ailment}")]
+
+
+def _elements(enemy: EnemyStat, weak: bool) -> dict[str, int]:
+    values = {element: getattr(enemy, f"weakness_{element}") for element in ELEMENTS}
+    return {element: value for element, value in values.items() if (value > 100 if weak else value < 100)}
+
+
+def _cell(values: list[str] | dict[str, int]) -> str:
+    if isinstance(values, dict):
+        values = [f"{key}{value}" for key, value in values.items()]
+    return ",".join(values) or "-"
+
+
+def _json(row: dict) -> str:
+    # Empty values are left out
+    return dumps({key: value for key, value in row.items() if value not in ([], {})}, separators=(",", ":"))
+
+
+def strength_row(character: PlayerCharacterStat, fmt: str) -> str:
+    """Get row of character's strengths."""
+    check_format(fmt)
+    def render() -> str:
+        if fmt == "text":
+            return character.strength_prompt()
+        values = {"id": character.character_id, "atk": character.attack, "def": character.defense,
+                  "ats": character.arts_attack, "adf": character.arts_defense, "spd": character.speed}
+        return _json(values) if fmt == "json" else "|".join(str(value) for value in values.values())
+    return rows.get(fmt, "strengths", character, render)
+
+
+def status_row(character: PlayerCharacterStat, fmt: str) -> str:
+    """Get row of character's HP, EP, CP, and ailments."""
+    check_format(fmt)
+    def render() -> str:
+        if fmt == "text":
+            return character.status_prompt()
+        if fmt == "json":
+            return _json({"id": character.character_id, "hp": [character.hp, character.hp_max], "ep": [character.ep, character.ep_max],
+                          "cp": [character.cp, 200], "ailments": _ailments(character)})
+        return f"{character.character_id}|{character.hp}/{character.hp_max}|{character.ep}/{character.ep_max}|{character.cp}/200|{_cell(_ailments(character))}"
+    return rows.get(fmt, "status", character, render)
+
+
+def enemy_row(enemy: EnemyStat, fmt: str) -> str:
+    """Get row of enemy's strengths, weaknesses, and reach."""
+    check_format(fmt)
+    def render() -> str:
+        if fmt == "text":
+            # Empty parts of the sentence leave runs of spaces
+            return " ".join(enemy.to_prompt().split())
+        reach = "basic" if enemy.basic_attack_enabled else "far"
+        if fmt == "json":
+            return _json({"id": enemy.enemy_id, "hp": [enemy.hp, enemy.hp_max], "stun": enemy.stun, "atk": enemy.attack,
+                          "def": enemy.defense, "ats": enemy.arts_attack, "adf": enemy.arts_defense, "spd": enemy.speed,
+                          "weak": _elements(enemy, True), "resist": _elements(enemy, False), "susceptible": _ailments(enemy), "reach": reach})
+        return f"{enemy.enemy_id}|{enemy.hp}/{enemy.hp_max}|{enemy.stun}|{enemy.attack}|{enemy.defense}|{enemy.arts_attack}|" \
+            f"{enemy.arts_defense}|{enemy.speed}|{_cell(_elements(enemy, True))}|{_cell(_elements(enemy, False))}|{_cell(_ailments(enemy))}|{reach}"
+    return rows.get(fmt, "enemies", enemy, render)
+
+
+def section(kind: str, lines: list[str], fmt: str) -> str:
+    """Join rows of a section: one per line for "text", under column header for "table", and into JSON list for "json"."""
+    check_format(fmt)
+    if fmt == "json":
+        return f"[{','.join(lines)}]"
+    if fmt == "table":
+        return "\n".join([HEADERS[kind]] + lines)
+    return "\n".join(lines)
@@ -90,10 +90,10 @@ class EnemyStat(BaseModel):
         resistance_list: list[str] = []
         for resist in [resist_earth, resist_water, resist_fire, resist_wind, resist_time, resist_space, resist_mirage]:
             if resist:
-                resistance_list.append(weakness)
+                resistance_list.append(resist)
 
         if "" == "".join(resistance_list):
-            resistance_list = ""
+            enemy_resistances = ""
         else:
             resistance_list = ", ".join(resistance_list)
             enemy_resistances = enemy_resistances.format(resistance_list=resistance_list)
@@ -44,6 +44,23 @@ class PlayerCharacterStat(BaseModel):
         character_parameters = f"Character {self.character_id} has HP {self.hp} out of {self.hp_max}, EP {self.ep} out of {self.ep_max}, CP {self.cp} out of 200. " \
         f"Its attack {self.attack}, defense {self.defense}, arts strength {self.arts_attack}, arts defense {self.arts_defense}, initiative {self.speed}."
 
+        return character_str_template.format(parameters=character_parameters, ailments=self._ailments_prompt())
+
+    def strength_prompt(self) -> str:
+        """Get string of character's strengths for LLM reasoner context.
+
+        Strengths are read once out of combat, so the string stays the same turn after turn.
+        """
+        return f"Character {self.character_id} has attack {self.attack}, defense {self.defense}, " \
+            f"arts strength {self.arts_attack}, arts defense {self.arts_defense}, initiative {self.speed}."
+
+    def status_prompt(self) -> str:
+        """Get string of character's HP, EP, CP, and ailments for LLM reasoner context."""
+        character_status = f"Character {self.character_id} has HP {self.hp} out of {self.hp_max}, EP {self.ep} out of {self.ep_max}, CP {self.cp} out of 200."
+        return f"{character_status} {self._ailments_prompt()}".rstrip()
+
+    def _ailments_prompt(self) -> str:
+        """Get string of ailments in effect, or empty string."""
         # Ailments
         character_ailments = "It is affected by {ailments_list}"
 
@@ -71,7 +88,7 @@ class PlayerCharacterStat(BaseModel):
         
             character_ailments = character_ailments.format(ailments_list=ailments_list)
 
-        return character_str_template.format(parameters=character_parameters, ailments=character_ailments)
+        return character_ailments
 
     @staticmethod
     def from_dict(parameters: dict, ailments: dict | None = None) -> object:
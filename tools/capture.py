@@ -0,0 +1,260 @@
+import ctypes
+import ctypes.util
+import glob
+import os
+from itertools import cycle
+from typing import Iterable
+import numpy as np
+from loguru import logger
+
+
+# Capture region: (left, top, width, height) in pixels of the screen. None - whole screen
+Region = tuple[int, int, int, int] | None
+
+
+class CaptureBackend:
+    """Screen capture backend. Grabs the whole screen or any sub-rectangle of it as HxWx3 RGB ndarray."""
+    def grab(self, region: Region = None) -> np.ndarray:
+        """Grab the screen.
+
+        Args:
+            region (Region, optional): (left, top, width, height) to grab. Defaults to None - whole screen.
+
+        Returns:
+            np.ndarray: HxWx3 uint8 RGB frame
+        """
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """Release backend resources."""
+        pass
+
+
+class PyAutoGUICapture(CaptureBackend):
+    """pyautogui.screenshot(). Works everywhere, but on Linux every grab shells out to an external screenshot tool."""
+    def __init__(self):
+        import pyautogui
+        self._screenshot = pyautogui.screenshot
+
+    def grab(self, region: Region = None) -> np.ndarray:
+        image = self._screenshot(region=region)
+        return np.asarray(image.convert("RGB") if image.mode != "RGB" else image)
+
+
+class _XImage(ctypes.Structure):
+    # Leading fields of XImage from X11/Xlib.h. Only these are accessed, the structure is allocated by Xlib
+    _fields_ = [
+        ("width", ctypes.c_int), ("height", ctypes.c_int), ("xoffset", ctypes.c_int), ("format", ctypes.c_int),
+        ("data", ctypes.c_void_p),
+        ("byte_order", ctypes.c_int), ("bitmap_unit", ctypes.c_int), ("bitmap_bit_order", ctypes.c_int),
+        ("bitmap_pad", ctypes.c_int), ("depth", ctypes.c_int), ("bytes_per_line", ctypes.c_int),
+        ("bits_per_pixel", ctypes.c_int),
+        ("red_mask", ctypes.c_ulong), ("green_mask", ctypes.c_ulong), ("blue_mask", ctypes.c_ulong),
+    ]
+
+
+class _XShmSegmentInfo(ctypes.Structure):
+    # X11/extensions/XShm.h
+    _fields_ = [("shmseg", ctypes.c_ulong), ("shmid", ctypes.c_int), ("shmaddr", ctypes.c_void_p), ("readOnly", ctypes.c_int)]
+
+
+class _XWindowAttributes(ctypes.Structure):
+    # Leading fields of XWindowAttributes from X11/Xlib.h. Padded to the full size of the structure
+    _fields_ = [
+        ("x", ctypes.c_int), ("y", ctypes.c_int), ("width", ctypes.c_int), ("height", ctypes.c_int),
+        ("border_width", ctypes.c_int), ("depth", ctypes.c_int), ("visual", ctypes.c_void_p), ("root", ctypes.c_ulong),
+        ("_rest", ctypes.c_byte * 128),
+    ]
+
+
+class X11ShmCapture(CaptureBackend):
+    """Direct X11 capture over MIT-SHM extension. Works on any X server including headless Xvfb.
+
+    The server copies requested sub-rectangle straight into a shared memory segment allocated once for the whole
+    screen, so a grab costs one round trip and a copy of the requested pixels only. Falls back to plain XGetImage
+    if the server doesn't support MIT-SHM, e.g. remote display.
+    """
+    _ZPixmap = 2
+    _AllPlanes = ctypes.c_ulong(-1).value
+    _IPC_PRIVATE, _IPC_CREAT, _IPC_RMID = 0, 0o1000, 0
+
+    def __init__(self, display: str | None = None, use_shm: bool = True):
+        """
+        Args:
+            display (str | None, optional): X display name, e.g. ":99". Defaults to None - $DISPLAY.
+            use_shm (bool, optional): use MIT-SHM extension if the server supports it. Defaults to True.
+        """
+        self._x11 = ctypes.CDLL(ctypes.util.find_library("X11") or "libX11.so.6")
+        self._xext = ctypes.CDLL(ctypes.util.find_library("Xext") or "libXext.so.6")
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._declare()
+
+        self._display = self._x11.XOpenDisplay(display.encode() if display else None)
+        if not self._display:
+            raise RuntimeError(f"Can't open X display {display or os.environ.get('DISPLAY')!r}")
+        self._root = self._x11.XDefaultRootWindow(self._display)
+        attributes = _XWindowAttributes()
+        self._x11.XGetWindowAttributes(self._display, self._root, ctypes.byref(attributes))
+        self.width, self.height, self._depth, self._visual = attributes.width, attributes.height, attributes.depth, attributes.visual
+
+        self._shm: _XShmSegmentInfo | None = None
+        self._images: dict[tuple[int, int], object] = {}
+        if use_shm and self._xext.XShmQueryExtension(self._display):
+            self._attach_shm()
+        logger.info(f"X11 capture: {self.width}x{self.height}x{self._depth}, {'MIT-SHM' if self._shm else 'XGetImage'}")
+
+    def _declare(self) -> None:
+        x11, xext, libc = self._x11, self._xext, self._libc
+        x11.XOpenDisplay.restype = ctypes.c_void_p
+        x11.XOpenDisplay.argtypes = [ctypes.c_char_p]
+        x11.XDefaultRootWindow.restype = ctypes.c_ulong
+        x11.XDefaultRootWindow.argtypes = [ctypes.c_void_p]
+        x11.XGetWindowAttributes.argtypes = [ctypes.c_void_p, ctypes.c_ulong, ctypes.POINTER(_XWindowAttributes)]
+        x11.XGetImage.restype = ctypes.POINTER(_XImage)
+        x11.XGetImage.argtypes = [ctypes.c_void_p, ctypes.c_ulong, ctypes.c_int, ctypes.c_int, ctypes.c_uint, ctypes.c_uint, ctypes.c_ulong, ctypes.c_int]
+        x11.XDestroyImage.argtypes = [ctypes.POINTER(_XImage)]
+        x11.XSync.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XCloseDisplay.argtypes = [ctypes.c_void_p]
+        xext.XShmQueryExtension.argtypes = [ctypes.c_void_p]
+        xext.XShmCreateImage.restype = ctypes.POINTER(_XImage)
+        xext.XShmCreateImage.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int, ctypes.c_void_p, ctypes.POINTER(_XShmSegmentInfo), ctypes.c_uint, ctypes.c_uint]
+        xext.XShmAttach.argtypes = [ctypes.c_void_p, ctypes.POINTER(_XShmSegmentInfo)]
+        xext.XShmDetach.argtypes = [ctypes.c_void_p, ctypes.POINTER(_XShmSegmentInfo)]
+        xext.XShmGetImage.argtypes = [ctypes.c_void_p, ctypes.c_ulong, ctypes.POINTER(_XImage), ctypes.c_int, ctypes.c_int, ctypes.c_ulong]
+        libc.shmget.restype = ctypes.c_int
+        libc.shmget.argtypes = [ctypes.c_int, ctypes.c_size_t, ctypes.c_int]
+        libc.shmat.restype = ctypes.c_void_p
+        libc.shmat.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_int]
+        libc.shmdt.argtypes = [ctypes.c_void_p]
+        libc.shmctl.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_void_p]
+
+    def _attach_shm(self) -> None:
+        """Allocate shared memory segment for the whole screen, 4 bytes per pixel, and attach it to X server."""
+        shm = _XShmSegmentInfo()
+        shm.shmid = self._libc.shmget(self._IPC_PRIVATE, self.width * self.height * 4, self._IPC_CREAT | 0o600)
+        if shm.shmid < 0:
+            logger.warning(f"shmget failed, errno {ctypes.get_errno()}. Falling back to XGetImage")
+            return
+        shm.shmaddr = self._libc.shmat(shm.shmid, None, 0)
+        shm.readOnly = 0
+        ok = self._xext.XShmAttach(self._display, ctypes.byref(shm))
+        self._x11.XSync(self._display, 0)
+        # Segment is destroyed once both sides detach
+        self._libc.shmctl(shm.shmid, self._IPC_RMID, None)
+        if not ok:
+            self._libc.shmdt(shm.shmaddr)
+            logger.warning("XShmAttach failed. Falling back to XGetImage")
+            return
+        self._shm = shm
+
+    def _shm_image(self, width: int, height: int) -> object:
+        """XImage header of the given size over the shared memory segment. Headers are cached per size."""
+        image = self._images.get((width, height))
+        if image is None:
+            image = self._xext.XShmCreateImage(self._display, self._visual, self._depth, self._ZPixmap, None,
+                                               ctypes.byref(self._shm), width, height)
+            image.contents.data = self._shm.shmaddr
+            self._images[(width, height)] = image
+        return image
+
+    @staticmethod
+    def _to_rgb(image: _XImage) -> np.ndarray:
+        """Copy BGRX pixels of 24/32-bit ZPixmap XImage into HxWx3 RGB ndarray."""
+        if image.bits_per_pixel != 32:
+            raise RuntimeError(f"Unsupported X image format: {image.bits_per_pixel} bits per pixel")
+        buffer = (ctypes.c_ubyte * (image.bytes_per_line * image.height)).from_address(image.data)
+        bgrx = np.frombuffer(buffer, np.uint8).reshape(image.height, image.bytes_per_line // 4, 4)[:, :image.width]
+        return np.ascontiguousarray(bgrx[..., 2::-1])
+
+    def grab(self, region: Region = None) -> np.ndarray:
+        left, top, width, height = region if region is not None else (0, 0, self.width, self.height)
+        # Default Xlib error handler terminates the process on BadMatch, so check the bounds here
+        if left < 0 or top < 0 or width <= 0 or height <= 0 or left + width > self.width or top + height > self.height:
+            raise ValueError(f"Region {(left, top, width, height)} is out of screen {self.width}x{self.height}")
+        if self._shm is not None:
+            image = self._shm_image(width, height)
+            if not self._xext.XShmGetImage(self._display, self._root, image, left, top, self._AllPlanes):
+                raise RuntimeError(f"XShmGetImage failed for region {(left, top, width, height)}")
+            return self._to_rgb(image.contents)
+
+        image = self._x11.XGetImage(self._display, self._root, left, top, width, height, self._AllPlanes, self._ZPixmap)
+        if not image:
+            raise RuntimeError(f"XGetImage failed for region {(left, top, width, height)}")
+        try:
+            return self._to_rgb(image.contents)
+        finally:
+            self._x11.XDestroyImage(image)
+
+    def close(self) -> None:
+        if not self._display:
+            return
+        for image in self._images.values():
+            # Data belongs to the shared memory segment, not to the image
+            image.contents.data = None
+            self._x11.XDestroyImage(image)
+        self._images.clear()
+        if self._shm is not None:
+            self._xext.XShmDetach(self._display, ctypes.byref(self._shm))
+            self._x11.XSync(self._display, 0)
+            self._libc.shmdt(self._shm.shmaddr)
+            self._shm = None
+        self._x11.XCloseDisplay(self._display)
+        self._display = None
+
+    def __del__(self):
+        if getattr(self, "_display", None):
+            self.close()
+
+
+class ReplayCapture(CaptureBackend):
+    """Replay screenshots from disk. Every grab returns the next frame, cropped to the requested region.
+
+    For running the agent and benchmarks without the game.
+    """
+    def __init__(self, frames: str | Iterable[str] | Iterable[np.ndarray], repeat: int = 1, loop: bool = True):
+        """
+        Args:
+            frames (str | Iterable[str] | Iterable[np.ndarray]): glob pattern, list of path/to/screenshot.png, or HxWx3 frames
+            repeat (int, optional): number of grabs returning the same frame. Defaults to 1.
+            loop (bool, optional): start over after the last frame. Defaults to True - raise StopIteration otherwise.
+        """
+        from vision.digits import load_frame
+        if isinstance(frames, str):
+            frames = sorted(glob.glob(frames))
+        self.frames = [np.ascontiguousarray(load_frame(frame)[..., :3] if isinstance(frame, str) else frame) for frame in frames]
+        if not self.frames:
+            raise ValueError("Nothing to replay")
+        self.repeat = repeat
+        self._order = cycle(range(len(self.frames))) if loop else iter(range(len(self.frames)))
+        self._current = 0
+        self._grabs = 0
+
+    def grab(self, region: Region = None) -> np.ndarray:
+        if self._grabs % self.repeat == 0:
+            self._current = next(self._order)
+        self._grabs += 1
+        frame = self.frames[self._current]
+        if region is None:
+            return frame.copy()
+        left, top, width, height = region
+        return frame[top:top + height, left:left + width].copy()
+
+
+def make_capture(backend: str = "pyautogui", display: str | None = None, replay: str | None = None) -> CaptureBackend:
+    """Create screen capture backend.
+
+    Args:
+        backend (str, optional): "pyautogui", "x11" - X11/MIT-SHM, or "replay" - screenshots from disk. Defaults to "pyautogui".
+        display (str | None, optional): X display name for "x11" backend. Defaults to None - $DISPLAY.
+        replay (str | None, optional): glob pattern of screenshots for "replay" backend. Defaults to None.
+
+    Returns:
+        CaptureBackend: capture backend
+    """
+    if backend == "x11":
+        return X11ShmCapture(display)
+    if backend == "replay":
+        return ReplayCapture(replay)
+    if backend == "pyautogui":
+        return PyAutoGUICapture()
+    raise ValueError(f"Unknown capture backend: {backend}")
@@ -1,16 +1,20 @@
-from time import sleep
-from typing import Annotated, cast
+from typing import TYPE_CHECKING, Annotated, cast
 import inspect
-import pyautogui as gui
 import pydirectinput as gui2
 from PIL import Image
 from loguru import logger
 from langchain_core.tools import tool, StructuredTool
 from langchain_core.runnables import RunnableConfig
 from langgraph.prebuilt import ToolNode, InjectedState
-# from nodes.vlm_node import VLMNode
-import nodes.vlm_node as vlm
 from nodes.graph_state import CombatState
+from vision.frames import Frame, FrameStore
+from tools.capture import CaptureBackend, PyAutoGUICapture
+from tools.targeting import plan_target_keys
+from tools.waiter import wait_until_settled
+
+if TYPE_CHECKING:
+    # nodes.vlm_node imports Controller
+    from nodes.vlm_node import VLMNode
 
 
 class Controller:
@@ -21,7 +25,16 @@ class Controller:
     attack_option: bool = True
     timeout: float = 0.5
     timeout_menu: float = 1.0
+    timeout_key: float = 0.1
+    target_attempts: int = 3
+    verify_min_wait: float = 0.2 # Min wait after target change before the selection is read back
+    # Regions (left, top, width, height) to watch for UI to settle after input. None - whole screen
+    command_menu_region: tuple[int, int, int, int] = (0, 640, 720, 400)
+    specifics_region: tuple[int, int, int, int] = (1400, 230, 520, 660)
     target_direction_f: bool = True # F - right, R - left
+    # Min EP, and CP of the active character to offer arts, and crafts to reasoner. Costs of the cheapest ones aren't read, 1 - any
+    art_min_ep: int = 1
+    craft_min_cp: int = 1
 
     def get_tools(self) -> list[StructuredTool]:
         """Get members marked as tools
@@ -32,9 +45,71 @@ class Controller:
         # TODO: Uncomment line below
         return [member[1] for member in inspect.getmembers_static(self) if isinstance(member[1], StructuredTool)]
 
-    def screenshot(self, img_path: str) -> Image.Image:
-        """Take screenshot"""
-        return gui.screenshot(img_path)
+    def get_legal_tools(self, turn_state: object) -> list[StructuredTool]:
+        """Get tools the active character can use this turn, in the order of `get_tools`.
+
+        Basic attack needs an enemy within reach, arts need EP, and no Mute, crafts need CP, and no Seal.
+        Defending, and items are always available.
+
+        Args:
+            turn_state (object): TurnState
+
+        Returns:
+            list[StructuredTool]: subset of `get_tools`. All of them if there's no active character
+        """
+        tools = self.get_tools()
+        active = [character for character in turn_state["player_characters"] if character.is_active]
+        if not active:
+            return tools
+
+        character = active[0]
+        illegal = set()
+        if not any(enemy.basic_attack_enabled for enemy in turn_state["enemies"]):
+            illegal.add("action_attack")
+        if character.ep < self.art_min_ep or character.ailment_mute:
+            illegal.add("action_use_art")
+        if character.cp < self.craft_min_cp or character.ailment_seal:
+            illegal.add("action_use_craft")
+        return [t for t in tools if t.name not in illegal]
+
+    def __init__(self, capture: CaptureBackend | None = None):
+        """
+        Args:
+            capture (CaptureBackend | None, optional): screen capture backend. Defaults to None - pyautogui.
+        """
+        self.capture = capture if capture is not None else PyAutoGUICapture()
+        self.frames = FrameStore(grab=self.capture.grab)
+        self.settle_time = 0.0
+
+    def screenshot(self, img_path: str | None = None) -> Frame:
+        """Take screenshot. Frame is kept in memory, and written to `img_path` only if it's given - for debugging."""
+        return self.frames.capture(img_path)
+
+    def screenshot_region(self, origin: tuple[int, int], size: tuple[int, int], img_path: str | None = None) -> Frame:
+        """Take screenshot of the screen region only. Doesn't replace the latest frame. See `FrameStore.capture_region`."""
+        return self.frames.capture_region(origin, size, img_path)
+
+    def wait_until_settled(self, region: tuple[int, int, int, int] | None = None, max_wait: float | None = None, min_wait: float = 0.0) -> float:
+        """Wait until screen region stops changing after input. See `tools.waiter.wait_until_settled`.
+
+        Args:
+            region (tuple[int, int, int, int] | None, optional): (left, top, width, height) to watch. Defaults to None - whole screen.
+            max_wait (float | None, optional): max duration of the wait, seconds. Defaults to None - `timeout`.
+            min_wait (float, optional): min duration of the wait, seconds. Defaults to 0.0.
+
+        Returns:
+            float: duration of the wait, seconds
+        """
+        waited = wait_until_settled(lambda: self.capture.grab(region), self.timeout if max_wait is None else max_wait, min_wait=min_wait)
+        self.settle_time += waited
+        return waited
+
+    @staticmethod
+    def debug_frame_path(config: RunnableConfig) -> str | None:
+        """Path to write captured frames to, if `debug_save_frames` is set."""
+        if config["configurable"]["debug_save_frames"]:
+            return config["configurable"]["path_to_screenshot"]
+        return None
 
     def reset_controller(self) -> None:
         """Reset controller after combat resolution."""
@@ -48,14 +123,14 @@ class Controller:
         if not self.enemy_specifics:
             gui2.press(keys="tab")
             self.enemy_specifics = True
-            sleep(self.timeout)
+            self.wait_until_settled(self.specifics_region, self.timeout)
 
     def toggle_display_details(self) -> None:
         """Display details of attacks, arts, and crafts"""
         if not self.display_details:
             gui2.middleClick()
             self.display_details = True
-            sleep(self.timeout)
+            self.wait_until_settled(max_wait=self.timeout)
 
     def change_target(self, target_direction_f: bool | None = None):
         """Change target.
@@ -63,7 +138,7 @@ class Controller:
         Args:
             right (bool, optional): Change to the target to the right. Default.
         """
-        if not target_direction_f:
+        if target_direction_f is None:
             target_direction_f = self.target_direction_f
         
         if target_direction_f:
@@ -71,41 +146,73 @@ class Controller:
         else:
             gui2.press(keys="r")
 
-    def select_target_enemy(self, enemy_id: int, enemy_coords: list[tuple[int, int]], target_direction: bool, path_to_screenshot: str, vlm_node: object) -> bool:
+    def select_target_enemy(self, enemy_id: int, enemy_coords: list[tuple[int, int]], target_direction: bool, path_to_screenshot: str | None, vlm_node: object,
+                            target_order: list[int] | None = None) -> bool:
         """Target specific enemy.
 
+        Selected enemy is found once, and the shortest key sequence to the target is issued without looking.
+        Selection is verified once at the end. If another enemy got selected, the order of targets is wrong, and
+        targets are stepped through one by one as a last resort.
+
         Args:
             enemy_id (int): enemy ID.
             enemy_coords (list[tuple[int, int]]): enemy portrait coordinates in turn-order region.
-            target_direction (bool): True - F, False - R
-            path_to_screenshot (str): path to screenshot
-            vlm_node (vlm.VLMNode): VLMNode object
+            target_direction (bool): True - F, False - R. Used if no enemy is selected
+            path_to_screenshot (str | None): path to write screenshots to for debugging. None - keep them in memory only
+            vlm_node (VLMNode): VLMNode object
+            target_order (list[int] | None, optional): enemy IDs in order of F presses. Defaults to None - order of turn-order region.
 
         Returns:
             bool: True if target has been found
         """
-        vlm_node = cast(vlm.VLMNode, vlm_node)
-        # TODO: Select target enemy
+        vlm_node = cast("VLMNode", vlm_node)
         logger.debug("TOOL: Attemp to select requested target")
-        # while True:
         if len(enemy_coords) <= 1:
             return True
+        if not target_order or sorted(target_order) != list(range(len(enemy_coords))):
+            target_order = list(range(len(enemy_coords)))
 
-        for _ in range(2 * len(enemy_coords)):
-            img_turn = gui.screenshot(path_to_screenshot)
-            img_turn_bw = vlm_node.produce_bw_image(img_turn, vlm_node.origin, vlm_node.size)
-            target_id, _ = vlm_node.find_selected_target(img_turn_bw, enemy_coords)
+        # Only turn-order strip with selection squares is grabbed
+        origin, size = vlm_node.selection_region()
+        region = origin + size
+        img_turn = self.screenshot_region(origin, size, path_to_screenshot)
+        target_id, _ = vlm_node.find_selected_target(img_turn, enemy_coords)
+        for _ in range(self.target_attempts):
             logger.debug(f"TOOL: Current {target_id=}")
-            
-            # Attack?
             if target_id == enemy_id:
                 logger.debug(f"TOOL: Found requested target! {target_id=} == {enemy_id=}")
                 return True
-            else:
+            if target_id not in target_order:
+                # Nothing is selected - make a step, and look again
                 self.change_target(target_direction)
-                logger.debug("TOOL: Next target")
-        
-        return False
+            else:
+                direction, presses = plan_target_keys(target_id, enemy_id, target_order)
+                logger.debug(f"TOOL: Press {'F' if direction else 'R'} {presses} times")
+                for _ in range(presses):
+                    self.change_target(direction)
+                    self.wait_until_settled(region, self.timeout_key)
+
+            # Verify
+            self.wait_until_settled(region, self.timeout, self.verify_min_wait)
+            expected_id = enemy_id if target_id in target_order else None
+            img_turn = self.screenshot_region(origin, size, path_to_screenshot)
+            target_id, _ = vlm_node.find_selected_target(img_turn, enemy_coords)
+            if expected_id is not None and target_id != expected_id:
+                # Order of targets is not what it was thought to be - step through them one by one
+                break
+
+        for _ in range(2 * len(enemy_coords)):
+            if target_id == enemy_id:
+                logger.debug(f"TOOL: Found requested target! {target_id=} == {enemy_id=}")
+                return True
+            self.change_target(target_direction)
+            logger.debug("TOOL: Next target")
+            self.wait_until_settled(region, self.timeout, self.verify_min_wait)
+            img_turn = self.screenshot_region(origin, size, path_to_screenshot)
+            target_id, _ = vlm_node.find_selected_target(img_turn, enemy_coords)
+
+        logger.warning(f"TOOL: Failed to select {enemy_id=}, {target_id=} is selected")
+        return target_id == enemy_id
 
     @tool
     @staticmethod
@@ -122,15 +229,15 @@ class Controller:
             if enemy.enemy_id == enemy_id:
                 target_direction = enemy.target_method_f
        
-        vlm_node = cast(vlm.VLMNode, config["configurable"]["tool_vlm"])
+        vlm_node = cast("VLMNode", config["configurable"]["tool_vlm"])
         enemy_coords = state["turn_state"]["enemy_coords"]
 
-        if controller.select_target_enemy(enemy_id, enemy_coords, target_direction, config["configurable"]["path_to_screenshot"], vlm_node):
+        if controller.select_target_enemy(enemy_id, enemy_coords, target_direction, controller.debug_frame_path(config), vlm_node, state["turn_state"].get("target_order")):
             # Assume 'Attack' option selected
             if not controller.attack_option:
                 logger.debug("TOOL: Scroll up")
                 gui2.scroll(1)
-                sleep(controller.timeout)
+                controller.wait_until_settled(controller.command_menu_region, controller.timeout)
             
             # Attack
             logger.debug("TOOL: Attacking target!")
@@ -146,7 +253,7 @@ class Controller:
         if controller.attack_option:
             # Scroll down
             gui2.scroll(-1)
-            sleep(controller.timeout)
+            controller.wait_until_settled(controller.command_menu_region, controller.timeout)
 
         # Defend
         gui2.press(keys="enter")
@@ -166,16 +273,16 @@ class Controller:
             if enemy.enemy_id == enemy_id:
                 target_direction = enemy.target_method_f
        
-        vlm_node = cast(vlm.VLMNode, config["configurable"]["tool_vlm"])
+        vlm_node = cast("VLMNode", config["configurable"]["tool_vlm"])
         enemy_coords = state["turn_state"]["enemy_coords"]
 
-        controller.select_target_enemy(enemy_id, enemy_coords, target_direction, config["configurable"]["path_to_screenshot"], vlm_node)
+        controller.select_target_enemy(enemy_id, enemy_coords, target_direction, controller.debug_frame_path(config), vlm_node, state["turn_state"].get("target_order"))
         # Find specific art
         # ! Use VLM to do so
         # TODO: Use specific art
         logger.debug("TOOL: Using art")
         gui2.press(keys="q")
-        sleep(controller.timeout_menu)
+        controller.wait_until_settled(max_wait=controller.timeout_menu)
         gui2.press(keys="enter")
 
     @tool
@@ -193,16 +300,16 @@ class Controller:
             if enemy.enemy_id == enemy_id:
                 target_direction = enemy.target_method_f
        
-        vlm_node = cast(vlm.VLMNode, config["configurable"]["tool_vlm"])
+        vlm_node = cast("VLMNode", config["configurable"]["tool_vlm"])
         enemy_coords = state["turn_state"]["enemy_coords"]
 
-        controller.select_target_enemy(enemy_id, enemy_coords, target_direction, config["configurable"]["path_to_screenshot"], vlm_node)
+        controller.select_target_enemy(enemy_id, enemy_coords, target_direction, controller.debug_frame_path(config), vlm_node, state["turn_state"].get("target_order"))
         # Find specific craft
         # ! Use VLM to do so
         # TODO: Use specific craft
         logger.debug("TOOL: Using craft")
         gui2.press(keys="e")
-        sleep(controller.timeout_menu)
+        controller.wait_until_settled(max_wait=controller.timeout_menu)
         gui2.press(keys="enter")
     
     @tool
@@ -212,7 +319,7 @@ class Controller:
         controller = cast(Controller, config["configurable"]["tool_controller"])
         # Open Items menu
         gui2.press(keys='x')
-        sleep(controller.timeout)
+        controller.wait_until_settled(max_wait=controller.timeout)
         # Find specific item
         # ! Use VLM to do so
         # TODO: Use specific item
@@ -221,18 +328,18 @@ class Controller:
     def action_open_character_screen(self) -> None:
         """Opens character screen from out-of-combat situation."""
         gui2.press(keys="esc")
-        sleep(self.timeout_menu)
+        self.wait_until_settled(max_wait=self.timeout_menu)
         gui2.press(keys="z")
-        sleep(self.timeout_menu)
+        self.wait_until_settled(max_wait=self.timeout_menu)
 
     def action_close_character_screen(self) -> None:
         """Close character screen from out-ouf-combat situation."""
         gui2.press(keys="esc")
-        sleep(self.timeout_menu)
+        self.wait_until_settled(max_wait=self.timeout_menu)
         gui2.press(keys="esc")
-        sleep(self.timeout_menu)
+        self.wait_until_settled(max_wait=self.timeout_menu)
 
     def action_next_menu_item(self) -> None:
         """Selects next item on the menu list."""
         gui2.press(keys="down")
-        sleep(self.timeout_menu)
+        self.wait_until_settled(max_wait=self.timeout_menu)
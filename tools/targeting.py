@@ -0,0 +1,19 @@
+def plan_target_keys(current: int, target: int, order: list[int]) -> tuple[bool, int]:
+    """Plan the shortest key sequence from the selected enemy to the target.
+
+    F selects the next enemy of cyclic `order`, and R - the previous one.
+
+    Args:
+        current (int): index of the selected enemy
+        target (int): index of the enemy to select
+        order (list[int]): enemy indices in order of F presses
+
+    Returns:
+        bool: True - press F, False - press R
+        int: number of presses
+    """
+    n = len(order)
+    distance = (order.index(target) - order.index(current)) % n
+    if distance <= n - distance:
+        return True, distance
+    return False, n - distance
@@ -0,0 +1,197 @@
+from time import perf_counter, sleep
+from typing import Callable
+import numpy as np
+from loguru import logger
+
+from vision.frames import changed_pixels
+
+
+def frame_difference(a: np.ndarray, b: np.ndarray, step: int = 4) -> float:
+    """Mean absolute difference of two frames, sampled every `step` pixels along both axes.
+
+    Args:
+        a (np.ndarray): HxWx3 frame
+        b (np.ndarray): HxWx3 frame of the same size
+        step (int, optional): sampling step in pixels. Defaults to 4.
+
+    Returns:
+        float: mean absolute difference in [0, 255]
+    """
+    a = a[::step, ::step].astype(np.int16)
+    b = b[::step, ::step].astype(np.int16)
+    return float(np.abs(a - b).mean())
+
+
+def wait_until_settled(grab: Callable[[], np.ndarray], max_wait: float, interval: float = 0.03, settle_pixels: int = 4,
+                       settle_samples: int = 2, change_pixels: int = 24, pixel_threshold: int = 32, change_grace: float = 0.15,
+                       min_wait: float = 0.0) -> float:
+    """Wait until a screen region stops changing after an input, instead of sleeping for a fixed time.
+
+    Two samples are compared by the number of changed pixels, see `vision.frames.changed_pixels`. Unlike mean difference,
+    it catches small elements - a selection square, or a menu cursor - moving over a large region.
+    Region has settled when `settle_samples` consecutive samples differ by at most `settle_pixels` pixels.
+    Game reacts to an input with a delay, so stillness counts only after the region has changed,
+    or after `change_grace` seconds if it doesn't change at all. A region that never stops moving, e.g. 3D scene,
+    is waited for `max_wait` seconds - as long as the fixed sleep.
+
+    Args:
+        grab (Callable[[], np.ndarray]): function returning HxWx3 frame of the region
+        max_wait (float): max duration of the wait, seconds. The fixed sleep this wait replaces
+        interval (float, optional): interval between two samples, seconds. Defaults to 0.03.
+        settle_pixels (int, optional): max number of changed pixels of two samples to consider region still. Defaults to 4.
+        settle_samples (int, optional): number of still samples in a row to consider region settled. Defaults to 2.
+        change_pixels (int, optional): min number of changed pixels of two samples to consider region changed. Defaults to 24.
+        pixel_threshold (int, optional): min per-channel difference of changed pixel. Defaults to 32.
+        change_grace (float, optional): time to wait for the region to start changing, seconds. Defaults to 0.15.
+        min_wait (float, optional): min duration of the wait, seconds - e.g. before reading the result of the input back. Defaults to 0.0.
+
+    Returns:
+        float: duration of the wait, seconds
+    """
+    t_start = perf_counter()
+    previous = grab()
+    changed = False
+    still = 0
+    while (elapsed := perf_counter() - t_start) < max_wait:
+        sleep(min(interval, max(max_wait - elapsed, 0.0)))
+        current = grab()
+        n_changed = changed_pixels(previous, current, pixel_threshold)
+        previous = current
+        if n_changed >= change_pixels:
+            changed = True
+        if n_changed <= settle_pixels:
+            still += 1
+            elapsed = perf_counter() - t_start
+            if still >= settle_samples and (changed or elapsed >= change_grace) and elapsed >= min_wait:
+                break
+        else:
+            still = 0
+    return perf_counter() - t_start
+
+
+class ChangeWaiter:
+    """Wait for a screen region to change and settle, and only then ask the expensive classifier.
+
+    Region is sampled every `min_interval` seconds while it changes, and the interval grows by `backoff`
+    up to `max_interval` while nothing happens. Region has settled when `settle_samples` consecutive samples
+    differ by less than `settle_threshold`. Classifier is also asked at least every `recheck_interval` seconds,
+    so a missed classification, e.g. mid-fade, isn't final while the region stays still.
+    """
+    def __init__(self, grab: Callable[[], np.ndarray], min_interval: float = 0.05, max_interval: float = 0.5,
+                 backoff: float = 1.5, change_threshold: float = 8.0, settle_threshold: float = 2.0,
+                 settle_samples: int = 3, timeout: float | None = None, recheck_interval: float | None = None):
+        """
+        Args:
+            grab (Callable[[], np.ndarray]): function returning HxWx3 frame of the region
+            min_interval (float, optional): interval between two samples while region changes, seconds. Defaults to 0.05.
+            max_interval (float, optional): max interval between two samples, seconds. Defaults to 0.5.
+            backoff (float, optional): growth factor of the interval while nothing happens. Defaults to 1.5.
+            change_threshold (float, optional): min difference of two samples to consider region changed. Defaults to 8.0.
+            settle_threshold (float, optional): max difference of two samples to consider region still. Defaults to 2.0.
+            settle_samples (int, optional): number of still samples in a row to consider region settled. Defaults to 3.
+            timeout (float | None, optional): max duration of a single wait, seconds. Defaults to None - wait forever.
+            recheck_interval (float | None, optional): max interval between two classifications, seconds.
+                Defaults to None - `max_interval`.
+        """
+        self.grab = grab
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.change_threshold = change_threshold
+        self.settle_threshold = settle_threshold
+        self.settle_samples = settle_samples
+        self.timeout = timeout
+        self.recheck_interval = recheck_interval if recheck_interval is not None else max_interval
+        # Metrics
+        self.waits = 0
+        self.samples = 0
+        self.model_calls = 0
+        self.timeouts = 0
+        self.lags: list[float] = []
+        self.last: dict[str, float | int | bool] = {}
+
+    def wait(self, is_ready: Callable[[], bool]) -> bool:
+        """Wait until `is_ready` returns True.
+
+        `is_ready` is called once right away, then every time the region settles after a change,
+        and at least every `recheck_interval` seconds.
+
+        Args:
+            is_ready (Callable[[], bool]): expensive classifier, e.g. "is it agent's turn?"
+
+        Returns:
+            bool: True - `is_ready` returned True, False - timeout
+        """
+        t_start = perf_counter()
+        samples, model_calls = 1, 1
+        previous = self.grab()
+        ready = is_ready()
+        t_checked = perf_counter()
+
+        interval = self.min_interval
+        changed = False
+        still = 0
+        t_settled = t_start
+        while not ready:
+            if self.timeout is not None and perf_counter() - t_start >= self.timeout:
+                break
+            sleep(interval)
+            current = self.grab()
+            samples += 1
+            difference = frame_difference(previous, current)
+            previous = current
+
+            if difference >= self.change_threshold:
+                # Something is going on - sample fast
+                changed, still = True, 0
+                interval = self.min_interval
+            elif not changed:
+                # Nothing happens - back off
+                interval = min(interval * self.backoff, self.max_interval)
+            elif difference < self.settle_threshold:
+                still += 1
+                if still == 1:
+                    t_settled = perf_counter()
+                if still >= self.settle_samples:
+                    model_calls += 1
+                    ready = is_ready()
+                    t_checked = perf_counter()
+                    changed, still = False, 0
+                    continue
+            else:
+                # Still moving
+                still = 0
+
+            if perf_counter() - t_checked >= self.recheck_interval:
+                # Previous classification may have missed - ask again
+                model_calls += 1
+                ready = is_ready()
+                t_checked = perf_counter()
+                if not ready and not changed:
+                    t_settled = t_checked
+
+        t_end = perf_counter()
+        # Detection lag: time from the moment region has settled to detection
+        lag = t_end - t_settled if ready else 0.0
+        self.waits += 1
+        self.samples += samples
+        self.model_calls += model_calls
+        if ready:
+            self.lags.append(lag)
+        else:
+            self.timeouts += 1
+        self.last = {"ready": ready, "duration": t_end - t_start, "lag": lag, "samples": samples, "model_calls": model_calls}
+        logger.info(f"Waited {t_end - t_start:.2f}s: {'ready' if ready else 'timeout'}, detection lag {lag:.3f}s, {samples} samples, {model_calls} model calls")
+        return ready
+
+    def stats(self) -> dict[str, int | float]:
+        """Get metrics over all waits."""
+        return {
+            "waits": self.waits,
+            "timeouts": self.timeouts,
+            "samples": self.samples,
+            "model_calls": self.model_calls,
+            "model_calls_per_wait": self.model_calls / self.waits if self.waits else 0.0,
+            "mean_lag": float(np.mean(self.lags)) if self.lags else 0.0,
+            "max_lag": max(self.lags, default=0.0)
+        }
@@ -0,0 +1,62 @@
+import numpy as np
+
+from vision.turn_order import as_frame
+
+
+# Symbol -> expected number of (white, gray, red) pixels in its cell
+SYMBOLS: dict[str, tuple[int, int, int]] = {
+    "circle": (103, 54, 0),     # Susceptible
+    "triangle": (0, 105, 0),    # Resistant
+    "cross": (0, 0, 60),        # Immune
+    "empty": (0, 0, 0),         # Enemy specifics aren't displayed
+}
+
+
+def classify_ailments(image: object, origins: tuple[tuple[int, int], ...], rows: int = 5, pitch: int = 34,
+                      cell_origin: tuple[int, int] = (4, 2), cell_size: tuple[int, int] = (28, 30)) -> tuple[list[bool], float]:
+    """Read susceptibility symbols of the ailment columns on enemy specifics panel.
+
+    Every column holds `rows` symbols `pitch` pixels apart. Cells of all symbols are gathered from the frame
+    with a single fancy-indexing operation, and every cell is described by the number of its white, gray, and red pixels.
+    Symbol is the nearest one of `SYMBOLS`, confidence is 1 - d1 / d2, where d1 and d2 are squared distances
+    to the nearest, and the second nearest symbol.
+
+    Args:
+        image (object): PIL.Image or HxWx3 ndarray screenshot
+        origins (tuple[tuple[int, int], ...]): origins of ailment columns, e.g. left and right
+        rows (int, optional): number of symbols in the column. Defaults to 5.
+        pitch (int, optional): vertical distance between symbols in pixels. Defaults to 34.
+        cell_origin (tuple[int, int], optional): offset of the first symbol cell relative to column origin. Defaults to (4, 2).
+        cell_size (tuple[int, int], optional): size of symbol cell (width, height). Defaults to (28, 30).
+
+    Returns:
+        list[bool]: True - enemy is susceptible to the ailment (circle), column by column, top to bottom
+        float: confidence in [0, 1] - confidence of the least certain symbol. 0 if any cell is empty
+    """
+    frame = as_frame(image)
+    origins = np.asarray(origins, dtype=np.intp)
+    top = (origins[:, 1, None] + cell_origin[1] + pitch * np.arange(rows)).ravel()
+    left = np.repeat(origins[:, 0] + cell_origin[0], rows)
+    cells = frame[(top[:, None] + np.arange(cell_size[1]))[:, :, None], (left[:, None] + np.arange(cell_size[0]))[:, None, :]]
+
+    r, g, b = cells[..., 0], cells[..., 1], cells[..., 2]
+    lo = np.minimum(np.minimum(r, g), b)
+    hi = np.maximum(np.maximum(r, g), b)
+    white = lo >= 180
+    gray = (hi >= 95) & (hi <= 170) & (hi - lo < 25)
+    red = (r >= 150) & (g < 90) & (b < 90)
+    counts = np.stack([white.sum(axis=(1, 2)), gray.sum(axis=(1, 2)), red.sum(axis=(1, 2))], axis=-1).astype(np.float32)
+
+    names = list(SYMBOLS)
+    expected = np.array(list(SYMBOLS.values()), dtype=np.float32)
+    distances = ((counts[:, None, :] - expected[None, :, :]) ** 2).sum(axis=-1)
+    order = np.argsort(distances, axis=-1)
+    nearest = order[:, 0]
+    d1 = distances[np.arange(len(counts)), nearest]
+    d2 = distances[np.arange(len(counts)), order[:, 1]]
+    confidence = 1.0 - d1 / np.maximum(d2, 1e-6)
+
+    susceptible = [names[i] == "circle" for i in nearest]
+    if (nearest == names.index("empty")).any():
+        return susceptible, 0.0
+    return susceptible, float(confidence.min())
@@ -0,0 +1,317 @@
+import json
+import os
+import numpy as np
+
+from vision.turn_order import as_frame, crop
+
+
+GLYPH_SIZE = (16, 12)
+TEMPLATES_PATH = os.path.join(os.path.dirname(__file__), "digit_templates.npz")
+
+
+def ink(region: np.ndarray, threshold: int = 140, colors: tuple[tuple[int, int, int], ...] | None = None,
+        max_distance: int = 40) -> np.ndarray:
+    """Mask pixels of the text.
+
+    Args:
+        region (np.ndarray): HxWx3 image
+        threshold (int, optional): minimal brightness (maximum of RGB channels) of text pixel. Defaults to 140.
+        colors (tuple[tuple[int, int, int], ...] | None, optional): colors of the font. Text drawn over bright gauges
+            is told apart by its color instead of brightness. Defaults to None - use `threshold`.
+        max_distance (int, optional): per-channel tolerance to `colors`. Defaults to 40.
+
+    Returns:
+        np.ndarray: HxW bool mask
+    """
+    if colors is None:
+        return (region[..., 0] >= threshold) | (region[..., 1] >= threshold) | (region[..., 2] >= threshold)
+
+    mask = np.zeros(region.shape[:2], dtype=bool)
+    for color in colors:
+        match = np.ones(region.shape[:2], dtype=bool)
+        for channel, value in enumerate(color):
+            plane = region[..., channel]
+            if value - max_distance > 0:
+                match &= plane >= value - max_distance
+            if value + max_distance < 255:
+                match &= plane <= value + max_distance
+        mask |= match
+    return mask
+
+
+def _runs(profile: np.ndarray) -> np.ndarray:
+    """Get (start, stop) pairs of runs of True in 1D bool array."""
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], profile.view(np.int8), [0]))))
+    return edges.reshape(-1, 2)
+
+
+def segment(mask: np.ndarray, height: tuple[int, int] = (11, 20), max_width: int | None = None,
+            bands: tuple[tuple[int, int], ...] | None = None) -> list[list[tuple[int, int, int, int]]]:
+    """Split text mask into lines, and lines into glyphs.
+
+    Lines are runs of rows with text pixels, glyphs are runs of columns with text pixels inside the line.
+    Glyphs out of `height` range are dropped - those are labels, gauges, and icons.
+
+    Args:
+        mask (np.ndarray): HxW bool mask. See `ink`
+        height (tuple[int, int], optional): min and max glyph height in pixels. Defaults to (11, 20).
+        max_width (int | None, optional): max glyph width in pixels. Wider runs are touching glyphs, and they are cut
+            at the columns with the least text pixels. Defaults to None - don't cut.
+        bands (tuple[tuple[int, int], ...] | None, optional): fixed (top, bottom) rows of lines. Use when text
+            touches artwork above or below it. Defaults to None - find lines by rows with text pixels.
+
+    Returns:
+        list[list[tuple[int, int, int, int]]]: glyph boxes (top, bottom, left, right) of every line, top to bottom, left to right
+    """
+    lines = []
+    for top, bottom in bands or _runs(mask.any(axis=1)):
+        line = mask[top:bottom]
+        columns = line.sum(axis=0)
+        runs = _runs(columns > 0)
+        if not len(runs):
+            continue
+        if max_width:
+            runs = _cut(runs, columns, max_width)
+        # Rows with text pixels of every glyph
+        rows = np.logical_or.reduceat(line, runs[:, 0], axis=1)
+        first = rows.argmax(axis=0)
+        last = len(rows) - rows[::-1].argmax(axis=0)
+        keep = (last - first >= height[0]) & (last - first <= height[1])
+        glyphs = [(int(top + f), int(top + l), int(left), int(right))
+                  for f, l, (left, right) in zip(first[keep], last[keep], runs[keep])]
+        if glyphs:
+            lines.append(glyphs)
+    return lines
+
+
+def _cut(runs: np.ndarray, columns: np.ndarray, max_width: int) -> np.ndarray:
+    """Cut runs wider than `max_width` into equal parts at the columns with the least text pixels."""
+    glyphs = []
+    for left, right in runs:
+        cuts = [left]
+        n = -(-(right - left) // max_width)
+        for i in range(1, n):
+            center = left + (right - left) * i // n
+            cuts.append(center - 2 + int(columns[center - 2:center + 3].argmin()))
+        cuts.append(right)
+        glyphs += zip(cuts[:-1], cuts[1:])
+    return np.array(glyphs, dtype=np.intp)
+
+
+def normalize(mask: np.ndarray, boxes: list[tuple[int, int, int, int]]) -> np.ndarray:
+    """Scale glyphs to `GLYPH_SIZE`, keeping narrow glyphs narrow.
+
+    Glyph is centered in a box at least 3/4 of its height wide, and the box is resampled with 2x2 supersampling.
+    All glyphs are gathered from the mask with a single fancy-indexing operation.
+
+    Args:
+        mask (np.ndarray): HxW bool mask. See `ink`
+        boxes (list[tuple[int, int, int, int]]): glyph boxes (top, bottom, left, right). See `segment`
+
+    Returns:
+        np.ndarray: NxD float32 array of GLYPH_SIZE[0] * GLYPH_SIZE[1] values in [0, 1]
+    """
+    top, bottom, left, right = np.asarray(boxes, dtype=np.intp).reshape(-1, 4).T
+    height, width = bottom - top, right - left
+    box_width = np.maximum(width, -(-3 * height // 4))
+    pad = (box_width - width) // 2
+    rows = top[:, None] + ((np.arange(2 * GLYPH_SIZE[0]) + 0.5) * height[:, None] / (2 * GLYPH_SIZE[0])).astype(np.intp)
+    cols = ((np.arange(2 * GLYPH_SIZE[1]) + 0.5) * box_width[:, None] / (2 * GLYPH_SIZE[1])).astype(np.intp) - pad[:, None]
+    inside = (cols >= 0) & (cols < width[:, None])
+    cols = left[:, None] + np.clip(cols, 0, width[:, None] - 1)
+    samples = np.ascontiguousarray(mask).ravel().take(rows[:, :, None] * mask.shape[1] + cols[:, None, :])
+    samples = (samples & inside[:, None, :]).view(np.uint8)
+    samples = samples[:, 0::2, 0::2] + samples[:, 1::2, 0::2] + samples[:, 0::2, 1::2] + samples[:, 1::2, 1::2]
+    return samples.reshape(len(samples), GLYPH_SIZE[0] * GLYPH_SIZE[1]).astype(np.float32) / 4
+
+
+class DigitReader:
+    """Template-matching reader of numbers printed with the game's fixed fonts.
+
+    Crop is binarized, split into glyphs, and every glyph is matched against templates calibrated from `imgs/debug`.
+    Glyph labels are digits, separators "/" and "%", and "?" - anything else that passes segmentation.
+    Numbers are runs of adjacent digits.
+    """
+    # Panel -> binarization parameters, and glyph height range
+    panels: dict[str, dict] = {
+        # HP, stun, ATK, ATS, SPD, DEF, ADF of selected enemy
+        "enemy_stats": {"ink": {"threshold": 140}, "height": (12, 20)},
+        # Weakness percentages - dim gray, yellow, or orange digits
+        "enemy_weakness": {"ink": {"threshold": 90}, "height": (11, 18)},
+        # HP, EP, CP of party members - pale green or white digits over bright gauges
+        "party": {"ink": {"colors": ((200, 245, 178), (255, 255, 255)), "max_distance": 40}, "height": (12, 18), "max_width": 13, "bands": ((7, 24), (25, 43))},
+        # STR, DEF, ATS, ADF, SPD on character screen
+        "character_screen": {"ink": {"threshold": 140}, "height": (12, 18)},
+    }
+
+    def __init__(self, path: str | None = TEMPLATES_PATH):
+        """
+        Args:
+            path (str | None, optional): path/to/digit_templates.npz. Defaults to TEMPLATES_PATH. None - no templates, see `calibrate`.
+        """
+        templates = np.empty((0, GLYPH_SIZE[0] * GLYPH_SIZE[1]), dtype=np.float32)
+        labels = np.empty(0, dtype="<U1")
+        if path:
+            data = np.load(path)
+            templates, labels = data["templates"], data["labels"]
+        self.set_templates(templates, labels)
+
+    def __call__(self, image: object, panel: str = "enemy_stats") -> tuple[list[int], float]:
+        """Read all numbers in the crop.
+
+        Args:
+            image (object): PIL.Image or HxWx3 ndarray crop
+            panel (str, optional): name of the panel the crop belongs to. See `panels`. Defaults to "enemy_stats".
+
+        Returns:
+            list[int]: numbers top to bottom, left to right
+            float: confidence in [0, 1] - confidence of the least certain glyph. 0 if no numbers were found,
+                or a glyph is cut by the edge of the crop
+        """
+        region = as_frame(image)
+        lines, glyphs = self.glyphs(region, panel)
+        if not len(glyphs):
+            return [], 0.0
+        labels, confidences = self.match(glyphs)
+
+        numbers = []
+        i = 0
+        for line in lines:
+            digits = ""
+            for j, (top, bottom, left, _) in enumerate(line):
+                label = labels[i + j]
+                # Separator or wide gap ends the number
+                if digits and (not label.isdigit() or left - line[j - 1][3] > (bottom - top) // 2):
+                    numbers.append(int(digits))
+                    digits = ""
+                if label.isdigit():
+                    digits += label
+            if digits:
+                numbers.append(int(digits))
+            i += len(line)
+
+        if not numbers:
+            return [], 0.0
+        # Glyph cut by the edge of the crop can't be trusted
+        if any(line[0][2] == 0 or line[-1][3] == region.shape[1] for line in lines):
+            return numbers, 0.0
+        return numbers, float(confidences.min())
+
+    def read(self, image: object, panel: str, count: int, min_confidence: float = 0.3) -> list[int] | None:
+        """Read exactly `count` numbers, or give up.
+
+        Args:
+            image (object): PIL.Image or HxWx3 ndarray crop
+            panel (str): name of the panel the crop belongs to. See `panels`
+            count (int): expected number of numbers
+            min_confidence (float, optional): minimal confidence of the read. Defaults to 0.3.
+
+        Returns:
+            list[int] | None: numbers, or None if the read is not trusted - fall back to VLM
+        """
+        numbers, confidence = self(image, panel)
+        if len(numbers) != count or confidence < min_confidence:
+            return None
+        return numbers
+
+    def glyphs(self, region: np.ndarray, panel: str) -> tuple[list[list[tuple[int, int, int, int]]], np.ndarray]:
+        """Segment the crop into normalized glyphs.
+
+        Args:
+            region (np.ndarray): HxWx3 crop
+            panel (str): name of the panel the crop belongs to. See `panels`
+
+        Returns:
+            list[list[tuple[int, int, int, int]]]: glyph boxes of every line. See `segment`
+            np.ndarray: NxD normalized glyphs. See `normalize`
+        """
+        params = self.panels[panel]
+        mask = ink(region, **params["ink"])
+        lines = segment(mask, params["height"], params.get("max_width"), params.get("bands"))
+        return lines, normalize(mask, [box for line in lines for box in line])
+
+    def match(self, glyphs: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Find nearest template of every glyph.
+
+        Confidence is 1 - d1 / d2, where d1 is squared distance to the nearest template,
+        and d2 - to the nearest template with any other label.
+
+        Args:
+            glyphs (np.ndarray): NxD normalized glyphs. See `normalize`
+
+        Returns:
+            np.ndarray: N labels
+            np.ndarray: N confidences
+        """
+        distances = (glyphs ** 2).sum(axis=-1)[:, None] + self._norms[None, :] - 2 * glyphs @ self.templates.T
+        distances = np.maximum(distances, 0.0)
+        nearest = distances.argmin(axis=-1)
+        labels = self.labels[nearest]
+        d1 = distances[np.arange(len(glyphs)), nearest]
+        d2 = np.where(self.labels[None, :] == labels[:, None], np.inf, distances).min(axis=-1)
+        return labels, 1.0 - d1 / np.maximum(d2, 1e-6)
+
+    def set_templates(self, templates: np.ndarray, labels: np.ndarray) -> None:
+        """Replace templates."""
+        self.templates = templates.astype(np.float32)
+        self.labels = labels.astype("<U1")
+        self._norms = (self.templates ** 2).sum(axis=-1)
+
+    def save(self, path: str = TEMPLATES_PATH) -> None:
+        """Save templates."""
+        np.savez_compressed(path, templates=self.templates.astype(np.float16), labels=self.labels)
+
+    @classmethod
+    def calibrate(cls, samples: list[dict], root: str = "imgs/debug") -> "DigitReader":
+        """Build templates out of labelled crops.
+
+        Every glyph of the crop becomes a template. Crop is labelled with its glyphs line by line,
+        spaces are ignored, e.g. "34681/34681", or "?620 200".
+
+        Args:
+            samples (list[dict]): labelled crops {"screenshot", "panel", "origin", "size", "text"}
+            root (str, optional): directory with screenshots. Defaults to "imgs/debug".
+
+        Returns:
+            DigitReader: reader with templates of all glyphs
+        """
+        reader = cls(path=None)
+        templates, labels = [], []
+        for sample in samples:
+            region = crop(load_frame(os.path.join(root, sample["screenshot"])), sample["origin"], sample["size"])
+            lines, glyphs = reader.glyphs(region, sample["panel"])
+            text = [line.replace(" ", "") for line in sample["text"].splitlines()]
+            if [len(line) for line in lines] != [len(line) for line in text]:
+                raise ValueError(f"{sample['screenshot']} {sample['origin']}: {[len(line) for line in lines]} glyphs, but text is {text}")
+            templates.append(glyphs)
+            labels += list("".join(text))
+
+        # Same glyph on many screenshots is one template
+        templates, labels = np.concatenate(templates), np.array(labels)
+        _, unique = np.unique(np.column_stack((templates, labels.view(np.uint32)[:, None])), axis=0, return_index=True)
+        unique.sort()
+        reader.set_templates(templates[unique], labels[unique])
+        return reader
+
+
+_frames: dict[str, np.ndarray] = {}
+
+
+def load_frame(path: str) -> np.ndarray:
+    """Load screenshot as RGB ndarray, once."""
+    if path not in _frames:
+        from PIL import Image
+        _frames[path] = as_frame(Image.open(path))
+    return _frames[path]
+
+
+def load_samples(path: str = "imgs/debug/digits.json") -> list[dict]:
+    """Load labelled crops. See `DigitReader.calibrate`."""
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+if __name__ == "__main__":
+    # Recalibrate templates: python -m vision.digits
+    DigitReader.calibrate(load_samples()).save()
+    print(f"Templates saved to {TEMPLATES_PATH}")
@@ -0,0 +1,149 @@
+from time import perf_counter
+from typing import Callable
+import numpy as np
+from PIL import Image
+from loguru import logger
+
+from vision.turn_order import crop
+
+
+class Frame:
+    """Captured screen: raw HxWx3 RGB buffer. Captured once per decision point, and shared by all consumers.
+
+    Crops are views into the buffer, and PIL.Image of the whole frame shares its memory.
+    Frame may cover only a region of the screen. Its `origin` is then the screen position of its top-left pixel,
+    and `crop` takes screen coordinates.
+    """
+    def __init__(self, pixels: np.ndarray, timestamp: float | None = None, origin: tuple[int, int] = (0, 0)):
+        """
+        Args:
+            pixels (np.ndarray): HxWx3 uint8 RGB buffer
+            timestamp (float | None, optional): capture time, perf_counter() seconds. Defaults to None - now.
+            origin (tuple[int, int], optional): screen position of the top-left pixel. Defaults to (0, 0) - whole screen.
+        """
+        self.pixels = np.ascontiguousarray(pixels)
+        self.timestamp = perf_counter() if timestamp is None else timestamp
+        self.origin = origin
+        self._image: Image.Image | None = None
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        return self.pixels if dtype is None else self.pixels.astype(dtype)
+
+    @property
+    def size(self) -> tuple[int, int]:
+        """Frame size (width, height)."""
+        return self.pixels.shape[1], self.pixels.shape[0]
+
+    @property
+    def image(self) -> Image.Image:
+        """PIL.Image sharing the buffer of the frame."""
+        if self._image is None:
+            self._image = Image.frombuffer("RGB", self.size, self.pixels, "raw", "RGB", 0, 1)
+        return self._image
+
+    def local(self, point: tuple[int, int]) -> tuple[int, int]:
+        """Convert screen coordinates to coordinates in the frame buffer."""
+        return point[0] - self.origin[0], point[1] - self.origin[1]
+
+    def crop(self, origin: tuple[int, int], size: tuple[int, int]) -> np.ndarray:
+        """Crop region out of the frame without copying. See `turn_order.crop`.
+
+        Args:
+            origin (tuple[int, int]): origin point in screen pixels (left, top)
+            size (tuple[int, int]): size of cropping area in pixels (width, height)
+        """
+        return crop(self.pixels, self.local(origin), size)
+
+    def save(self, path: str) -> None:
+        """Write frame to disk. For debugging only."""
+        self.image.save(path)
+
+
+def as_image(image: object) -> Image.Image:
+    """Get PIL.Image out of path/to/image.png, PIL.Image, Frame, or HxWx3 ndarray."""
+    if isinstance(image, Image.Image):
+        return image
+    if isinstance(image, Frame):
+        return image.image
+    if isinstance(image, np.ndarray):
+        return Image.fromarray(np.ascontiguousarray(image))
+    return Image.open(image)
+
+
+def changed_pixels(a: np.ndarray, b: np.ndarray, threshold: int = 64) -> int:
+    """Count pixels of two crops of the same screen region that differ by more than `threshold` in any channel.
+
+    Unlike mean difference, a single changed digit of a stat panel stands out against the noise of translucent background.
+
+    Args:
+        a (np.ndarray): HxWx3 crop
+        b (np.ndarray): HxWx3 crop of the same size
+        threshold (int, optional): min per-channel difference of changed pixel. Defaults to 64.
+
+    Returns:
+        int: number of changed pixels
+    """
+    if a.shape != b.shape:
+        return a.shape[0] * a.shape[1]
+    # |a - b| in uint8 without widening, and max over channels plane by plane - an order of magnitude faster on full frames
+    difference = np.maximum(a, b)
+    difference -= np.minimum(a, b)
+    difference = np.maximum.reduce([difference[..., channel] for channel in range(difference.shape[-1])])
+    return int(np.count_nonzero(difference > threshold))
+
+
+class FrameStore:
+    """The latest captured frame."""
+    def __init__(self, grab: Callable[..., object]):
+        """
+        Args:
+            grab (Callable[..., object]): function capturing the screen as PIL.Image or HxWx3 ndarray.
+                Takes optional `region` (left, top, width, height). See `tools.capture.CaptureBackend.grab`
+        """
+        self.grab = grab
+        self.latest: Frame | None = None
+        self.captures = 0
+
+    @staticmethod
+    def _pixels(image: object) -> np.ndarray:
+        if isinstance(image, np.ndarray):
+            return image
+        return np.asarray(image.convert("RGB") if image.mode != "RGB" else image)
+
+    def capture(self, debug_path: str | None = None) -> Frame:
+        """Capture new frame of the whole screen.
+
+        Args:
+            debug_path (str | None, optional): path/to/screenshot.png to write the frame to. Defaults to None - keep it in memory only.
+
+        Returns:
+            Frame: captured frame
+        """
+        self.latest = Frame(self._pixels(self.grab()))
+        self.captures += 1
+        if debug_path:
+            self.latest.save(debug_path)
+            logger.debug(f"Frame saved to {debug_path}")
+        return self.latest
+
+    def capture_region(self, origin: tuple[int, int], size: tuple[int, int], debug_path: str | None = None) -> Frame:
+        """Capture region of the screen. Doesn't replace the latest frame.
+
+        Args:
+            origin (tuple[int, int]): origin point in screen pixels (left, top)
+            size (tuple[int, int]): size of the region in pixels (width, height)
+            debug_path (str | None, optional): path/to/screenshot.png to write the region to. Defaults to None - keep it in memory only.
+
+        Returns:
+            Frame: captured region. See `Frame.origin`
+        """
+        frame = Frame(self._pixels(self.grab(region=tuple(origin) + tuple(size))), origin=tuple(origin))
+        self.captures += 1
+        if debug_path:
+            frame.save(debug_path)
+            logger.debug(f"Region saved to {debug_path}")
+        return frame
+
+    def get(self) -> Frame:
+        """Get the latest frame, capture one if there is none."""
+        return self.latest if self.latest is not None else self.capture()
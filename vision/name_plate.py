@@ -0,0 +1,43 @@
+import numpy as np
+
+from vision.turn_order import as_frame, crop
+
+
+def name_plate_hash(image: object, origin: tuple[int, int] = (1455, 242), size: tuple[int, int] = (300, 36),
+                    min_value: int = 190, grid: tuple[int, int] = (8, 48), min_pixels: int = 60, max_indent: int = 16) -> int | None:
+    """Get perceptual hash of enemy name on "View Specifics" panel.
+
+    Name is written in white over translucent panel, so it's separated from the background by the darkest channel.
+    Ink is cropped to its bounding box, and the box is resampled to `grid` cells. Cell bit is set if any of
+    its 4 samples is ink. Hashes of the same name differ by a few bits at most, and hashes of
+    different names by dozens.
+
+    Args:
+        image (object): Frame, PIL.Image, or HxWx3 ndarray screenshot
+        origin (tuple[int, int], optional): origin of the name plate. Defaults to (1455, 242).
+        size (tuple[int, int], optional): size of the name plate. Defaults to (300, 36).
+        min_value (int, optional): minimal value of the darkest channel of ink. Defaults to 190.
+        grid (tuple[int, int], optional): hash grid (rows, columns). Defaults to (8, 48).
+        min_pixels (int, optional): minimal number of ink pixels. Defaults to 60.
+        max_indent (int, optional): max distance of the name from the left edge of the plate - it's left-aligned. Defaults to 16.
+
+    Returns:
+        int | None: grid[0] * grid[1]-bit hash, or None if there is no name on screen
+    """
+    region = crop(as_frame(image), origin, size)
+    ink = region[..., :3].min(axis=-1) >= min_value
+    if np.count_nonzero(ink) < min_pixels:
+        return None
+    # Stray bright pixels of the background don't stretch the bounding box
+    rows, cols = np.flatnonzero(ink.sum(axis=1) >= 2), np.flatnonzero(ink.sum(axis=0) >= 2)
+    # Scattered ink - no row, or column with 2 pixels
+    if len(rows) == 0 or len(cols) == 0 or cols[0] > max_indent:
+        return None
+    ink = ink[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+
+    # Resample the box with 2x2 supersampling, see `digits.normalize`
+    rows = ((np.arange(2 * grid[0]) + 0.5) * ink.shape[0] / (2 * grid[0])).astype(np.intp)
+    cols = ((np.arange(2 * grid[1]) + 0.5) * ink.shape[1] / (2 * grid[1])).astype(np.intp)
+    samples = ink[rows[:, None], cols[None, :]].view(np.uint8)
+    counts = samples[0::2, 0::2] + samples[1::2, 0::2] + samples[0::2, 1::2] + samples[1::2, 1::2]
+    return int.from_bytes(np.packbits(counts.ravel() >= 1).tobytes(), "big")
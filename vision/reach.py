@@ -0,0 +1,87 @@
+import numpy as np
+
+from vision.turn_order import _label, crop
+
+
+def red_pixels(region: np.ndarray, max_hue: float = 15.0, min_saturation: float = 0.6, min_value: int = 150) -> tuple[np.ndarray, np.ndarray]:
+    """Find saturated red pixels of HSV-thresholded image.
+
+    Uses the same HSV value channel as `binarize` - maximum of RGB channels - with saturation (max - min) / max,
+    and hue of pixels with red maximum 60 * (G - B) / (max - min) degrees.
+    Red channel of red pixel is its value, and saturation caps the other two channels at (1 - min_saturation) * 255,
+    so only pixels passing these bounds are converted to HSV.
+
+    Args:
+        region (np.ndarray): HxWx3 image
+        max_hue (float, optional): max deviation of hue from pure red in degrees. Defaults to 15.0.
+        min_saturation (float, optional): minimal saturation. Defaults to 0.6.
+        min_value (int, optional): minimal value (brightness). Defaults to 150.
+
+    Returns:
+        np.ndarray: y coordinates of red pixels
+        np.ndarray: x coordinates of red pixels
+    """
+    cap = int((1 - min_saturation) * 255)
+    candidates = (region[..., 0] >= min_value) & (region[..., 1] <= cap) & (region[..., 2] <= cap)
+    ys, xs = np.divmod(np.flatnonzero(candidates), region.shape[1])
+    rgb = region[ys, xs].astype(np.int16)
+    r, g, b = rgb[:, 0], rgb[:, 1], rgb[:, 2]
+    delta = r - np.minimum(g, b)
+    keep = (r >= g) & (r >= b) & (delta >= min_saturation * r) & (np.abs(g - b) * 60 <= delta * max_hue)
+    return ys[keep], xs[keep]
+
+
+def find_red_cross(frame: np.ndarray, origin: tuple[int, int], size: tuple[int, int], min_pixels: int = 150,
+                   min_gap: int = 4, significance: float = 0.5) -> tuple[bool, float]:
+    """Look for a big red X - the sign of enemy out of basic attack reach - in the region around targeting reticle.
+
+    1. Find saturated red pixels. See `red_pixels`.
+    2. Label connected components the same way as enemy chevrons in `find_enemies`.
+    3. Score every component of at least `min_pixels` pixels by how well it fits two diagonals of its bounding box:
+       square bounding box, pixels close to the diagonals, and both diagonals equally filled.
+
+    Only the X found is trusted. No X is reported with zero confidence - the marker may come in another shade, or place,
+    so the caller has to check it some other way.
+
+    Args:
+        frame (np.ndarray): HxWx3 screenshot
+        origin (tuple[int, int]): origin of the region around targeting reticle
+        size (tuple[int, int]): size of the region
+        min_pixels (int, optional): minimal number of pixels of the X. Defaults to 150.
+        min_gap (int, optional): minimal gap in pixels between two components. Defaults to 4.
+        significance (float, optional): minimal score of the X. Defaults to 0.5.
+
+    Returns:
+        bool: True - red X is on screen
+        float: confidence in [0, 1], 0 - no X found
+    """
+    ys, xs = red_pixels(crop(frame, origin, size))
+    if len(xs) < min_pixels:
+        return False, 0.0
+
+    label = _label(xs, ys, min_gap)
+    order = np.argsort(label, kind="stable")
+    label, xs, ys = label[order], xs[order], ys[order]
+    starts = np.flatnonzero(np.concatenate(([True], np.diff(label) != 0)))
+    n = len(starts)
+    counts = np.diff(np.append(starts, len(label)))
+    left, right = np.minimum.reduceat(xs, starts), np.maximum.reduceat(xs, starts)
+    top, bottom = np.minimum.reduceat(ys, starts), np.maximum.reduceat(ys, starts)
+    width = (right - left + 1).astype(np.float32)
+    height = (bottom - top + 1).astype(np.float32)
+
+    # Pixel coordinates relative to the bounding box of its component
+    u = (xs - left[label]) / np.maximum(width[label] - 1, 1)
+    v = (ys - top[label]) / np.maximum(height[label] - 1, 1)
+    main, anti = np.abs(u - v), np.abs(u + v - 1)
+    distance = np.bincount(label, weights=np.minimum(main, anti), minlength=n) / counts
+    on_main = np.bincount(label, weights=main < anti, minlength=n)
+    balance = np.minimum(on_main, counts - on_main) / np.maximum(np.maximum(on_main, counts - on_main), 1)
+    aspect = np.minimum(width, height) / np.maximum(width, height)
+
+    score = aspect * balance * np.clip(1.0 - distance / 0.3, 0.0, 1.0)
+    score[counts < min_pixels] = 0.0
+    best = float(score.max())
+    if best >= significance:
+        return True, best
+    return False, 0.0
@@ -0,0 +1,119 @@
+from enum import Enum
+
+import numpy as np
+
+from vision.frames import as_image
+from vision.turn_order import as_frame, color_match, crop, find_enemies
+
+
+class ScreenState(Enum):
+    """What is on screen."""
+    PLAYER_TURN = "player_turn"     # Command menu with Attack and Defend is active
+    ENEMY_TURN = "enemy_turn"       # Combat is going on, but it's not agent's turn
+    VICTORY = "victory"             # RESULTS panel
+    DEFEAT = "defeat"               # GAME OVER menu with Retry
+    OUT_OF_COMBAT = "out_of_combat" # Field
+    MENU = "menu"                   # Full-screen menu, or item sub-menu. Target selection of attacks, and arts is PLAYER_TURN
+
+
+# Signature -> (origin, size, color, max_distance, min_fraction). Pixel signature is on screen if at least
+# `min_fraction` of its region is within `max_distance` from `color`. All values are in pixels of 1920x1080 frame
+SIGNATURES: dict[str, tuple[tuple[int, int], tuple[int, int], tuple[int, int, int], int, float]] = {
+    # Orange S-Break orb, top right. Bright on player turn, incl. target selection of attacks, and arts
+    "s_break": ((1650, 65), (25, 25), (229, 128, 32), 40, 0.3),
+    # Same orb dimmed by item sub-menu
+    "s_break_dimmed": ((1650, 65), (25, 25), (114, 64, 16), 20, 0.3),
+    # Light blue "RESULTS" title of victory panel
+    "results": ((1450, 385), (185, 27), (128, 188, 211), 50, 0.15),
+    # Teal highlight of "Retry" item of GAME OVER menu
+    "retry": ((900, 735), (240, 25), (14, 80, 73), 20, 0.5),
+    # Crimson banner of character screen
+    "status": ((1700, 70), (180, 40), (121, 15, 51), 25, 0.5),
+}
+
+# VLM answer -> screen state. `VLMWrapper.classify` checks the labels don't share a first token in any case
+VLM_LABELS: dict[str, ScreenState] = {
+    "attack": ScreenState.PLAYER_TURN,
+    "enemy": ScreenState.ENEMY_TURN,
+    "results": ScreenState.VICTORY,
+    "retry": ScreenState.DEFEAT,
+    "field": ScreenState.OUT_OF_COMBAT,
+    "menu": ScreenState.MENU,
+}
+
+VLM_PROMPT = """What is on screen? Answer with one word:
+attack - menu items "Attack" and "Defend" are on screen;
+enemy - combat is going on, character's turn order is at the top of the screen, but there is no "Attack" menu;
+results - word "RESULTS" is on screen;
+retry - menu with item "Retry" is on screen;
+field - characters walk around, no combat, and no menu;
+menu - full-screen game menu."""
+
+
+def match_signatures(frame: np.ndarray) -> dict[str, float]:
+    """Get fraction of matching pixels of every signature. See `SIGNATURES`."""
+    fractions = {}
+    for name, (origin, size, color, max_distance, _) in SIGNATURES.items():
+        ys, _, _ = color_match(crop(frame, origin, size), color, max_distance)
+        fractions[name] = len(ys) / (size[0] * size[1])
+    return fractions
+
+
+def classify_screen(image: object, turn_order_origin: tuple[int, int] = (660, 45), turn_order_size: tuple[int, int] = (900, 140),
+                    enemy_color: tuple[int, int, int] = (219, 0, 72), enemy_max_distance: int = 10) -> ScreenState | None:
+    """Classify the screen by pixel signatures.
+
+    1. GAME OVER menu, RESULTS panel, and character screen are told apart by their unique colors.
+    2. S-Break orb is on screen only on player turn. It's dimmed when item sub-menu is open - MENU.
+       It stays bright on target selection of attacks, and arts - PLAYER_TURN.
+    3. Enemy portraits in turn-order region mean combat is going on.
+
+    Args:
+        image (object): Frame, PIL.Image, or HxWx3 ndarray screenshot
+        turn_order_origin (tuple[int, int], optional): origin of turn-order region. Defaults to (660, 45).
+        turn_order_size (tuple[int, int], optional): size of turn-order region. Defaults to (900, 140).
+        enemy_color (tuple[int, int, int], optional): shade of enemy chevron. Defaults to (219, 0, 72).
+        enemy_max_distance (int, optional): per-channel tolerance to `enemy_color`. Defaults to 10.
+
+    Returns:
+        ScreenState | None: screen state, or None if no signature matched - ask VLM
+    """
+    frame = as_frame(image)
+    fractions = match_signatures(frame)
+    found = {name for name, fraction in fractions.items() if fraction >= SIGNATURES[name][4]}
+
+    if "retry" in found:
+        return ScreenState.DEFEAT
+    if "results" in found:
+        return ScreenState.VICTORY
+    if "status" in found or "s_break_dimmed" in found:
+        return ScreenState.MENU
+    if "s_break" in found:
+        return ScreenState.PLAYER_TURN
+    n_enemies, _ = find_enemies(frame, turn_order_origin, turn_order_size, enemy_color, enemy_max_distance)
+    if n_enemies:
+        return ScreenState.ENEMY_TURN
+    return None
+
+
+def get_screen_state(image: object, vlm: object, budget: str = "full_frame_classifier", **kwargs) -> tuple[ScreenState, float]:
+    """Classify the screen by pixel signatures, and fall back to a single VLM query.
+
+    Args:
+        image (object): Frame, PIL.Image, HxWx3 ndarray, or path/to/screenshot.png
+        vlm (object): VLMWrapper
+        budget (str, optional): pixel budget of VLM query. Defaults to "full_frame_classifier".
+        **kwargs: turn-order region parameters. See `classify_screen`
+
+    Returns:
+        ScreenState: screen state
+        float: confidence. 1.0 for pixel signatures, probability of the answer for VLM
+    """
+    if isinstance(image, str):
+        image = as_image(image)
+    state = classify_screen(image, **kwargs)
+    if state is not None:
+        return state, 1.0
+
+    label, probability = vlm.classify(text=VLM_PROMPT, image=as_image(image), labels=tuple(VLM_LABELS), budget=budget)
+    return VLM_LABELS[label], probability
@@ -0,0 +1,189 @@
+import numpy as np
+
+
+def as_frame(image: object) -> np.ndarray:
+    """Get RGB ndarray view of the screenshot.
+
+    Args:
+        image (object): PIL.Image, vision.frames.Frame, or HxWx3 ndarray
+
+    Returns:
+        np.ndarray: HxWx3 uint8 array
+    """
+    if isinstance(image, np.ndarray):
+        return image
+    if hasattr(image, "pixels"):
+        return image.pixels
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    return np.asarray(image)
+
+
+def crop(frame: np.ndarray, origin: tuple[int, int], size: tuple[int, int]) -> np.ndarray:
+    """Crop region out of the frame without copying.
+
+    Args:
+        frame (np.ndarray): HxWx3 frame
+        origin (tuple[int, int]): origin point in pixels (left, top)
+        size (tuple[int, int]): size of cropping area in pixels (width, height)
+
+    Returns:
+        np.ndarray: view into the frame
+    """
+    return frame[origin[1]:origin[1] + size[1], origin[0]:origin[0] + size[0]]
+
+
+def color_match(region: np.ndarray, color: tuple[int, int, int], max_distance: int = 10) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Find pixels within Chebyshev distance `max_distance` from `color`.
+
+    The most selective channel (the one with value closest to 0 or 255) is thresholded over the whole region,
+    the rest of channels are tested only on the surviving candidates.
+
+    Args:
+        region (np.ndarray): HxWx3 image
+        color (tuple[int, int, int]): needle color
+        max_distance (int, optional): per-channel color tolerance. Defaults to 10.
+
+    Returns:
+        np.ndarray: y coordinates of matched pixels
+        np.ndarray: x coordinates of matched pixels
+        np.ndarray: Chebyshev distance of matched pixels to the `color`
+    """
+    order = sorted(range(3), key=lambda c: -abs(color[c] - 127.5))
+    plane = region[..., order[0]]
+    lo = color[order[0]] - max_distance
+    hi = color[order[0]] + max_distance
+    if lo <= 0:
+        candidates = plane <= hi
+    elif hi >= 255:
+        candidates = plane >= lo
+    else:
+        candidates = (plane >= lo) & (plane <= hi)
+    ys, xs = np.divmod(np.flatnonzero(candidates), region.shape[1])
+
+    for channel in order[1:]:
+        values = region[ys, xs, channel]
+        keep = (values >= color[channel] - max_distance) & (values <= color[channel] + max_distance)
+        ys, xs = ys[keep], xs[keep]
+
+    distance = np.abs(region[ys, xs].astype(np.int16) - np.array(color, dtype=np.int16)).max(axis=-1)
+    return ys, xs, distance
+
+
+def _label(major: np.ndarray, minor: np.ndarray, min_gap: int) -> np.ndarray:
+    """Label points into groups along `major` axis, then split every group along `minor` axis.
+
+    Two neighbouring points belong to the same group if the gap between them is less than `min_gap`.
+
+    Returns:
+        np.ndarray: group label of every point
+    """
+    order = np.argsort(major, kind="stable")
+    column_label = np.empty_like(order)
+    column_label[order] = np.concatenate(([0], np.cumsum(np.diff(major[order]) >= min_gap)))
+
+    order = np.lexsort((minor, column_label))
+    new_group = (np.diff(column_label[order]) != 0) | (np.diff(minor[order]) >= min_gap)
+    label = np.empty_like(order)
+    label[order] = np.concatenate(([0], np.cumsum(new_group)))
+    return label
+
+
+def find_enemies(frame: np.ndarray, origin: tuple[int, int], size: tuple[int, int],
+                 enemy_color: tuple[int, int, int] = (219, 0, 72), max_distance: int = 10,
+                 min_gap: int = 10) -> tuple[int, list[tuple[int, int]]]:
+    """Find enemy portraits in turn-order region by the shade of their red chevron.
+
+    1. Mask pixels close to `enemy_color`.
+    2. Cluster mask columns - chevrons of two portraits are at least `min_gap` pixels apart.
+    3. Label connected components inside every column cluster by splitting its rows the same way.
+    4. Anchor each component at its best matching pixel, leftmost then topmost - the tip of the chevron.
+
+    Args:
+        frame (np.ndarray): HxWx3 screenshot
+        origin (tuple[int, int]): origin of turn-order region
+        size (tuple[int, int]): size of turn-order region
+        enemy_color (tuple[int, int, int], optional): shade of enemy chevron. Defaults to (219, 0, 72).
+        max_distance (int, optional): per-channel color tolerance. Defaults to 10.
+        min_gap (int, optional): minimal distance in pixels between two portraits. Defaults to 10.
+
+    Returns:
+        int: number of enemies
+        list[tuple[int, int]]: enemy portrait coordinates on turn order image region, left to right
+    """
+    region = crop(frame, origin, size)
+    ys, xs, distance = color_match(region, enemy_color, max_distance)
+    if len(xs) == 0:
+        return (0, [])
+
+    # Connected components: column clusters split by row gaps
+    label = _label(xs, ys, min_gap)
+    # Anchor: best match, then leftmost, then topmost pixel of every component
+    order = np.lexsort((ys, xs, distance, label))
+    first = order[np.concatenate(([True], np.diff(label[order]) != 0))]
+    first = first[np.argsort(xs[first], kind="stable")]
+    enemy_coords = [(int(x), int(y)) for x, y in zip(xs[first], ys[first])]
+
+    return (len(enemy_coords), enemy_coords)
+
+
+def binarize(region: np.ndarray, threshold: int = 127) -> np.ndarray:
+    """Produce black-and-white image out of HSV value channel of the region.
+
+    Same result as thresholding S and V channels, merging them back with zero hue and taking red channel of RGB:
+    with zero hue red channel equals V, and V of HSV is the maximum of RGB channels.
+
+    Args:
+        region (np.ndarray): HxWx3 image
+        threshold (int, optional): minimal brightness of white pixel. Defaults to 127.
+
+    Returns:
+        np.ndarray: HxW uint8 image with values 0 or 255
+    """
+    return (region.max(axis=-1) >= threshold).astype(np.uint8) * 255
+
+
+def find_selected_target(frame: np.ndarray, origin: tuple[int, int], enemy_coords: list[tuple[int, int]],
+                         origin_delta: tuple[int, int] = (20, 0), size: int = 10, significance: float = 0.5,
+                         threshold: int = 127) -> tuple[int, float]:
+    """Get index of enemy coordinates that correspond to currently selected enemy.
+
+    Selected portrait is highlighted, so the `size`x`size` square above-right of its chevron is bright.
+    All squares are gathered from the frame with a single fancy-indexing operation.
+
+    Args:
+        frame (np.ndarray): HxWx3 screenshot
+        origin (tuple[int, int]): origin of turn-order region
+        enemy_coords (list[tuple[int, int]]): list of enemy (x,y) coordinates in turn-order region
+        origin_delta (tuple[int, int], optional): offset of the square relative to the chevron. Defaults to (20, 0).
+        size (int, optional): size of the square. Defaults to 10.
+        significance (float, optional): minimal proportion of white pixels. Defaults to 0.5.
+        threshold (int, optional): minimal brightness of white pixel. Defaults to 127.
+
+    Returns:
+        tuple[int,float]: Index of enemy_coords, level of confidence. Index is len(enemy_coords) + 1 if none is selected.
+    """
+    if not enemy_coords:
+        return len(enemy_coords) + 1, 1.0
+
+    coords = np.asarray(enemy_coords, dtype=np.intp)
+    step = np.arange(size, dtype=np.intp)
+    rows = (origin[1] + coords[:, 1] + origin_delta[1] - size)[:, None] + step
+    cols = (origin[0] + coords[:, 0] + origin_delta[0])[:, None] + step
+    # Pixels outside of the frame are black
+    valid = ((rows >= 0) & (rows < frame.shape[0]))[:, :, None] & ((cols >= 0) & (cols < frame.shape[1]))[:, None, :]
+    squares = frame[rows.clip(0, frame.shape[0] - 1)[:, :, None], cols.clip(0, frame.shape[1] - 1)[:, None, :]]
+    white = (squares.max(axis=-1) >= threshold) & valid
+    proportions = white.reshape(len(coords), -1).mean(axis=-1)
+
+    # If it's perfectly white - it is selected enemy
+    perfect = np.flatnonzero(proportions == 1.0)
+    if len(perfect):
+        return int(perfect[0]), 1.0
+
+    # Otherwise - enemy index with maximum proportion of white
+    enemy_id = int(np.argmax(proportions))
+    if proportions[enemy_id] < significance:
+        return len(enemy_coords) + 1, 1.0
+
+    return enemy_id, float(proportions[enemy_id])